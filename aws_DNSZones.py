@@ -1,7 +1,18 @@
+import argparse
 import csv
 import json
-import boto3
-import subprocess
+from functools import partial
+
+from aws_cache import add_cache_arguments, cache, open_cache
+from aws_cassette import add_cassette_arguments, cassette, open_cassette
+from aws_clients import get_client, pool
+from aws_csv_writer import StreamingCsvWriter
+from aws_domain_trie import normalize_domain, suffix_trie, zone_trie
+from aws_fanout import Task, add_workers_argument, run_tasks
+from aws_metrics import add_metrics_arguments, metrics, write_run_metrics
+from aws_paginate import iter_resource_record_sets
+from aws_ratelimit import run_cli
+from aws_records import project_account_zone
 
 def get_account_ids_from_json(json_filename):
     with open(json_filename, 'r') as json_file:
@@ -12,58 +23,106 @@ def get_all_hosted_zones(account_id, profile, json_writer):
     try:
         hosted_zones_data = []
         # Get all hosted zones for the specified profile
-        result = subprocess.run(['aws', 'route53', 'list-hosted-zones', '--profile', profile], capture_output=True, text=True)
+        result = run_cli(profile, None, 'route53', ['aws', 'route53', 'list-hosted-zones', '--profile', profile], capture_output=True, text=True)
         hosted_zones = json.loads(result.stdout)['HostedZones']
         for zone in hosted_zones:
-            hosted_zone_data = {
-                'AccountID': account_id,
-                'HostedZoneId': zone['Id'],
-                'HostedZoneName': zone['Name'],
-                'PrivateZone': zone['Config']['PrivateZone'] if 'Config' in zone else False
-            }
-            
-
-            hosted_zones_data.append(hosted_zone_data)
+            hosted_zones_data.append(project_account_zone(account_id, profile, zone))
         # return [zone['HostedZoneName'].split('/')[-1] for zone in hosted_zones]
         json_writer.extend(hosted_zones_data)
 
     except Exception as e:
         print(f"Error getting all hosted zones for profile {profile}: {e}")
+        metrics.record_dropped(profile, None, 'route53:list-hosted-zones (cli)', e)
         return []
 
-def compare_hosted_zone_with_csv(hosted_zones, csv_filename, exclude_domain='gmail.com'):
-    dns_names_to_compare = set()
+def list_account_hosted_zones(account_id, profile):
+    hosted_zones_data = []
+    get_all_hosted_zones(account_id, profile, hosted_zones_data)
+    return hosted_zones_data
+
+def map_domains_to_zones(zone_index, csv_filename, exclude_suffixes=('gmail.com',)):
+    # Yields (domain, zones) for every CSV domain at or under a hosted zone,
+    # where zones are the hosted zones of its most specific parent. A domain
+    # is skipped when it is, or is under, one of exclude_suffixes.
+    if isinstance(exclude_suffixes, str):
+        exclude_suffixes = [exclude_suffixes]
+    excluded = suffix_trie(exclude_suffixes)
+
     with open(csv_filename, 'r') as csv_file:
         csv_reader = csv.DictReader(csv_file)
         for row in csv_reader:
-            domain_name = row['domain_name'].lower()
-            if exclude_domain not in domain_name:
-                dns_names_to_compare.add(domain_name)
+            domain_name = normalize_domain(row['domain_name'])
+            if not domain_name or excluded.matches(domain_name):
+                continue
+            zones = zone_index.longest_match(domain_name)
+            if zones:
+                yield domain_name, zones
+
+def compare_hosted_zone_with_csv(hosted_zones, csv_filename, exclude_suffixes=('gmail.com',), domain_map_writer=None):
+    matched_zone_ids = set()
+    for domain_name, zones in map_domains_to_zones(zone_trie(hosted_zones), csv_filename, exclude_suffixes):
+        for zone in zones:
+            matched_zone_ids.add((zone.account_id, zone.zone_id))
+            if domain_map_writer is not None:
+                domain_map_writer.writerow({
+                    'domain_name': domain_name,
+                    'AccountID': zone.account_id,
+                    'HostedZoneId': zone.zone_id,
+                    'HostedZoneName': zone.name
+                })
+
+    matched_zones = [zone for zone in hosted_zones if (zone.account_id, zone.zone_id) in matched_zone_ids]
 
-    matched_zones = []
-
-    for zone in hosted_zones: 
-        if zone['HostedZoneName'].lower() in dns_names_to_compare:
-            matched_zones.append(zone)
-    
     return matched_zones
 
-def export_dkim_cname_records_to_csv(account_id, hosted_zone_id, csv_writer, account_name):
-    session = boto3.Session(profile_name=account_name)
-    route53_client = session.client('route53')
-
+def iter_dkim_records(route53_client, hosted_zone_id, zone_name):
+    # Route53 lists records ordered by their labels read right to left, so all
+    # <selector>._domainkey.<zone> records form one contiguous range. Seek to
+    # its start and stop at the first record past it instead of listing the zone.
+    range_name = '_domainkey.' + zone_name.lower().rstrip('.') + '.'
+    records = iter_resource_record_sets(route53_client, hosted_zone_id, StartRecordName=range_name, StartRecordType='CNAME')
+    for record in records:
+        record_name = record['Name'].lower()
+        if record_name != range_name and not record_name.endswith('.' + range_name):
+            return
+        yield record
+
+def find_dkim_cname_records(account_id, hosted_zone_id, zone_name, account_name, full_scan=False):
+    route53_client = get_client(account_name, 'route53')
+
+    rows = []
     try:
-        response = route53_client.list_resource_record_sets(HostedZoneId=hosted_zone_id)
-        print(response)
-        dkim_cname_records = [record['Name'] for record in response['ResourceRecordSets'] if record['Type'] == 'CNAME' and 'dkim' in record['Name'].lower()]
+        if full_scan:
+            # The original scan: every record, keeping CNAMEs named like DKIM keys
+            for record in iter_resource_record_sets(route53_client, hosted_zone_id):
+                if record['Type'] == 'CNAME' and 'dkim' in record['Name'].lower():
+                    rows.append({'AccountID': account_id, 'HostedZoneId': hosted_zone_id, 'DKIM_CNAME_Record': record['Name']})
+        else:
+            for record in iter_dkim_records(route53_client, hosted_zone_id, zone_name):
+                if record['Type'] == 'CNAME':
+                    rows.append({'AccountID': account_id, 'HostedZoneId': hosted_zone_id, 'DKIM_CNAME_Record': record['Name']})
 
-        for record in dkim_cname_records:
-            csv_writer.writerow({'AccountID': account_id, 'HostedZoneId': hosted_zone_id, 'DKIM_CNAME_Record': record})
-    
     except Exception as e:
         print(f"Error exporting DKIM CNAME records in hosted zone {hosted_zone_id}: {e}")
+        metrics.record_dropped(account_name, None, 'route53:ListResourceRecordSets', e, hosted_zone_id)
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export DKIM CNAME records for hosted zones listed in dkim.csv')
+    add_workers_argument(parser)
+    parser.add_argument('--full-scan', action='store_true',
+                        help="List every record of each zone and keep CNAMEs containing 'dkim', instead of reading only _domainkey records")
+    parser.add_argument('--exclude-suffix', action='append', dest='exclude_suffixes',
+                        help='Skip dkim.csv domains at or under this domain; repeatable (default: gmail.com)')
+    parser.add_argument('--domain-map', metavar='CSV',
+                        help='Also write every dkim.csv domain with the hosted zone it falls under to CSV')
+    add_cache_arguments(parser)
+    add_cassette_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    open_cache(args.cache, args.no_cache, args.refresh)
+    open_cassette(args.record, args.replay, args.replay_latency)
 
-def main():
     json_filename = 'aws_accounts.json'
     csv_filename = 'dkim.csv'
     csv_filename_dkim = 'dkim_cname_records.csv'
@@ -73,20 +132,39 @@ def main():
 
     all_load_balancers = []
 
-    for account in account_ids:
-        account_name = (account[0])
-        account_id = (account[1])
-        get_all_hosted_zones(account_id, account_name, json_data)
+    tasks = (
+        Task(account[1], None, 'route53', 'list_hosted_zones', partial(list_account_hosted_zones, account[1], account[0]))
+        for account in account_ids
+    )
+    for task, hosted_zones_data in run_tasks(tasks, args.workers):
+        json_data.extend(hosted_zones_data)
 
-    matched_zones = compare_hosted_zone_with_csv(json_data, csv_filename)
+    exclude_suffixes = args.exclude_suffixes or ['gmail.com']
+    if args.domain_map:
+        with StreamingCsvWriter(args.domain_map, ['domain_name', 'AccountID', 'HostedZoneId', 'HostedZoneName']) as domain_map_writer:
+            matched_zones = compare_hosted_zone_with_csv(json_data, csv_filename, exclude_suffixes, domain_map_writer)
+    else:
+        matched_zones = compare_hosted_zone_with_csv(json_data, csv_filename, exclude_suffixes)
 
     print("Matched Hosted Zones:")
 
-    for zone in matched_zones:
-        print(f"AccountID: {zone['AccountID']}, HostedZoneId: {zone['HostedZoneId']}, HostedZoneName: {zone['HostedZoneName']}, PrivateZone: {zone['PrivateZone']}")
-        export_dkim_cname_records_to_csv(zone['AccountID'], zone['HostedZoneId'], csv_filename_dkim, account_name)
+    # Each zone is read with the profile of the account that owns it
+    tasks = (
+        Task(zone.account_id, None, 'route53', 'list_resource_record_sets',
+             partial(find_dkim_cname_records, zone.account_id, zone.zone_id, zone.name, zone.profile, args.full_scan),
+             zone.zone_id)
+        for zone in matched_zones
+    )
+    with StreamingCsvWriter(csv_filename_dkim, ['AccountID', 'HostedZoneId', 'DKIM_CNAME_Record']) as csv_writer:
+        for zone, (task, rows) in zip(matched_zones, run_tasks(tasks, args.workers)):
+            print(f"AccountID: {zone.account_id}, HostedZoneId: {zone.zone_id}, HostedZoneName: {zone.name}, PrivateZone: {zone.private}")
+            csv_writer.writerows(rows)
 
     print(f"Data Exported to {csv_filename_dkim}")
+    pool.print_stats()
+    cache.print_stats()
+    cassette.print_stats()
+    write_run_metrics('aws_DNSZones', args.metrics_dir, args.profile_report)
 
 if __name__ == "__main__":
     main()
@@ -1,79 +1,143 @@
+import argparse
 import csv
-import boto3
 import json
+from functools import partial
+
+from aws_cache import add_cache_arguments, cache, open_cache
+from aws_cassette import add_cassette_arguments, cassette, open_cassette
+from aws_clients import get_client, pool
+from aws_credentials import add_credentials_arguments, credentials, open_credentials
+from aws_csv_writer import StreamingCsvWriter
+from aws_metrics import add_metrics_arguments, write_run_metrics
+from aws_fanout import Task, add_workers_argument, run_tasks
+from aws_paginate import iter_network_acls, iter_reservations
+
+# EC2 accepts at most 200 values in one filter
+FILTER_BATCH_SIZE = 200
 
 def get_account_ids_from_json(json_filename):
     with open(json_filename, 'r') as json_file:
         data = json.load(json_file)
     return data
 
-def get_vpc_id_from_acl(acl_id, region, account_name):
-    session = boto3.Session(profile_name=account_name)
-    ec2_client = session.client('ec2', region_name=region)
-
-    acl_info = ec2_client.describe_network_acls(NetworkAclIds=[acl_id])
-    if 'NetworkAcls' in acl_info and acl_info['NetworkAcls']:
-        vpc_id = acl_info['NetworkAcls'][0]['VpcId']
-        return vpc_id
-    else:
-        return None
-    
-def check_vpc_usage(vpc_id, region, account_name):
-    session = boto3.Session(profile_name=account_name)
-    ec2_client = session.client('ec2', region_name=region)
-
-    Instances = ec2_client.describe_instances(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}])['Reservations']
-    return bool(Instances)
-
-def export_vpcs_to_csv(account_name, acl_id, used_vpcs, region, output_file):
-
-    fieldnames = ['Account Name', 'ACL ID', 'Used VPC', 'Region']
-    with open(output_file, 'a', newline='') as csv_file:    
-        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-
-        for vpc in used_vpcs:
-            writer.writerow({'Account Name': account_name, 'ACL ID': acl_id, 'Used VPC': vpc, 'Region': region})
-
-if __name__ == "__main__":
-
-    input_csv_file_path = 'input.csv'
-    output_csv_file_path = 'output.csv'
-    json_filename = 'aws_accounts.json'
-
-    account_ids = get_account_ids_from_json(json_filename)
-
+def batches(values, size=FILTER_BATCH_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def get_vpc_ids_for_acls(acl_ids, region, account_name):
+    # One filtered listing per batch of ACLs instead of one call per ACL.
+    # ACLs that no longer exist are simply missing from the result.
+    ec2_client = get_client(account_name, 'ec2', region)
+
+    vpc_ids = {}
+    for batch in batches(acl_ids):
+        for acl in iter_network_acls(ec2_client, Filters=[{'Name': 'network-acl-id', 'Values': batch}]):
+            vpc_ids[acl['NetworkAclId']] = acl['VpcId']
+    return vpc_ids
+
+def get_used_vpcs(vpc_ids, region, account_name):
+    # VPCs with at least one instance, from one instance listing per batch of
+    # VPCs instead of one call per ACL
+    ec2_client = get_client(account_name, 'ec2', region)
+
+    used_vpcs = set()
+    for batch in batches(vpc_ids):
+        for reservation in iter_reservations(ec2_client, Filters=[{'Name': 'vpc-id', 'Values': batch}]):
+            for instance in reservation['Instances']:
+                used_vpcs.add(instance.get('VpcId'))
+    return used_vpcs
+
+FIELDNAMES = ['Account Name', 'ACL ID', 'Used VPC', 'Region']
+
+def export_vpcs_to_csv(account_name, acl_id, used_vpcs, region, writer):
+    for vpc in used_vpcs:
+        writer.writerow({'Account Name': account_name, 'ACL ID': acl_id, 'Used VPC': vpc, 'Region': region})
+
+def check_acls(acl_ids, region, account_name):
+    vpc_ids = get_vpc_ids_for_acls(acl_ids, region, account_name)
+    used_vpcs = get_used_vpcs(sorted(set(vpc_ids.values())), region, account_name)
+    return vpc_ids, used_vpcs
+
+def read_acl_rows(input_csv_file_path):
+    # Account ID -> [(ACL ID, region)] in file order, from a single pass over the CSV
+    acl_rows = {}
+    with open(input_csv_file_path, 'r') as csv_file:
+        csv_reader = csv.DictReader(csv_file)
+        for row in csv_reader:
+            acl_rows.setdefault(row['Account ID'], []).append((row['Resource ID'], row['Region']))
+    return acl_rows
+
+def acl_tasks(account_ids, acl_rows):
+    # One task per (account, region); the key ties each back to its account
     for account in account_ids:
         account_name = (account[0])
         account_ID = (account[1])
 
-        with open(input_csv_file_path, 'r') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            for row in csv_reader:
-                acl_id = row['Resource ID']
-                account_id = row['Account ID']
-                region = row['Region']
+        rows = acl_rows.get(account_ID, [])
+        for region in dict.fromkeys(region for _, region in rows):
+            acl_ids = list(dict.fromkeys(acl_id for acl_id, acl_region in rows if acl_region == region))
+            yield Task(account_name, region, 'ec2', 'describe_network_acls', partial(check_acls, acl_ids, region, account_name),
+                       account_ID)
 
-                if account_id == account_ID:
+def report_account(account_name, rows, resolved, writer):
+    # Rows are reported in input.csv order once every region of the account is resolved
+    for acl_id, region in rows:
+        vpc_ids, used_vpcs = resolved[region]
+        vpc_id = vpc_ids.get(acl_id)
 
-                    vpc_id = get_vpc_id_from_acl(acl_id, region, account_name)
+        if vpc_id:
+            if vpc_id in used_vpcs:
 
-                    if vpc_id:
-                        if check_vpc_usage(vpc_id, region, account_name):
+                export_vpcs_to_csv(account_name, acl_id, [vpc_id], region, writer)
 
-                            export_vpcs_to_csv(account_name, acl_id, [vpc_id], region, output_csv_file_path)
+                print(f"ACL {acl_id} in account {account_name} in region {region} is assocaited with used VPC {vpc_id}.")
 
-                            print(f"ACL {acl_id} in account {account_name} in region {region} is assocaited with used VPC {vpc_id}.")
+            else:
+                print(f"ACL {acl_id} in account {account_name} in region {region} is assocaited with unused VPC {vpc_id}.")
 
-                        else:
-                            print(f"ACL {acl_id} in account {account_name} in region {region} is assocaited with unused VPC {vpc_id}.")
-
-                    else:
-                        print(f"Could not find VPC associated with ACL {acl_id} in account {account_name} in region {region}.")
-
-    print("Exported Used VPCs to:", output_csv_file_path)
+        else:
+            print(f"Could not find VPC associated with ACL {acl_id} in account {account_name} in region {region}.")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check which network ACLs in input.csv belong to VPCs with instances')
+    add_workers_argument(parser)
+    add_cache_arguments(parser)
+    add_cassette_arguments(parser)
+    add_credentials_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    open_cache(args.cache, args.no_cache, args.refresh)
+    open_cassette(args.record, args.replay, args.replay_latency)
 
+    input_csv_file_path = 'input.csv'
+    output_csv_file_path = 'output.csv'
+    json_filename = 'aws_accounts.json'
 
+    account_ids = get_account_ids_from_json(json_filename)
+    acl_rows = read_acl_rows(input_csv_file_path)
+    if not open_credentials([account[0] for account in account_ids], args.sso_login):
+        return
+
+    # output.csv has always been appended to without a header row
+    with StreamingCsvWriter(output_csv_file_path, FIELDNAMES, append=True, write_header=False) as writer:
+        current = None
+        resolved = {}
+        for task, result in run_tasks(acl_tasks(account_ids, acl_rows), args.workers):
+            if current is not None and (task.account, task.key) != current:
+                report_account(current[0], acl_rows[current[1]], resolved, writer)
+                resolved = {}
+            current = (task.account, task.key)
+            resolved[task.region] = result
+
+        if current is not None:
+            report_account(current[0], acl_rows[current[1]], resolved, writer)
 
+    print("Exported Used VPCs to:", output_csv_file_path)
+    pool.print_stats()
+    cache.print_stats()
+    cassette.print_stats()
+    credentials.print_stats()
+    write_run_metrics('aws_acl_uses_check', args.metrics_dir, args.profile_report)
 
-    
\ No newline at end of file
+if __name__ == "__main__":
+    main()
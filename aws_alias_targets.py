@@ -0,0 +1,159 @@
+import re
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+from aws_clients import get_client
+from aws_dns_graph import normalize_dns_name
+from aws_paginate import iter_buckets, iter_classic_load_balancers, iter_distributions, iter_domain_names
+
+# What a record's CNAME or alias value was found to point at
+Target = namedtuple('Target', ['type', 'arn'])
+
+REGION_PATTERN = re.compile(r'(?:^|[.-])((?:us-gov|[a-z]{2})-[a-z]+-\d)\.')
+
+
+class TargetResolver(ABC):
+    # One kind of alias target. fetch lists every target of that kind in one
+    # account (and region, when regional) with a single paginated listing and
+    # yields (key, arn); key(record_name, dns_name) is what a record's value
+    # is looked up by. wants() keeps accounts from listing kinds of target
+    # none of their records can point at.
+    target_type = None
+    service = None
+    operation = None
+    regional = True
+    # Listed for every account up front instead of only where a record needs it
+    eager = False
+
+    @abstractmethod
+    def wants(self, dns_name):
+        pass
+
+    def region(self, dns_name):
+        if not self.regional:
+            return None
+        match = REGION_PATTERN.search(dns_name)
+        return match.group(1) if match else None
+
+    def key(self, record_name, dns_name):
+        return dns_name
+
+    @abstractmethod
+    def fetch(self, inventory, region):
+        pass
+
+
+def is_elb_name(dns_name):
+    # ALB and classic: name-id.<region>.elb.amazonaws.com; NLB: name-id.elb.<region>.amazonaws.com
+    return '.elb.' in dns_name and '.amazonaws.com' in dns_name
+
+
+class ElbV2Resolver(TargetResolver):
+    target_type = 'elbv2'
+    service = 'elbv2'
+    operation = 'elbv2:DescribeLoadBalancers'
+    eager = True
+
+    def wants(self, dns_name):
+        return is_elb_name(dns_name)
+
+    def fetch(self, inventory, region):
+        # Shares the load balancer listing with the other reports
+        for lb in inventory.load_balancers(region):
+            yield lb.dns_name, lb.arn
+
+
+class ClassicElbResolver(TargetResolver):
+    # Classic load balancer names look like ALB names, so this comes after
+    # ElbV2Resolver and is only listed for names it did not know
+    target_type = 'elb'
+    service = 'elb'
+    operation = 'elb:DescribeLoadBalancers'
+
+    def wants(self, dns_name):
+        return is_elb_name(dns_name)
+
+    def fetch(self, inventory, region):
+        elb_client = get_client(inventory.account.profile, self.service, region)
+        for lb in iter_classic_load_balancers(elb_client):
+            arn = f"arn:aws:elasticloadbalancing:{region}:{inventory.account.account_id}:loadbalancer/{lb['LoadBalancerName']}"
+            yield lb['DNSName'], arn
+
+
+class CloudFrontResolver(TargetResolver):
+    target_type = 'cloudfront'
+    service = 'cloudfront'
+    operation = 'cloudfront:ListDistributions'
+    regional = False
+
+    def wants(self, dns_name):
+        return dns_name.endswith('.cloudfront.net')
+
+    def fetch(self, inventory, region):
+        cloudfront_client = get_client(inventory.account.profile, self.service)
+        for distribution in iter_distributions(cloudfront_client):
+            yield distribution['DomainName'], distribution['ARN']
+
+
+class S3WebsiteResolver(TargetResolver):
+    # Website endpoints name the bucket either in the CNAME value
+    # (bucket.s3-website-<region>.amazonaws.com) or, for aliases to the bare
+    # endpoint, as the record name itself
+    target_type = 's3'
+    service = 's3'
+    operation = 's3:ListBuckets'
+    regional = False
+
+    def wants(self, dns_name):
+        return 's3-website' in dns_name
+
+    def key(self, record_name, dns_name):
+        if dns_name.startswith('s3-website'):
+            return normalize_dns_name(record_name)
+        return dns_name.split('.s3-website')[0]
+
+    def fetch(self, inventory, region):
+        s3_client = get_client(inventory.account.profile, self.service)
+        for bucket in iter_buckets(s3_client):
+            yield bucket['Name'], f"arn:aws:s3:::{bucket['Name']}"
+
+
+class ApiGatewayResolver(TargetResolver):
+    # Regional custom domain names; edge-optimized ones are CloudFront names
+    # owned by API Gateway and stay unmatched
+    target_type = 'apigateway'
+    service = 'apigateway'
+    operation = 'apigateway:GetDomainNames'
+
+    def wants(self, dns_name):
+        return '.execute-api.' in dns_name
+
+    def fetch(self, inventory, region):
+        apigateway_client = get_client(inventory.account.profile, self.service, region)
+        for domain in iter_domain_names(apigateway_client):
+            if domain.get('regionalDomainName'):
+                yield domain['regionalDomainName'], f"arn:aws:apigateway:{region}::/domainnames/{domain['domainName']}"
+
+
+def default_resolvers():
+    return [ElbV2Resolver(), ClassicElbResolver(), CloudFrontResolver(), S3WebsiteResolver(), ApiGatewayResolver()]
+
+
+def find_target(index_for, resolvers, regions, record_name, dns_name):
+    # The first resolver, in order, whose listing holds the value. index_for
+    # (resolver, region) returns that listing as {key: Target}, fetching it
+    # on first use; regional resolvers only look in the given regions.
+    dns_name = normalize_dns_name(dns_name)
+    if not dns_name:
+        return None
+    for resolver in resolvers:
+        if not resolver.wants(dns_name):
+            continue
+        region = resolver.region(dns_name)
+        if resolver.regional and region not in regions:
+            continue
+        key = resolver.key(record_name, dns_name)
+        target = index_for(resolver, region).get(key) if key else None
+        if target is not None:
+            return target
+    return None
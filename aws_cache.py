@@ -0,0 +1,234 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+import subprocess
+import threading
+import time
+import zlib
+
+from botocore.awsrequest import AWSResponse
+
+DEFAULT_CACHE_PATH = 'aws_cache.db'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Seconds a response stays fresh, per operation. Operations not listed here
+# are never cached. The CLI names match aws_metrics.run_command. Hosted zone
+# and record set listings are deliberately absent: a cached copy would hide
+# record changes from the exports and from the snapshot's fingerprints and
+# deltas, which the snapshot already avoids refetching cheaply.
+CACHE_TTLS = {
+    'elbv2:DescribeLoadBalancers': 1800,
+    'elb:DescribeLoadBalancers': 1800,
+    'cloudfront:ListDistributions': 1800,
+    's3:ListBuckets': 1800,
+    'apigateway:GetDomainNames': 1800,
+    'elbv2:describe-load-balancers (cli)': 1800
+}
+
+
+def json_default(value):
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f'{type(value).__name__} is not cacheable')
+
+
+def json_object_hook(value):
+    if '__datetime__' in value:
+        return datetime.datetime.fromisoformat(value['__datetime__'])
+    return value
+
+
+def cli_operation(command):
+    return f'{command[1]}:{command[2]} (cli)' if len(command) > 2 and command[0] == 'aws' else command[0]
+
+
+class ResponseCache:
+    # Parsed API responses on disk, keyed by (account, region, operation,
+    # params), so scripts run minutes apart share one set of listings. Several
+    # processes can use one file: SQLite's WAL lets readers run alongside the
+    # single writer and the timeout waits out the other processes' writes.
+    # Nothing is read or written until open() is called.
+    def __init__(self, ttls=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttls = dict(CACHE_TTLS, **(ttls or {}))
+        self.max_bytes = max_bytes
+        self.path = None
+        self.refresh = False
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # Profile -> account ID, so scripts reaching one account through
+        # different profiles share its entries. Kept in the file too, so a
+        # script that only knows profiles finds what the others stored.
+        self.accounts = {}
+        self._lock = threading.Lock()
+        self._db = None
+
+    def open(self, path=DEFAULT_CACHE_PATH, refresh=False):
+        self.close()
+        db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.executescript('''
+            CREATE TABLE IF NOT EXISTS responses (
+                cache_key TEXT PRIMARY KEY, account TEXT, region TEXT, operation TEXT,
+                stored_at REAL, expires_at REAL, accessed_at REAL, size INTEGER, body BLOB);
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+            CREATE TABLE IF NOT EXISTS accounts (profile TEXT PRIMARY KEY, account_id TEXT);
+        ''')
+        with self._lock:
+            self._db = db
+            self.path = path
+            self.refresh = refresh
+            self.accounts.update(db.execute('SELECT profile, account_id FROM accounts'))
+
+    @property
+    def enabled(self):
+        return self._db is not None
+
+    def link_account(self, profile, account_id):
+        account_id = str(account_id)
+        with self._lock:
+            if self.accounts.get(profile) == account_id:
+                return
+            self.accounts[profile] = account_id
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO accounts VALUES (?, ?)', (profile, account_id))
+
+    def key(self, account, region, operation, params):
+        payload = json.dumps([str(account or ''), region or '', operation, params], sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def get(self, cache_key):
+        # None for a miss, an expired entry, or any lookup under --refresh
+        if not self.enabled:
+            return None
+        if self.refresh:
+            self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT body FROM responses WHERE cache_key = ? AND expires_at > ?', (cache_key, now)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE responses SET accessed_at = ? WHERE cache_key = ?', (now, cache_key))
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]), object_hook=json_object_hook)
+
+    def put(self, cache_key, account, region, operation, value):
+        if not self.enabled:
+            return
+        try:
+            body = zlib.compress(json.dumps(value, default=json_default).encode())
+        except TypeError:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (cache_key, str(account or ''), region or '', operation, now, now + self.ttls[operation], now,
+                     len(body), body)
+                )
+                self._evict(now)
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def _evict(self, now):
+        # Expired entries go first, then the least recently used until the
+        # file is back under 90% of max_bytes
+        self.evicted += self._db.execute('DELETE FROM responses WHERE expires_at <= ?', (now,)).rowcount
+        (total,) = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes * 0.9
+        evict = []
+        for cache_key, size in self._db.execute('SELECT cache_key, size FROM responses ORDER BY accessed_at'):
+            if excess <= 0:
+                break
+            evict.append((cache_key,))
+            excess -= size
+        self._db.executemany('DELETE FROM responses WHERE cache_key = ?', evict)
+        self.evicted += len(evict)
+
+    def instrument(self, client, account):
+        # A fresh entry short-circuits the call before anything is sent, the
+        # same way botocore's Stubber does; successful responses are stored
+        # on the way back.
+        region = client.meta.region_name
+        service = client.meta.service_model.service_name
+
+        def keyed(params, model, context, **_):
+            operation = f'{service}:{model.name}'
+            if self.enabled and operation in self.ttls:
+                context['cache_account'] = self.accounts.get(account, account)
+                context['cache_key'] = self.key(context['cache_account'], region, operation, params)
+                context['cache_operation'] = operation
+
+        def lookup(context, **_):
+            if 'cache_key' not in context:
+                return None
+            parsed = self.get(context['cache_key'])
+            if parsed is None:
+                return None
+            context['cache_hit'] = True
+            return AWSResponse('https://cache', 200, {}, None), parsed
+
+        def store(http_response, parsed, context, **_):
+            if 'cache_key' not in context or context.get('cache_hit'):
+                return
+            if http_response.status_code == 200 and 'Error' not in parsed:
+                value = {key: item for key, item in parsed.items() if key != 'ResponseMetadata'}
+                self.put(context['cache_key'], context['cache_account'], region, context['cache_operation'], value)
+
+        client.meta.events.register('before-parameter-build', keyed)
+        client.meta.events.register_first('before-call', lookup)
+        client.meta.events.register('after-call', store)
+        return client
+
+    def run_command(self, account, region, command, run):
+        # run() is the uncached CLI call; only successful text output is kept
+        operation = cli_operation(command)
+        if not self.enabled or operation not in self.ttls:
+            return run()
+        account = self.accounts.get(account, account)
+        cache_key = self.key(account, region, operation, command)
+        cached = self.get(cache_key)
+        if cached is not None:
+            return subprocess.CompletedProcess(command, 0, cached['stdout'], cached['stderr'])
+        result = run()
+        if result.returncode == 0 and isinstance(result.stdout, str):
+            self.put(cache_key, account, region, operation, {'stdout': result.stdout, 'stderr': result.stderr or ''})
+        return result
+
+    def print_stats(self):
+        if self.enabled:
+            print(f"Cache {self.path}: {self.hits} responses served locally, {self.misses} fetched, {self.evicted} evicted")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+            self._db = None
+
+
+cache = ResponseCache()
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH,
+                        help=f'SQLite cache of load balancer, CloudFront, S3 and API Gateway listings shared between scripts; '
+                             f'hosted zones and records are always listed fresh (default: {DEFAULT_CACHE_PATH})')
+    parser.add_argument('--no-cache', action='store_true', help='Call the API for everything and leave the cache alone')
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached responses but store the fresh ones')
+
+
+def open_cache(path=DEFAULT_CACHE_PATH, no_cache=False, refresh=False):
+    if not no_cache:
+        cache.open(path, refresh)
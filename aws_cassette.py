@@ -0,0 +1,197 @@
+import argparse
+import json
+import sqlite3
+import subprocess
+import threading
+import time
+import zlib
+
+from boto3.session import Session
+from botocore.awsrequest import AWSResponse
+
+from aws_cache import cache, cli_operation, json_default, json_object_hook
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+class Cassette:
+    # Every AWS response of a run, boto3 and CLI alike, in one SQLite file
+    # indexed by (account, region, operation, params). Recording keeps the
+    # last response seen for each key along with how long it took; replaying
+    # serves them without a session, credentials or the network, and a call
+    # that was never recorded fails instead of reaching AWS.
+    def __init__(self):
+        self.path = None
+        self.mode = None
+        self.latency_scale = 0.0
+        self.recorded = 0
+        self.replayed = 0
+        self.missed = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+    def open(self, path, mode, latency_scale=0.0):
+        self.close()
+        if mode == 'replay':
+            # Read only, so a typo in the path fails instead of replaying nothing
+            db = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        else:
+            db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=OFF')
+            db.executescript('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    cache_key TEXT PRIMARY KEY, account TEXT, region TEXT, operation TEXT,
+                    status INTEGER, seconds REAL, body BLOB);
+                CREATE INDEX IF NOT EXISTS responses_operation ON responses (account, operation);
+            ''')
+        with self._lock:
+            self._db = db
+            self.path = path
+            self.mode = mode
+            self.latency_scale = latency_scale
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def session_factory(self, profile_name=None, **kwargs):
+        # Replayed calls never reach AWS, so profiles do not need to exist here
+        return Session(aws_access_key_id='replay', aws_secret_access_key='replay',
+                       region_name=kwargs.get('region_name') or 'us-east-1')
+
+    def put(self, cache_key, account, region, operation, status, seconds, value):
+        body = zlib.compress(json.dumps(value, default=json_default).encode())
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (cache_key, str(account or ''), region or '', operation, status, seconds, body)
+            )
+            self.recorded += 1
+
+    def get(self, cache_key, operation):
+        with self._lock:
+            row = self._db.execute('SELECT status, seconds, body FROM responses WHERE cache_key = ?', (cache_key,)).fetchone()
+            if row is None:
+                self.missed += 1
+            else:
+                self.replayed += 1
+        if row is None:
+            raise CassetteMiss(f'{operation} was not recorded in {self.path}')
+        status, seconds, body = row
+        if self.latency_scale:
+            time.sleep(seconds * self.latency_scale)
+        return status, json.loads(zlib.decompress(body), object_hook=json_object_hook)
+
+    def instrument(self, client, account):
+        region = client.meta.region_name
+        service = client.meta.service_model.service_name
+
+        def keyed(params, model, context, **_):
+            if self.mode is not None:
+                operation = f'{service}:{model.name}'
+                context['cassette_key'] = cache.key(account, region, operation, params)
+                context['cassette_operation'] = operation
+                context['cassette_started'] = time.perf_counter()
+
+        def replay(context, **_):
+            if not self.replaying or 'cassette_key' not in context:
+                return None
+            status, parsed = self.get(context['cassette_key'], context['cassette_operation'])
+            return AWSResponse('https://cassette', status, {}, None), parsed
+
+        def record(http_response, parsed, context, **_):
+            # Errors are recorded too, so a replay fails the same way
+            if not self.recording or 'cassette_key' not in context:
+                return
+            value = {key: item for key, item in parsed.items() if key != 'ResponseMetadata'}
+            self.put(context['cassette_key'], account, region, context['cassette_operation'], http_response.status_code,
+                     time.perf_counter() - context['cassette_started'], value)
+
+        client.meta.events.register('before-parameter-build', keyed)
+        # Ahead of aws_cache and any other stub
+        client.meta.events.register_first('before-call', replay)
+        client.meta.events.register('after-call', record)
+        return client
+
+    def run_command(self, account, region, command, run):
+        # run() is the real CLI call; only text output is recorded
+        if self.mode is None:
+            return run()
+        operation = cli_operation(command)
+        cache_key = cache.key(account, region, operation, command)
+        if self.replaying:
+            try:
+                status, value = self.get(cache_key, operation)
+            except CassetteMiss as e:
+                return subprocess.CompletedProcess(command, 255, '', str(e))
+            return subprocess.CompletedProcess(command, status, value['stdout'], value['stderr'])
+
+        started = time.perf_counter()
+        result = run()
+        if isinstance(result.stdout, str):
+            self.put(cache_key, account, region, operation, result.returncode, time.perf_counter() - started,
+                     {'stdout': result.stdout, 'stderr': result.stderr or ''})
+        return result
+
+    def operations(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT operation, COUNT(*), SUM(LENGTH(body)), SUM(seconds) FROM responses GROUP BY operation ORDER BY operation'
+            ).fetchall()
+
+    def print_stats(self):
+        if self.recording:
+            print(f"Cassette {self.path}: {self.recorded} responses recorded")
+        elif self.replaying:
+            print(f"Cassette {self.path}: {self.replayed} responses replayed, {self.missed} not recorded")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+            self._db = None
+            self.mode = None
+
+
+cassette = Cassette()
+
+
+def add_cassette_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--record', metavar='CASSETTE', help='Record every AWS response of this run to CASSETTE')
+    group.add_argument('--replay', metavar='CASSETTE',
+                       help='Serve AWS responses from CASSETTE instead of AWS; calls it does not hold fail')
+    parser.add_argument('--replay-latency', type=float, metavar='SCALE', default=0.0,
+                        help='Sleep SCALE times the recorded latency of each replayed call (default: 0, CPU speed)')
+
+
+def open_cassette(record=None, replay=None, latency_scale=0.0):
+    if record:
+        cassette.open(record, 'record')
+    elif replay:
+        cassette.open(replay, 'replay', latency_scale)
+        # Replayed responses must not end up in the shared response cache
+        cache.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarize the responses held in a cassette')
+    parser.add_argument('cassette')
+    args = parser.parse_args(argv)
+
+    cassette.open(args.cassette, 'replay')
+    print(f"{'operation':<44}{'responses':>10}{'bytes':>12}{'recorded (s)':>14}")
+    for operation, count, nbytes, seconds in cassette.operations():
+        print(f"{operation:<44}{count:>10}{nbytes:>12}{seconds:>14.2f}")
+    cassette.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import threading
+
+import boto3
+
+from aws_cache import cache
+from aws_cassette import cassette
+from aws_credentials import credentials
+from aws_metrics import metrics
+from aws_ratelimit import CLIENT_CONFIG, limiter
+
+
+class ClientPool:
+    # boto3 sessions are not thread-safe but the clients they create are, so
+    # sessions are only touched under the lock and clients are shared freely.
+    def __init__(self, session_factory=None, api_metrics=None, rate_limiter=None, response_cache=None, api_cassette=None,
+                 sso_credentials=None):
+        self.session_factory = session_factory or boto3.session.Session
+        # Every client is instrumented, rate limited, cached and recorded
+        # (once the cache or cassette is opened), and SSO profiles share role
+        # credentials once they are opened; pass api_metrics, rate_limiter,
+        # response_cache, api_cassette or sso_credentials to use others
+        self.metrics = api_metrics or metrics
+        self.limiter = rate_limiter or limiter
+        self.cache = response_cache or cache
+        self.cassette = api_cassette or cassette
+        self.credentials = sso_credentials or credentials
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._clients = {}
+        self.sessions_created = 0
+        self.sessions_reused = 0
+        self.clients_created = 0
+        self.clients_reused = 0
+
+    def get_session(self, profile):
+        with self._lock:
+            return self._get_session(profile)
+
+    def _get_session(self, profile):
+        session = self._sessions.get(profile)
+        if session is not None:
+            self.sessions_reused += 1
+            return session
+
+        if self.cassette.replaying:
+            session = self.cassette.session_factory(profile_name=profile)
+        else:
+            session = self.credentials.attach(self.session_factory(profile_name=profile), profile)
+        # Resolve credentials once here; every client built from this session
+        # shares the resolved (and auto-refreshing) credentials.
+        session.get_credentials()
+        self._sessions[profile] = session
+        self.sessions_created += 1
+        return session
+
+    def get_client(self, profile, service, region=None):
+        key = (profile, service, region)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.clients_reused += 1
+                return client
+
+            session = self._get_session(profile)
+            client = session.client(service, region_name=region, config=CLIENT_CONFIG)
+            self.metrics.instrument(client, profile)
+            self.limiter.instrument(client, profile)
+            self.cassette.instrument(client, profile)
+            self.cache.instrument(client, profile)
+            self._clients[key] = client
+            self.clients_created += 1
+            return client
+
+    def account_id(self, profile):
+        # The account a profile reaches, which the cache and region map key
+        # by. A link stored by an earlier script answers without a call;
+        # a replay has neither open, so it never asks.
+        account_id = self.cache.accounts.get(profile)
+        if account_id is not None or self.cassette.replaying:
+            return account_id or profile
+        try:
+            account_id = self.get_client(profile, 'sts').get_caller_identity()['Account']
+        except Exception as e:
+            print(f"Error getting the account ID for profile {profile}: {e}")
+            return profile
+        self.cache.link_account(profile, account_id)
+        return account_id
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._clients.clear()
+            self.sessions_created = 0
+            self.sessions_reused = 0
+            self.clients_created = 0
+            self.clients_reused = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions_created': self.sessions_created,
+                'sessions_reused': self.sessions_reused,
+                'clients_created': self.clients_created,
+                'clients_reused': self.clients_reused
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Sessions created: {stats['sessions_created']}, reused: {stats['sessions_reused']}; "
+              f"Clients created: {stats['clients_created']}, reused: {stats['clients_reused']}")
+
+
+pool = ClientPool()
+
+
+def get_client(profile, service, region=None):
+    return pool.get_client(profile, service, region)
+
+
+def get_account_id(profile):
+    return pool.account_id(profile)
@@ -0,0 +1,605 @@
+import argparse
+import json
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+from functools import partial
+
+from aws_alias_targets import Target, default_resolvers, find_target
+from aws_cache import add_cache_arguments, cache, open_cache
+from aws_cassette import add_cassette_arguments, cassette, open_cassette
+from aws_clients import get_client, pool
+from aws_credentials import add_credentials_arguments, credentials, open_credentials
+from aws_dns_graph import DnsGraph, Resolution, record_target
+from aws_fanout import Task, add_workers_argument, run_tasks
+from aws_journal import JobJournal
+from aws_metrics import add_metrics_arguments, metrics, write_run_metrics
+from aws_output import add_output_arguments, open_writer, output_path
+from aws_paginate import iter_hosted_zones, iter_load_balancers, iter_network_acls, iter_resource_record_sets
+from aws_records import project_load_balancer, project_network_acl, project_record, project_zone
+from aws_regions import add_region_map_arguments, open_region_map, region_map
+from aws_snapshot import DELTA_FIELDNAMES, add_snapshot_max_age_argument, open_snapshot
+
+# account_id labels the account in outputs, the snapshot and the journal;
+# profile is the AWS profile its clients are built from.
+Account = namedtuple('Account', ['account_id', 'profile'])
+
+DEFAULT_PROFILE_TEMPLATE = 'st-security-ro-{account_id}'
+
+# The regions aws_loadbalancer.py and aws_networkACL.py have always covered
+LOAD_BALANCER_REGIONS = ['us-east-2', 'us-east-1', 'us-west-1', 'us-west-2']
+NETWORK_ACL_REGIONS = ['us-east-2', 'ap-northeast-3', 'eu-west-1', 'eu-north-1', 'ca-central-1', 'ap-northeast-2', 'ap-south-1',
+                       'us-east-1', 'us-west-1', 'eu-west-3', 'sa-east-1', 'us-west-2', 'ap-southeast-1', 'eu-central-1',
+                       'ap-southeast-2', 'ap-northeast-1', 'eu-west-2']
+
+
+def fetch_load_balancers(account, region):
+    if not region_map.should_list(account.account_id, account.profile, 'elbv2:DescribeLoadBalancers', region):
+        return []
+    elbv2_client = get_client(account.profile, 'elbv2', region)
+
+    load_balancers = []
+    try:
+        for lb in iter_load_balancers(elbv2_client):
+            load_balancers.append(project_load_balancer(lb))
+        region_map.record(account.account_id, 'elbv2:DescribeLoadBalancers', region, len(load_balancers))
+    except Exception as e:
+        print(f"Error getting load balancers for account {account.profile} in {region}: {e}")
+        metrics.record_dropped(account.account_id, region, 'elbv2:DescribeLoadBalancers', e)
+    return load_balancers
+
+
+def fetch_network_acls(account, region):
+    if not region_map.should_list(account.account_id, account.profile, 'ec2:DescribeNetworkAcls', region):
+        return []
+    ec2_client = get_client(account.profile, 'ec2', region)
+
+    try:
+        network_acls = [project_network_acl(acl) for acl in iter_network_acls(ec2_client)]
+        region_map.record(account.account_id, 'ec2:DescribeNetworkAcls', region, len(network_acls))
+        return network_acls
+    except Exception as e:
+        print(f"Error Describing network ACLs in account {account.account_id}, region {region}: {e}")
+        metrics.record_dropped(account.account_id, region, 'ec2:DescribeNetworkAcls', e)
+        return []
+
+
+def fetch_records(account, zone, snapshot=None, delta=None, full=False):
+    route53_client = get_client(account.profile, 'route53')
+
+    try:
+        if snapshot is None:
+            records = iter_resource_record_sets(route53_client, zone['Id'])
+        else:
+            records = snapshot.iter_records(
+                account.account_id, zone, lambda: iter_resource_record_sets(route53_client, zone['Id']), delta, full
+            )
+        # The snapshot needs the raw records; nothing after it does
+        for record in records:
+            yield project_record(record)
+    except Exception as e:
+        print(f"Error getting records for hosted zone {zone['Id']} in account {account.profile}: {e}")
+        metrics.record_dropped(account.account_id, None, 'route53:ListResourceRecordSets', e, zone['Id'])
+
+
+def fetch_targets(inventory, resolver, region):
+    # {key: Target} for one kind of alias target in one account and region
+    try:
+        return {key.lower().rstrip('.'): Target(resolver.target_type, arn) for key, arn in resolver.fetch(inventory, region)}
+    except Exception as e:
+        print(f"Error listing {resolver.target_type} targets for account {inventory.account.profile} in {region or 'all regions'}: {e}")
+        metrics.record_dropped(inventory.account.account_id, region, resolver.operation, e)
+        return {}
+
+
+class Inventory:
+    # Everything fetched for one account during a crawl. Each listing is
+    # fetched once, by whichever task asks for it first, and shared by every
+    # report; a task asking while another is fetching waits for that result.
+    def __init__(self, account, snapshot=None, full=False):
+        self.account = account
+        cache.link_account(account.profile, account.account_id)
+        self.snapshot = snapshot
+        self.full = full
+        # [(HostedZone, [DnsRecord])], or None when the zones could not be listed
+        self.zones = None
+        self.delta = []
+        self._lock = threading.Lock()
+        self._listings = {}
+
+    def _once(self, key, fetch):
+        with self._lock:
+            future = self._listings.get(key)
+            owner = future is None
+            if owner:
+                future = self._listings[key] = Future()
+
+        if owner:
+            try:
+                future.set_result(fetch())
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def load_balancers(self, region):
+        return self._once(('elbv2', region), partial(fetch_load_balancers, self.account, region))
+
+    def network_acls(self, region):
+        return self._once(('ec2', region), partial(fetch_network_acls, self.account, region))
+
+    def targets(self, resolver, region=None):
+        return self._once(('targets', resolver.target_type, region), partial(fetch_targets, self, resolver, region))
+
+    def crawl_zones(self):
+        route53_client = get_client(self.account.profile, 'route53')
+        try:
+            zones = list(iter_hosted_zones(route53_client))
+        except Exception as e:
+            print(f"Error listing the hosted zones for account {self.account.profile}: {e}")
+            metrics.record_dropped(self.account.account_id, None, 'route53:ListHostedZones', e)
+            return
+
+        self.zones = [
+            (project_zone(zone), list(fetch_records(self.account, zone, self.snapshot, self.delta, self.full)))
+            for zone in zones
+        ]
+        # Only a complete listing can tell which zones were deleted
+        if self.snapshot is not None:
+            self.delta.extend(self.snapshot.retire_zones(self.account.account_id, {zone['Id'] for zone in zones}))
+
+
+def filter_records(records):
+    # Filter Type A records with alias settings or CNAME values
+    for record in records:
+        if (record.type == 'A' and record.alias) or record.type == 'CNAME':
+            yield record
+
+
+def print_record(profile, record, show_stdout=False):
+    record_type = record.type
+    record_name = record.name
+
+    if record_type == 'A' and record.alias:
+        # If it's an A record with AliasTarget, use DNSName as the value
+        record_value = record.value
+    elif record.alias or record.value is None:
+        record_value = 'N/A'
+    else:
+        record_value = record.value
+
+    if show_stdout:
+        # Print record to stdout with a new line character
+        print(f"Profile: {profile}, Type: {record_type}, Name: {record_name}, Value: {record_value}\n")
+
+    return profile, record_type, record_name, record_value
+
+
+class Report:
+    # One output file rendered from each account's inventory. A report asks
+    # for hosted zones (uses_zones) and/or per-region listings (listings, as
+    # (service, region) pairs), and only covers the given accounts. A
+    # cross_account report only writes final_rows, once every account is in.
+    filename = None
+    fieldnames = []
+    uses_zones = False
+    cross_account = False
+
+    def __init__(self, account_ids=None, filename=None):
+        self.account_ids = None if account_ids is None else {str(account_id) for account_id in account_ids}
+        self.filename = filename or self.filename
+        self.listings = []
+        self.writer = None
+
+    def covers(self, account):
+        return self.account_ids is None or str(account.account_id) in self.account_ids
+
+    def after_zones(self, inventory):
+        pass
+
+    def rows(self, inventory):
+        return []
+
+    def final_rows(self):
+        return []
+
+
+class RecordsReport(Report):
+    # new.py's output.csv: A and CNAME records with the ARN and type of the
+    # load balancer, distribution, bucket or API they point at. Each kind of
+    # target is listed once per account, and per region for regional ones,
+    # only when one of the account's records needs it.
+    filename = 'output.csv'
+    fieldnames = ['AccountID', 'HostedZoneName', 'RecordName', 'RecordType', 'LoadBalancerARNs', 'TargetType']
+    uses_zones = True
+
+    def __init__(self, regions, account_ids=None, filename=None, resolvers=None):
+        super().__init__(account_ids, filename)
+        self.regions = list(regions)
+        self.resolvers = resolvers or default_resolvers()
+
+    def find_target(self, inventory, record_name, value):
+        return find_target(inventory.targets, self.resolvers, self.regions, record_name, value)
+
+    def after_zones(self, inventory):
+        # Fetch every listing the records need here, in the zone task, so
+        # rows() only reads memoized listings
+        for zone, records in inventory.zones or []:
+            for record in records:
+                if record.type in ['A', 'CNAME']:
+                    self.find_target(inventory, record.name, record.value)
+
+    def rows(self, inventory):
+        for zone, records in inventory.zones or []:
+            for record in records:
+                if record.type in ['A', 'CNAME']:
+                    target = self.find_target(inventory, record.name, record.value)
+                    entry = {
+                        'AccountID': inventory.account.account_id,
+                        'HostedZoneName': zone.name,
+                        'RecordName': record.value,
+                        'RecordType': record.type,
+                        'LoadBalancerARNs': target.arn if target else None,
+                        'TargetType': target.type if target else None
+                    }
+                    print(entry)
+                    yield entry
+
+
+class ResolutionReport(Report):
+    # CNAME and alias records followed through every account's zones to the
+    # AWS resource, plain record or outside name they end at
+    filename = 'dns_resolution.csv'
+    fieldnames = ['AccountID', 'HostedZoneName', 'RecordName', 'RecordType', 'Target', 'FinalTarget', 'Depth', 'Status',
+                  'TargetType', 'TargetARN']
+    uses_zones = True
+    cross_account = True
+
+    def __init__(self, regions, account_ids=None, filename=None, resolvers=None, workers=1):
+        super().__init__(account_ids, filename)
+        self.regions = list(regions)
+        self.resolvers = resolvers or default_resolvers()
+        self.workers = workers
+        # Chains can end at another account's load balancers, so every
+        # account's are listed, records or not
+        self.listings = [('elbv2', region) for region in self.regions]
+        # (target type, region) -> {key: Target} across every account
+        self.indexes = {}
+        self.graph = DnsGraph(partial(find_target, self.index_for, self.resolvers, self.regions, None))
+        self.accounts = []
+        self.records = []
+
+    def index_for(self, resolver, region):
+        return self.indexes.get((resolver.target_type, region), {})
+
+    def add_index(self, target_type, region, index):
+        merged = self.indexes.setdefault((target_type, region), {})
+        for key, target in index.items():
+            merged.setdefault(key, target)
+
+    def rows(self, inventory):
+        account_id = inventory.account.account_id
+        self.accounts.append(inventory.account)
+        for zone, records in inventory.zones or []:
+            self.graph.add_zone(zone.name)
+            for record in records:
+                self.graph.add_record(record)
+                if record_target(record) is not None:
+                    self.records.append((account_id, zone.name, record))
+        for resolver in self.resolvers:
+            if resolver.eager:
+                for region in self.regions if resolver.regional else [None]:
+                    self.add_index(resolver.target_type, region, inventory.targets(resolver, region))
+        return []
+
+    def list_lazy_targets(self):
+        # Chains still ending outside our zones may end at a distribution,
+        # bucket or other non-eager target. List those kinds, in just the
+        # regions the names point at, in every account.
+        needed = {}
+        for _, _, record in self.records:
+            resolution = self.graph.resolve(record_target(record))
+            if resolution.status != 'external':
+                continue
+            for resolver in self.resolvers:
+                if resolver.eager or not resolver.wants(resolution.target):
+                    continue
+                region = resolver.region(resolution.target)
+                if resolver.regional and region not in self.regions:
+                    continue
+                needed[(resolver.target_type, region)] = resolver
+
+        tasks = (
+            Task(account.account_id, region, resolver.service, resolver.operation,
+                 partial(fetch_targets, Inventory(account), resolver, region), (resolver.target_type, region))
+            for account in self.accounts
+            for (_, region), resolver in needed.items()
+        )
+        for task, index in run_tasks(tasks, self.workers):
+            self.add_index(*task.key, index)
+        self.graph.reset()
+
+    def final_rows(self):
+        self.list_lazy_targets()
+        statuses = {}
+        for account_id, zone_name, record in self.records:
+            target = record_target(record)
+            resolution = self.graph.resolve(target)
+            if resolution.status == 'external' and resolution.depth == 0:
+                # S3 website aliases name their bucket with the record name
+                resource = find_target(self.index_for, self.resolvers, self.regions, record.name, target)
+                if resource is not None:
+                    resolution = Resolution(resolution.target, resource, 0, 'resource')
+            statuses[resolution.status] = statuses.get(resolution.status, 0) + 1
+            yield {
+                'AccountID': account_id,
+                'HostedZoneName': zone_name,
+                'RecordName': record.name,
+                'RecordType': record.type,
+                'Target': target,
+                'FinalTarget': resolution.target,
+                # The record's own hop counts towards the depth
+                'Depth': resolution.depth + 1,
+                'Status': resolution.status,
+                'TargetType': resolution.resource.type if resolution.resource else '',
+                'TargetARN': resolution.resource.arn if resolution.resource else ''
+            }
+        print(f"Resolved {len(self.records)} CNAME and alias records: "
+              + ', '.join(f'{count} {status}' for status, count in sorted(statuses.items())))
+
+
+class Route53ZonesReport(Report):
+    # aws_r53export.py's route53zones.csv: alias A and CNAME records by profile
+    filename = 'route53zones.csv'
+    fieldnames = ['Profile', 'Record Type', 'Record Name', 'Record Value']
+    uses_zones = True
+
+    def __init__(self, account_ids=None, filename=None, show_stdout=False):
+        super().__init__(account_ids, filename)
+        self.show_stdout = show_stdout
+
+    def rows(self, inventory):
+        profile = inventory.account.profile
+        print(f"Profile: {profile}")
+        print("Processing Records...")
+        for zone, records in inventory.zones or []:
+            for record in filter_records(records):
+                yield print_record(profile, record, self.show_stdout)
+        print("Completed\n")
+
+
+class LoadBalancerReport(Report):
+    # aws_loadbalancer.py's all_load_balancer.csv
+    filename = 'all_load_balancer.csv'
+    fieldnames = ['AccountID', 'LoadBalancerArn', 'LoadBalancerName', 'DNSName', 'Type']
+
+    def __init__(self, regions=LOAD_BALANCER_REGIONS, account_ids=None, filename=None):
+        super().__init__(account_ids, filename)
+        self.regions = list(regions)
+        self.listings = [('elbv2', region) for region in self.regions]
+
+    def rows(self, inventory):
+        for region in self.regions:
+            load_balancers = inventory.load_balancers(region)
+            for lb in load_balancers:
+                yield {
+                    # DescribeLoadBalancers has no account field; this column has always been empty
+                    'AccountID': '',
+                    'LoadBalancerName': lb.name,
+                    'LoadBalancerArn': lb.arn,
+                    'DNSName': lb.dns_name,
+                    'Type': lb.type,
+                }
+            print(f"Exported {len(load_balancers)} load balancers for account {inventory.account.profile} in {region}")
+
+
+class NetworkAclReport(Report):
+    # aws_networkACL.py's network ACL export
+    filename = 'network_acls.csv'
+    fieldnames = ['AccountID', 'Region', 'NetworkAclID', 'IsDefault']
+
+    def __init__(self, regions=NETWORK_ACL_REGIONS, account_ids=None, filename=None):
+        super().__init__(account_ids, filename)
+        self.regions = list(regions)
+        self.listings = [('ec2', region) for region in self.regions]
+
+    def rows(self, inventory):
+        for region in self.regions:
+            for acl in inventory.network_acls(region):
+                entry = {
+                    'AccountID': inventory.account.account_id,
+                    'Region': region,
+                    'NetworkAclID': acl.id,
+                    'IsDefault': acl.is_default
+                }
+                print(entry)
+                yield entry
+
+
+def crawl_zones(inventory, reports):
+    inventory.crawl_zones()
+    for report in reports:
+        report.after_zones(inventory)
+
+
+def crawl_tasks(accounts, reports, inventories, snapshot=None, full=False):
+    # Every listing an account's reports need, as (account, region) tasks.
+    # An account's tasks are yielded together, so its inventory is complete
+    # once the last of them has come back.
+    for account in accounts:
+        covering = [report for report in reports if report.covers(account)]
+        inventory = Inventory(account, snapshot, full)
+
+        tasks = []
+        zone_reports = [report for report in covering if report.uses_zones]
+        if zone_reports:
+            tasks.append(Task(account.account_id, None, 'route53', 'list_resource_record_sets',
+                              partial(crawl_zones, inventory, zone_reports)))
+
+        listings = dict.fromkeys(listing for report in covering for listing in report.listings)
+        for service, region in listings:
+            fetch = inventory.load_balancers if service == 'elbv2' else inventory.network_acls
+            operation = 'describe_load_balancers' if service == 'elbv2' else 'describe_network_acls'
+            tasks.append(Task(account.account_id, region, service, operation, partial(fetch, region)))
+
+        if tasks:
+            inventories[account.account_id] = inventory
+            yield from tasks
+
+
+def write_account(inventory, reports, delta_writer, journal, writers):
+    for report in reports:
+        if report.covers(inventory.account):
+            report.writer.writerows(report.rows(inventory))
+    if delta_writer is not None:
+        delta_writer.writerows(inventory.delta)
+    journal.mark_done(('account', inventory.account.account_id), *writers)
+
+
+def collect(accounts, reports, workers=1, journal_path='collector.journal', restart=False, snapshot=None, full=False,
+            delta_filename=None):
+    # Crawls each account once for every report and writes each report as
+    # its accounts complete. Returns (finished, delta_writer); finished is
+    # False when the run was stopped and can be resumed from the journal.
+    journal = JobJournal(journal_path, restart=restart)
+    journal.install_signal_handlers()
+
+    writers = []
+    for report in reports:
+        report.writer = open_writer(report.filename, report.fieldnames, resume_offset=journal.resume_offset(report.filename))
+        writers.append(report.writer)
+    delta_writer = None
+    if snapshot is not None and delta_filename:
+        delta_writer = open_writer(delta_filename, DELTA_FIELDNAMES, resume_offset=journal.resume_offset(delta_filename))
+        writers.append(delta_writer)
+
+    inventories = {}
+    accounts = journal.pending(accounts, lambda account: ('account', account.account_id))
+    try:
+        current = None
+        for task, _ in run_tasks(crawl_tasks(accounts, reports, inventories, snapshot, full), workers):
+            if current is not None and task.account != current:
+                write_account(inventories.pop(current), reports, delta_writer, journal, writers)
+            current = task.account
+
+        if current is not None:
+            write_account(inventories.pop(current), reports, delta_writer, journal, writers)
+
+        if not journal.stop_requested:
+            for report in reports:
+                if not report.cross_account:
+                    continue
+                if journal.resumed:
+                    # Accounts finished before the interruption are not in this run's
+                    # graph; the last complete output stays in place
+                    print(f"Skipping {report.filename}: it needs every account from one run; rerun with --restart")
+                    report.writer.abort()
+                    writers.remove(report.writer)
+                    os.remove(report.writer.partial_path)
+                else:
+                    report.writer.writerows(report.final_rows())
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+
+    return journal.finish(*writers), delta_writer
+
+
+def load_accounts(accounts_filename='accounts.json', named_accounts_filename='aws_accounts.json',
+                  profile_template=DEFAULT_PROFILE_TEMPLATE):
+    # Every account in either file, once. Named accounts use their name as
+    # the profile; the rest use profile_template, as new.py does.
+    with open(accounts_filename, 'r') as json_file:
+        account_ids = [str(account_id) for account_id in json.load(json_file)]
+    with open(named_accounts_filename, 'r') as json_file:
+        named_accounts = [(name, str(account_id)) for name, account_id in json.load(json_file)]
+
+    profiles = {account_id: name for name, account_id in named_accounts}
+    accounts = {}
+    for account_id in account_ids + [account_id for _, account_id in named_accounts]:
+        if account_id not in accounts:
+            accounts[account_id] = Account(account_id, profiles.get(account_id) or profile_template.format(account_id=account_id))
+    return list(accounts.values()), account_ids, [account_id for _, account_id in named_accounts]
+
+
+def load_regions(json_filename='aws-region-names.json'):
+    with open(json_filename, 'r') as json_file:
+        return list(dict.fromkeys(zone['region'] for zone in json.load(json_file)['zones']))
+
+
+REPORT_NAMES = ['records', 'load_balancers', 'network_acls', 'route53zones', 'resolution']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Crawl every account and region once and write output.csv, all_load_balancer.csv, '
+                    'network_acls.csv and route53zones.csv from the same crawl')
+    add_workers_argument(parser)
+    parser.add_argument('--reports', default=','.join(REPORT_NAMES),
+                        help=f"Comma-separated reports to write (default: {','.join(REPORT_NAMES)})")
+    parser.add_argument('--profile-template', default=DEFAULT_PROFILE_TEMPLATE,
+                        help='Profile for accounts.json accounts missing from aws_accounts.json')
+    parser.add_argument('--snapshot', default='collector.snapshot.db',
+                        help='SQLite snapshot used to skip unchanged hosted zones (default: collector.snapshot.db)')
+    parser.add_argument('--no-snapshot', action='store_true', help='List every zone and do not read or update the snapshot')
+    parser.add_argument('--full', action='store_true', help='Re-list every zone and refresh the snapshot')
+    add_snapshot_max_age_argument(parser)
+    parser.add_argument('--restart', action='store_true', help='Ignore an interrupted run and start from the first account')
+    add_output_arguments(parser)
+    add_cache_arguments(parser)
+    add_cassette_arguments(parser)
+    add_credentials_arguments(parser)
+    add_region_map_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    open_cache(args.cache, args.no_cache, args.refresh)
+    open_cassette(args.record, args.replay, args.replay_latency)
+    open_region_map(args.region_map, args.no_region_map, args.all_regions)
+
+    accounts, account_ids, named_account_ids = load_accounts(profile_template=args.profile_template)
+    selected = [name.strip() for name in args.reports.split(',') if name.strip()]
+
+    # Each report keeps the accounts and regions of the script it replaces
+    reports = []
+    if 'records' in selected:
+        reports.append(RecordsReport(load_regions(), account_ids))
+    if 'load_balancers' in selected:
+        reports.append(LoadBalancerReport(account_ids=named_account_ids))
+    if 'network_acls' in selected:
+        # aws_networkACL.py wrote output.csv, which clashes with new.py's report
+        reports.append(NetworkAclReport(account_ids=named_account_ids))
+    if 'route53zones' in selected:
+        reports.append(Route53ZonesReport(named_account_ids))
+    if 'resolution' in selected:
+        # Every account, so chains crossing into any of them resolve
+        reports.append(ResolutionReport(load_regions(), workers=args.workers))
+    for report in reports:
+        report.filename = output_path(report.filename, args.output_format)
+    delta_filename = output_path('collector.delta.csv', args.output_format)
+
+    if not open_credentials([account.profile for account in accounts], args.sso_login):
+        return
+    snapshot = open_snapshot(args.snapshot, args.no_snapshot, args.snapshot_max_age)
+    finished, delta_writer = collect(accounts, reports, args.workers, 'collector.journal', args.restart, snapshot, args.full,
+                                     delta_filename)
+
+    write_run_metrics('aws_collector', args.metrics_dir, args.profile_report)
+    if not finished:
+        return
+
+    for report in reports:
+        print(f"Exported {report.writer.rows_written} rows to {report.filename}")
+    if snapshot is not None:
+        print(f"Exported {delta_writer.rows_written} record changes to {delta_filename}")
+        snapshot.print_stats()
+        snapshot.close()
+    pool.print_stats()
+    cache.print_stats()
+    cassette.print_stats()
+    credentials.print_stats()
+    region_map.print_stats()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+import datetime
+import os
+import subprocess
+import threading
+
+import botocore.session
+from botocore import UNSIGNED
+from botocore.config import Config
+from botocore.credentials import CredentialProvider, RefreshableCredentials
+from botocore.exceptions import BotoCoreError, ClientError, ProfileNotFound
+from botocore.tokens import SSOTokenProvider
+from botocore.utils import JSONFileCache, SSOTokenLoader, parse_timestamp
+
+from aws_cassette import cassette
+
+SSO_CACHE_DIR = os.path.expanduser(os.path.join('~', '.aws', 'sso', 'cache'))
+# Role credentials are refreshed in the background this long before they
+# expire, ahead of botocore's own 15 minute advisory refresh; a client only
+# waits for a refresh once they are within BLOCKING_REFRESH of expiring
+REFRESH_AHEAD = 20 * 60
+BLOCKING_REFRESH = 10 * 60
+REFRESH_CHECK = 30
+# A token expiring sooner than this gets a warning before the sweep starts
+TOKEN_WARNING = 60 * 60
+
+
+class SsoTokenExpired(Exception):
+    pass
+
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def sso_login(profile_name):
+    try:
+        subprocess.run(['aws', 'sso', 'login', '--profile', profile_name], check=True)
+        print(f"Successfully logged in with AWS SSO profile: {profile_name}")
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error logging in with AWS SSO profile: {profile_name}\n{e}")
+        return False
+
+
+class SsoProfile:
+    # What an SSO profile resolves to: the role credentials are shared by
+    # every profile with the same key, the token by every profile with the
+    # same token_source
+    def __init__(self, profile, botocore_session, config):
+        self.profile = profile
+        self.botocore_session = botocore_session
+        self.account_id = str(config['sso_account_id'])
+        self.role_name = config['sso_role_name']
+        self.session_name = config.get('sso_session')
+        if self.session_name:
+            sso_session = botocore_session.full_config.get('sso_sessions', {}).get(self.session_name, {})
+            self.start_url = sso_session.get('sso_start_url')
+            self.region = sso_session.get('sso_region')
+        else:
+            self.start_url = config.get('sso_start_url')
+            self.region = config.get('sso_region')
+        self.token_source = self.session_name or self.start_url
+        self.key = (self.token_source, self.account_id, self.role_name)
+
+    def token(self):
+        # (access token, expiration); sso-session tokens are refreshed by
+        # botocore when they can be, legacy ones only by logging in again
+        try:
+            if self.session_name:
+                token = SSOTokenProvider(self.botocore_session, profile_name=self.profile).load_token().get_frozen_token()
+                return token.token, token.expiration
+            token = SSOTokenLoader(JSONFileCache(SSO_CACHE_DIR))(self.start_url)
+        except BotoCoreError as e:
+            raise SsoTokenExpired(f"No valid SSO token for {self.token_source}: {e}")
+        expiration = parse_timestamp(token['expiresAt'])
+        if expiration <= utc_now():
+            raise SsoTokenExpired(f"The SSO token for {self.token_source} expired at {expiration:%Y-%m-%d %H:%M} UTC")
+        return token['accessToken'], expiration
+
+
+class SharedCredentialProvider(CredentialProvider):
+    METHOD = 'shared-sso'
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+
+    def load(self):
+        return self.credentials
+
+
+class SsoCredentials:
+    # Process-wide SSO role credentials. Every session of a profile, and of
+    # any other profile for the same account and role, shares one
+    # RefreshableCredentials, so a parallel sweep makes one GetRoleCredentials
+    # call per role instead of one per session. A background thread renews
+    # them REFRESH_AHEAD before they expire; botocore's refresh then finds
+    # fresh credentials waiting and only blocks, behind a single fetch, when
+    # the background refresh failed and expiry is close. Profiles that are not
+    # SSO profiles are left to boto3. Nothing is shared until open() is called.
+    def __init__(self, refresh_ahead=REFRESH_AHEAD, blocking_refresh=BLOCKING_REFRESH):
+        self.refresh_ahead = refresh_ahead
+        self.blocking_refresh = blocking_refresh
+        self.enabled = False
+        self.fetched = 0
+        self.refreshed_ahead = 0
+        self.blocking_refreshes = 0
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._sso_profiles = {}
+        self._credentials = {}
+        self._metadata = {}
+        self._lifetimes = {}
+        self._fetch_locks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def open(self):
+        self.close()
+        self.enabled = True
+
+    def sso_profile(self, profile):
+        # None for profiles that do not exist or do not use SSO
+        with self._lock:
+            if profile in self._profiles:
+                return self._profiles[profile]
+        try:
+            botocore_session = botocore.session.Session(profile=profile)
+            config = botocore_session.get_scoped_config()
+        except ProfileNotFound:
+            config = {}
+        sso_profile = None
+        if config.get('sso_account_id') and config.get('sso_role_name'):
+            sso_profile = SsoProfile(profile, botocore_session, config)
+        with self._lock:
+            self._profiles[profile] = sso_profile
+            if sso_profile is not None:
+                self._sso_profiles.setdefault(sso_profile.key, sso_profile)
+        return sso_profile
+
+    def check(self, profiles, login=False):
+        # Before a sweep: every SSO token the profiles need must still be
+        # valid. With login, an expired one is renewed with aws sso login.
+        # Returns False when the sweep should not start.
+        ok = True
+        by_source = {}
+        for profile in profiles:
+            sso_profile = self.sso_profile(profile)
+            if sso_profile is not None:
+                by_source.setdefault(sso_profile.token_source, sso_profile)
+
+        for token_source, sso_profile in by_source.items():
+            try:
+                _, expiration = sso_profile.token()
+            except SsoTokenExpired as e:
+                if login and sso_login(sso_profile.profile):
+                    continue
+                print(f"{e}; run 'aws sso login --profile {sso_profile.profile}' or pass --sso-login")
+                ok = False
+                continue
+            remaining = (expiration - utc_now()).total_seconds()
+            if remaining < TOKEN_WARNING:
+                print(f"Warning: the SSO token for {token_source} expires in {int(remaining // 60)} minutes; "
+                      f"role credentials may not be renewed after that")
+        return ok
+
+    def _sso_client(self, sso_profile):
+        return sso_profile.botocore_session.create_client(
+            'sso', region_name=sso_profile.region, config=Config(signature_version=UNSIGNED)
+        )
+
+    def _fetch(self, sso_profile):
+        access_token, _ = sso_profile.token()
+        response = self._sso_client(sso_profile).get_role_credentials(
+            roleName=sso_profile.role_name, accountId=sso_profile.account_id, accessToken=access_token
+        )
+        role = response['roleCredentials']
+        expiry_time = datetime.datetime.fromtimestamp(role['expiration'] / 1000, datetime.timezone.utc)
+        metadata = {
+            'access_key': role['accessKeyId'],
+            'secret_key': role['secretAccessKey'],
+            'token': role['sessionToken'],
+            'expiry_time': expiry_time.isoformat()
+        }
+        with self._lock:
+            self._metadata[sso_profile.key] = metadata
+            self._lifetimes[sso_profile.key] = (expiry_time - utc_now()).total_seconds()
+            self.fetched += 1
+        return metadata
+
+    def _remaining(self, key):
+        with self._lock:
+            metadata = self._metadata.get(key)
+        if metadata is None:
+            return None, 0
+        expiry_time = datetime.datetime.fromisoformat(metadata['expiry_time'])
+        return metadata, (expiry_time - utc_now()).total_seconds()
+
+    def _current(self, key, floor):
+        # Metadata with more than floor seconds left, fetching it at most once
+        # however many threads ask at the same time
+        metadata, remaining = self._remaining(key)
+        if metadata is not None and remaining > floor:
+            return metadata
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(key, threading.Lock())
+            sso_profile = self._sso_profiles[key]
+        with fetch_lock:
+            metadata, remaining = self._remaining(key)
+            if metadata is not None and remaining > floor:
+                return metadata
+            return self._fetch(sso_profile)
+
+    def _refresh(self, key):
+        # botocore's refresh_using: normally the background thread got here first
+        metadata, remaining = self._remaining(key)
+        if metadata is not None and remaining > self.blocking_refresh:
+            return metadata
+        with self._lock:
+            self.blocking_refreshes += 1
+        return self._current(key, self.blocking_refresh)
+
+    def credentials(self, profile):
+        # The shared RefreshableCredentials of an SSO profile, or None
+        if not self.enabled:
+            return None
+        sso_profile = self.sso_profile(profile)
+        if sso_profile is None:
+            return None
+        key = sso_profile.key
+        with self._lock:
+            credentials = self._credentials.get(key)
+        if credentials is not None:
+            return credentials
+
+        metadata = self._current(key, self.blocking_refresh)
+        with self._lock:
+            credentials = self._credentials.get(key)
+            if credentials is None:
+                credentials = self._credentials[key] = RefreshableCredentials.create_from_metadata(
+                    metadata, refresh_using=lambda: self._refresh(key), method=SharedCredentialProvider.METHOD
+                )
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._refresh_ahead, name='sso-credentials', daemon=True)
+                self._thread.start()
+        return credentials
+
+    def _refresh_ahead(self):
+        while not self._stop.wait(REFRESH_CHECK):
+            with self._lock:
+                keys = list(self._credentials)
+            for key in keys:
+                # Short-lived credentials are renewed halfway through instead
+                with self._lock:
+                    ahead = min(self.refresh_ahead, self._lifetimes.get(key, 0) / 2)
+                metadata, remaining = self._remaining(key)
+                if metadata is not None and remaining > ahead:
+                    continue
+                try:
+                    self._current(key, ahead)
+                    with self._lock:
+                        self.refreshed_ahead += 1
+                except (BotoCoreError, ClientError, SsoTokenExpired) as e:
+                    print(f"Error refreshing SSO credentials for account {key[1]} role {key[2]}: {e}")
+
+    def attach(self, session, profile):
+        # Make a boto3 session of an SSO profile use the shared credentials
+        credentials = self.credentials(profile)
+        if credentials is not None:
+            session._session.get_component('credential_provider').insert_before('sso', SharedCredentialProvider(credentials))
+        return session
+
+    def print_stats(self):
+        if self.enabled and self._credentials:
+            print(f"SSO credentials: {len(self._credentials)} roles, {self.fetched} fetched, "
+                  f"{self.refreshed_ahead} refreshed ahead of expiry, {self.blocking_refreshes} blocking refreshes")
+
+    def close(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            self.enabled = False
+            self._thread = None
+            self._profiles.clear()
+            self._sso_profiles.clear()
+            self._credentials.clear()
+            self._metadata.clear()
+            self._lifetimes.clear()
+
+
+credentials = SsoCredentials()
+
+
+def add_credentials_arguments(parser):
+    parser.add_argument('--sso-login', action='store_true',
+                        help="Run 'aws sso login' before the sweep for profiles whose SSO token has expired")
+
+
+def open_credentials(profiles, login=False):
+    # False when an SSO token has expired and the sweep should not start
+    if cassette.replaying:
+        return True
+    credentials.open()
+    return credentials.check(profiles, login)
@@ -0,0 +1,92 @@
+import csv
+import os
+
+
+class StreamingCsvWriter:
+    # Rows are buffered and appended as they arrive, so exporters never hold a
+    # whole run in memory and never rewrite rows. A new export is written to
+    # '<path>.partial' and only renamed over <path> once it completes; append
+    # mode writes to <path> directly, adding the header if the file is empty.
+    # resume_offset reopens an interrupted export at its last checkpoint,
+    # dropping anything written after it.
+    def __init__(self, path, fieldnames, append=False, write_header=True, buffer_rows=500, fsync_every=5000,
+                 resume_offset=None):
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.append = append
+        self.buffer_rows = buffer_rows
+        self.fsync_every = fsync_every
+        self.rows_written = 0
+        self._buffer = []
+        self._unsynced = 0
+
+        self.partial_path = path if append else path + '.partial'
+        if resume_offset is not None and os.path.exists(self.partial_path):
+            os.truncate(self.partial_path, resume_offset)
+            self._file = open(self.partial_path, 'a', newline='')
+        else:
+            self._file = open(self.partial_path, 'a' if append else 'w', newline='')
+        self._writer = csv.writer(self._file)
+
+        if write_header and self._file.tell() == 0:
+            self._writer.writerow(self.fieldnames)
+
+    def writerow(self, row):
+        if isinstance(row, dict):
+            row = [row.get(field, '') for field in self.fieldnames]
+        self._buffer.append(row)
+        if len(self._buffer) >= self.buffer_rows:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self._buffer:
+            self._writer.writerows(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._unsynced += len(self._buffer)
+            self._buffer = []
+        self._file.flush()
+
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def checkpoint(self):
+        # Everything written so far is durable; returns the offset to resume from.
+        self.flush()
+        self.sync()
+        return self._file.tell()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self.sync()
+        self._file.close()
+        if not self.append:
+            os.replace(self.partial_path, self.path)
+
+    def abort(self):
+        # Keep what was written so far in the .partial file, but never promote
+        # an incomplete export over the previous complete one.
+        if self._file.closed:
+            return
+        self.flush()
+        self.sync()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,96 @@
+import sys
+from collections import namedtuple
+
+from aws_domain_trie import DomainTrie
+
+# resource is the Target the chain ends at, if any. status is one of:
+#   resource       the chain ends at a known AWS resource (load balancer, distribution, ...)
+#   address        the chain ends at a record with plain values (A, AAAA, ...)
+#   external       the chain leaves every hosted zone in the graph
+#   dangling       the chain ends at a name inside one of our zones that has no records
+#   cycle          the chain loops back on itself
+Resolution = namedtuple('Resolution', ['target', 'resource', 'depth', 'status'])
+
+
+def record_target(record):
+    # The name a CNAME or alias DnsRecord points at, or None for plain records
+    if record.alias or record.type == 'CNAME':
+        return record.value
+    return None
+
+
+def normalize_dns_name(dns_name):
+    if not dns_name:
+        return None
+
+    dns_name = dns_name.lower().rstrip('.')
+    if dns_name.startswith('dualstack.'):
+        dns_name = dns_name[len('dualstack.'):]
+    return dns_name
+
+
+class DnsGraph:
+    # Every record name of every account and the CNAME and alias edges
+    # between them; find_target(name) says which AWS resource, if any, a
+    # name belongs to (see aws_alias_targets). Chains are resolved by walking
+    # the edges; each name on a walked chain is memoized, so resolving all
+    # records costs one step per name overall. A name with several records
+    # (weighted, latency or failover sets) follows the first one added.
+    def __init__(self, find_target=None):
+        self.find_target = find_target
+        self.names = set()
+        self.edges = {}
+        self.zones = DomainTrie()
+        self._resolved = {}
+
+    def add_zone(self, zone_name):
+        self.zones.add(zone_name)
+
+    def add_record(self, record):
+        name = normalize_dns_name(record.name)
+        self.names.add(name)
+        target = record_target(record)
+        if target and name not in self.edges:
+            # Many records point at the same few load balancers
+            self.edges[name] = sys.intern(normalize_dns_name(target))
+        self._resolved.clear()
+
+    def reset(self):
+        # Forget every resolution, e.g. after find_target learned new resources
+        self._resolved.clear()
+
+    def _terminal(self, name):
+        resource = self.find_target(name) if self.find_target else None
+        if resource is not None:
+            return Resolution(name, resource, 0, 'resource')
+        if name in self.names:
+            return Resolution(name, None, 0, 'address')
+        if self.zones.matches(name):
+            return Resolution(name, None, 0, 'dangling')
+        return Resolution(name, None, 0, 'external')
+
+    def resolve(self, name):
+        name = normalize_dns_name(name)
+        path = []
+        on_path = set()
+        while True:
+            result = self._resolved.get(name)
+            if result is not None:
+                break
+            if name in on_path:
+                result = Resolution(name, None, 0, 'cycle')
+                break
+            if name not in self.edges:
+                result = self._terminal(name)
+                break
+            path.append(name)
+            on_path.add(name)
+            name = self.edges[name]
+
+        # Memoize every name walked, counting hops back from the end
+        for walked in reversed(path):
+            result = Resolution(result.target, result.resource, result.depth + 1, result.status)
+            self._resolved[walked] = result
+        if not path:
+            self._resolved[name] = result
+        return result
@@ -0,0 +1,75 @@
+_VALUE = object()
+
+
+def normalize_domain(name):
+    return name.strip().lower().rstrip('.')
+
+
+def domain_labels(name):
+    # 'www.Example.com.' -> ['com', 'example', 'www']
+    name = normalize_domain(name)
+    return name.split('.')[::-1] if name else []
+
+
+class DomainTrie:
+    # Domains stored by their labels read right to left, so every suffix of a
+    # name is a prefix of its path and the most specific stored suffix of any
+    # domain is found in one walk of at most len(labels) steps.
+    def __init__(self):
+        self._root = {}
+        self.size = 0
+
+    def add(self, domain, value=True):
+        node = self._root
+        for label in domain_labels(domain):
+            node = node.setdefault(label, {})
+        if _VALUE not in node:
+            self.size += 1
+        node[_VALUE] = value
+
+    def get(self, domain, default=None):
+        node = self._root
+        for label in domain_labels(domain):
+            node = node.get(label)
+            if node is None:
+                return default
+        return node.get(_VALUE, default)
+
+    def longest_match(self, domain, default=None):
+        # Value of the longest stored name that is `domain` or one of its parents
+        match = default
+        node = self._root
+        for label in domain_labels(domain):
+            node = node.get(label)
+            if node is None:
+                break
+            if _VALUE in node:
+                match = node[_VALUE]
+        return match
+
+    def matches(self, domain):
+        return self.longest_match(domain, _VALUE) is not _VALUE
+
+    def __len__(self):
+        return self.size
+
+
+def suffix_trie(suffixes):
+    trie = DomainTrie()
+    for suffix in suffixes:
+        if normalize_domain(suffix):
+            trie.add(suffix)
+    return trie
+
+
+def zone_trie(hosted_zones):
+    # Zone name -> every hosted zone with that name; public and private zones,
+    # or zones in different accounts, can share a name.
+    trie = DomainTrie()
+    for zone in hosted_zones:
+        zones = trie.get(zone.name)
+        if zones is None:
+            zones = []
+            trie.add(zone.name, zones)
+        zones.append(zone)
+    return trie
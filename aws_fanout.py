@@ -0,0 +1,64 @@
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# One unit of work: an AWS operation against one account and region.
+# `call` takes no arguments and returns the unit's result; `key` optionally
+# names the resource it covers (e.g. a hosted zone id) for checkpointing.
+Task = namedtuple('Task', ['account', 'region', 'service', 'operation', 'call', 'key'], defaults=(None,))
+
+DEFAULT_PER_ACCOUNT = 4
+DEFAULT_PER_SERVICE = 16
+
+
+class FanOut:
+    def __init__(self, workers=1, per_account=DEFAULT_PER_ACCOUNT, per_service=DEFAULT_PER_SERVICE):
+        self.workers = max(int(workers or 1), 1)
+        self.per_account = per_account
+        self.per_service = per_service
+        self._lock = threading.Lock()
+        self._account_limits = {}
+        self._service_limits = {}
+
+    def _limit(self, limits, key, size):
+        with self._lock:
+            if key not in limits:
+                limits[key] = threading.BoundedSemaphore(size)
+            return limits[key]
+
+    def _run(self, task):
+        # Always acquire the account slot before the service slot so two tasks
+        # can never hold one each and wait on the other.
+        with self._limit(self._account_limits, task.account, self.per_account):
+            with self._limit(self._service_limits, task.service, self.per_service):
+                return task.call()
+
+    def map(self, tasks):
+        # Yields (task, result) pairs in the order the tasks were given,
+        # whatever order they finish in. Only a bounded window of tasks is in
+        # flight, so a lazy task generator is consumed as results drain.
+        if self.workers == 1:
+            for task in tasks:
+                yield task, task.call()
+            return
+
+        window = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for task in tasks:
+                window.append((task, executor.submit(self._run, task)))
+                if len(window) >= self.workers * 2:
+                    done_task, future = window.popleft()
+                    yield done_task, future.result()
+
+            while window:
+                done_task, future = window.popleft()
+                yield done_task, future.result()
+
+
+def run_tasks(tasks, workers=1, per_account=DEFAULT_PER_ACCOUNT, per_service=DEFAULT_PER_SERVICE):
+    return FanOut(workers, per_account, per_service).map(tasks)
+
+
+def add_workers_argument(parser, default=1):
+    parser.add_argument('--workers', type=int, default=default,
+                        help=f'Number of (account, region) units to run concurrently (default: {default})')
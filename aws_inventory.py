@@ -0,0 +1,452 @@
+import argparse
+import itertools
+import json
+import os
+import pathlib
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from aws_dns_graph import normalize_dns_name
+from aws_output import FORMATS, output_path, read_rows
+
+DEFAULT_INVENTORY_PATH = 'inventory.db'
+# The exports loaded when none are named, each in whichever of its formats
+# was written last
+DEFAULT_INPUTS = ['dns_resolution.csv', 'output.resolution.csv', 'output.csv', 'route53zones.csv', 'all_load_balancer.csv']
+DEFAULT_PORT = 8053
+DEFAULT_LIMIT = 100
+# Queries read the file through a memory map rather than SQLite's page cache
+MMAP_SIZE = 1 << 30
+
+RECORD_COLUMNS = ['source', 'account', 'zone', 'name', 'type', 'value', 'final_target', 'depth', 'status', 'target_type', 'arn']
+LOAD_BALANCER_COLUMNS = ['account', 'arn', 'name', 'dns_name', 'type']
+# Searchable field -> (indexed column, whether it holds normalized DNS names
+# (lower case, no trailing dot or dualstack. prefix), reversed column for
+# suffix searches). Suffixes are only kept for the names records and load
+# balancers are known by, which keeps the file and its build small.
+RECORD_FIELDS = {
+    'name': ('name_key', True, 'name_rkey'),
+    'value': ('value_key', True, None),
+    'final_target': ('final_key', True, None),
+    'arn': ('arn', False, None),
+    'account': ('account', False, None)
+}
+LOAD_BALANCER_FIELDS = {
+    'dns_name': ('dns_key', True, 'dns_rkey'),
+    'name': ('name', False, None),
+    'arn': ('arn', False, None),
+    'account': ('account', False, None)
+}
+MATCHES = ['exact', 'prefix', 'suffix']
+# Each row is its columns followed by its DNS name keys
+INSERTS = {
+    'records': f"INSERT INTO records VALUES ({', '.join('?' * (len(RECORD_COLUMNS) + 4))})",
+    'load_balancers': f"INSERT INTO load_balancers VALUES ({', '.join('?' * (len(LOAD_BALANCER_COLUMNS) + 2))})"
+}
+
+SCHEMA = '''
+    CREATE TABLE records (
+        source TEXT, account TEXT, zone TEXT, name TEXT, type TEXT, value TEXT, final_target TEXT, depth INTEGER,
+        status TEXT, target_type TEXT, arn TEXT,
+        name_key TEXT, name_rkey TEXT, value_key TEXT, final_key TEXT);
+    CREATE TABLE load_balancers (
+        account TEXT, arn TEXT, name TEXT, dns_name TEXT, type TEXT, dns_key TEXT, dns_rkey TEXT);
+    CREATE TABLE sources (path TEXT, report TEXT, rows INTEGER, loaded_at REAL);
+'''
+# Created once the rows are in, which is faster than maintaining them per insert
+INDEXES = '''
+    CREATE INDEX records_name ON records (name_key);
+    CREATE INDEX records_name_suffix ON records (name_rkey);
+    CREATE INDEX records_value ON records (value_key);
+    CREATE INDEX records_final ON records (final_key);
+    CREATE INDEX records_arn ON records (arn);
+    CREATE INDEX records_account ON records (account);
+    CREATE INDEX load_balancers_dns ON load_balancers (dns_key);
+    CREATE INDEX load_balancers_dns_suffix ON load_balancers (dns_rkey);
+    CREATE INDEX load_balancers_name ON load_balancers (name);
+    CREATE INDEX load_balancers_arn ON load_balancers (arn);
+    CREATE INDEX load_balancers_account ON load_balancers (account);
+'''
+
+
+def blank(value):
+    # CSV exports write missing values as ''
+    return None if value is None or value == '' else value
+
+
+def integer(value):
+    return None if blank(value) is None else int(value)
+
+
+def dns_key(dns_name):
+    return normalize_dns_name(blank(dns_name))
+
+
+def reversed_key(key):
+    return key[::-1] if key else None
+
+
+def record_row(source, account, zone, name, record_type, value, final_target=None, depth=None, status=None,
+               target_type=None, arn=None):
+    row = [blank(column) for column in (source, account, zone, name, record_type, value, final_target, depth, status,
+                                        target_type, arn)]
+    name_key = dns_key(name)
+    return tuple(row) + (name_key, reversed_key(name_key), dns_key(value), dns_key(final_target))
+
+
+def resolution_row(row):
+    return record_row('resolution', row['AccountID'], row['HostedZoneName'], row['RecordName'], row['RecordType'],
+                      row['Target'], row['FinalTarget'], integer(row['Depth']), row['Status'], row['TargetType'],
+                      row['TargetARN'])
+
+
+def records_row(row):
+    # new.py's RecordName column has always held the record's value, not its name
+    return record_row('records', row['AccountID'], row['HostedZoneName'], None, row['RecordType'], row['RecordName'],
+                      target_type=row['TargetType'], arn=row['LoadBalancerARNs'])
+
+
+def route53zones_row(row):
+    return record_row('route53zones', row['Profile'], None, row['Record Name'], row['Record Type'], row['Record Value'])
+
+
+def load_balancer_row(row):
+    # The export's AccountID column is empty; the ARN carries the account
+    arn = blank(row['LoadBalancerArn'])
+    parts = arn.split(':') if arn else []
+    account = parts[4] if len(parts) > 4 else blank(row.get('AccountID'))
+    key = dns_key(row['DNSName'])
+    return account, arn, blank(row['LoadBalancerName']), blank(row['DNSName']), blank(row['Type']), key, reversed_key(key)
+
+
+# Export -> (the column that identifies it, table, row converter). Exports
+# are recognised by their columns, so renamed and converted files load too.
+EXPORTS = {
+    'resolution': ('FinalTarget', 'records', resolution_row),
+    'records': ('LoadBalancerARNs', 'records', records_row),
+    'route53zones': ('Record Value', 'records', route53zones_row),
+    'load_balancers': ('LoadBalancerArn', 'load_balancers', load_balancer_row)
+}
+
+
+def export_of(row):
+    for report, (column, _, _) in EXPORTS.items():
+        if column in row:
+            return report
+    return None
+
+
+def prefix_range(column, prefix):
+    # A prefix search as a range over the column's index; '' matches everything
+    if not prefix:
+        return f'{column} IS NOT NULL', []
+    return f'{column} >= ? AND {column} < ?', [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+
+
+def default_inputs():
+    inputs = []
+    for filename in DEFAULT_INPUTS:
+        existing = [path for path in (output_path(filename, output_format) for output_format in FORMATS) if os.path.exists(path)]
+        if existing:
+            inputs.append(max(existing, key=os.path.getmtime))
+    return inputs
+
+
+class InventoryStore:
+    # The exported records and load balancers in one indexed SQLite file, to
+    # answer "what is behind this name" and "what points at this ARN" without
+    # another crawl. load() rebuilds the file from the exports; open() maps
+    # it read-only, so a server starts in milliseconds however many rows it
+    # holds and point queries are single index lookups.
+    def __init__(self, path=DEFAULT_INVENTORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def load(self, paths):
+        # Built beside the current file and swapped in once complete, so a
+        # server keeps answering from the old inventory meanwhile. Returns
+        # (path, report, rows) for every export loaded.
+        building_path = self.path + '.building'
+        if os.path.exists(building_path):
+            os.remove(building_path)
+        db = sqlite3.connect(building_path)
+        loaded = []
+        try:
+            db.executescript('PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;' + SCHEMA)
+            for path in paths:
+                rows = read_rows(path)
+                first = next(rows, None)
+                report = export_of(first) if first is not None else None
+                if report is None:
+                    print(f"Skipping {path}: not a record or load balancer export, or empty")
+                    continue
+                _, table, convert = EXPORTS[report]
+                cursor = db.executemany(INSERTS[table], map(convert, itertools.chain([first], rows)))
+                db.execute('INSERT INTO sources VALUES (?, ?, ?, ?)', (path, report, cursor.rowcount, time.time()))
+                loaded.append((path, report, cursor.rowcount))
+            db.executescript(INDEXES)
+            db.execute('ANALYZE')
+            db.commit()
+        finally:
+            db.close()
+        os.replace(building_path, self.path)
+        return loaded
+
+    def open(self):
+        self.close()
+        uri = pathlib.Path(self.path).absolute().as_uri() + '?mode=ro'
+        db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        db.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+        with self._lock:
+            self._db = db
+
+    def _select(self, table, columns, fields, field, value, match, limit):
+        if field not in fields:
+            raise ValueError(f"Unknown {table} field {field!r}; choose from {', '.join(fields)}")
+        if match not in MATCHES:
+            raise ValueError(f"Unknown match {match!r}; choose from {', '.join(MATCHES)}")
+        column, is_dns_name, reversed_column = fields[field]
+        if is_dns_name:
+            value = normalize_dns_name(value) or ''
+        if match == 'suffix':
+            if reversed_column is None:
+                raise ValueError(f"{field} has no suffix search")
+            column, value = reversed_column, value[::-1]
+
+        if match == 'exact':
+            where, params = f'{column} = ?', [value]
+        else:
+            where, params = prefix_range(column, value)
+        with self._lock:
+            rows = self._db.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {where} LIMIT ?",
+                                    params + [limit]).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def records(self, field, value, match='exact', limit=DEFAULT_LIMIT):
+        return self._select('records', RECORD_COLUMNS, RECORD_FIELDS, field, value, match, limit)
+
+    def load_balancers(self, field, value, match='exact', limit=DEFAULT_LIMIT):
+        return self._select('load_balancers', LOAD_BALANCER_COLUMNS, LOAD_BALANCER_FIELDS, field, value, match, limit)
+
+    def behind(self, name, limit=DEFAULT_LIMIT):
+        # A name's records and the load balancers they end at: by ARN when
+        # the export resolved one, otherwise by the DNS name they point at
+        records = self.records('name', name, limit=limit)
+        load_balancers = []
+        for record in records:
+            if record['arn']:
+                found = self.load_balancers('arn', record['arn'])
+            else:
+                found = self.load_balancers('dns_name', record['final_target'] or record['value'] or '')
+            load_balancers.extend(lb for lb in found if lb not in load_balancers)
+        return {'records': records, 'load_balancers': load_balancers}
+
+    def pointing_at(self, target, limit=DEFAULT_LIMIT):
+        # Records pointing at an ARN or DNS name, directly or at the end of a
+        # chain, and at the load balancer the ARN or name belongs to
+        is_arn = target.startswith('arn:')
+        load_balancers = self.load_balancers('arn' if is_arn else 'dns_name', target)
+        arns = {target} if is_arn else set()
+        keys = set() if is_arn else {normalize_dns_name(target)}
+        for lb in load_balancers:
+            arns.add(lb['arn'])
+            keys.add(normalize_dns_name(lb['dns_name']))
+        arns.discard(None)
+        keys.discard(None)
+
+        arn_marks = ', '.join('?' * len(arns))
+        key_marks = ', '.join('?' * len(keys))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(RECORD_COLUMNS)} FROM records "
+                f"WHERE arn IN ({arn_marks}) OR value_key IN ({key_marks}) OR final_key IN ({key_marks}) LIMIT ?",
+                [*arns, *keys, *keys, limit]
+            ).fetchall()
+        return {'records': [dict(zip(RECORD_COLUMNS, row)) for row in rows], 'load_balancers': load_balancers}
+
+    def stats(self):
+        with self._lock:
+            records = self._db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+            load_balancers = self._db.execute('SELECT COUNT(*) FROM load_balancers').fetchone()[0]
+            sources = self._db.execute('SELECT path, report, rows, loaded_at FROM sources').fetchall()
+        return {
+            'records': records,
+            'load_balancers': load_balancers,
+            'sources': [dict(zip(['path', 'report', 'rows', 'loaded_at'], source)) for source in sources]
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+            self._db = None
+
+
+def single_field(params, fields):
+    given = [field for field in fields if field in params]
+    if len(given) != 1:
+        raise ValueError(f"Give exactly one of {', '.join(fields)}")
+    return given[0], params[given[0]]
+
+
+def required(params, name):
+    if not params.get(name):
+        raise ValueError(f"Missing {name}")
+    return params[name]
+
+
+class InventoryHandler(BaseHTTPRequestHandler):
+    # GET /records?<field>=...&match=&limit=, /load-balancers?<field>=...,
+    # /behind?name=..., /pointing-at?target=... and /stats, answered as JSON.
+    # Connections are kept alive, so a client asking many questions pays for
+    # one TCP handshake; Nagle is off so the body is not held back waiting
+    # for the ACK of the headers.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        started = time.perf_counter()
+        try:
+            result = self.route(url.path, params)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        if result is None:
+            self.send_json(404, {'error': f"Unknown path {url.path}"})
+            return
+        result['ms'] = round((time.perf_counter() - started) * 1000, 3)
+        self.send_json(200, result)
+
+    def route(self, path, params):
+        store = self.server.store
+        limit = int(params.pop('limit', DEFAULT_LIMIT))
+        match = params.pop('match', 'exact')
+        if path == '/records':
+            rows = store.records(*single_field(params, RECORD_FIELDS), match, limit)
+            return {'rows': rows, 'count': len(rows)}
+        if path == '/load-balancers':
+            rows = store.load_balancers(*single_field(params, LOAD_BALANCER_FIELDS), match, limit)
+            return {'rows': rows, 'count': len(rows)}
+        if path == '/behind':
+            return store.behind(required(params, 'name'), limit)
+        if path == '/pointing-at':
+            return store.pointing_at(required(params, 'target'), limit)
+        if path == '/stats':
+            return store.stats()
+        return None
+
+    def log_message(self, format, *args):
+        if self.server.log_requests:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def make_server(store, host='127.0.0.1', port=DEFAULT_PORT, log_requests=True):
+    server = ThreadingHTTPServer((host, port), InventoryHandler)
+    server.store = store
+    server.log_requests = log_requests
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load the exported records and load balancers into an indexed local inventory and query it')
+    parser.add_argument('--db', default=DEFAULT_INVENTORY_PATH, help=f'Inventory file (default: {DEFAULT_INVENTORY_PATH})')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load_parser = commands.add_parser('load', help='Rebuild the inventory from exports, in any output format')
+    load_parser.add_argument('inputs', nargs='*',
+                             help=f"Exports to load (default: whichever of {', '.join(DEFAULT_INPUTS)} exist, in any format)")
+
+    serve_parser = commands.add_parser('serve', help='Answer queries over HTTP as JSON')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument('--quiet', action='store_true', help='Do not log each request')
+
+    for command, fields in (('records', RECORD_FIELDS), ('load-balancers', LOAD_BALANCER_FIELDS)):
+        query_parser = commands.add_parser(command, help=f'Find {command.replace("-", " ")} by one field')
+        field_group = query_parser.add_mutually_exclusive_group(required=True)
+        for field in fields:
+            field_group.add_argument(f"--{field.replace('_', '-')}", dest=field)
+        query_parser.add_argument('--match', choices=MATCHES, default='exact')
+        query_parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+
+    behind_parser = commands.add_parser('behind', help='What a DNS name resolves to')
+    behind_parser.add_argument('name')
+    pointing_parser = commands.add_parser('pointing-at', help='Which records point at an ARN or DNS name')
+    pointing_parser.add_argument('target')
+    for query_parser in (behind_parser, pointing_parser):
+        query_parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    commands.add_parser('stats', help='Row counts and the exports loaded')
+    args = parser.parse_args(argv)
+
+    store = InventoryStore(args.db)
+    if args.command == 'load':
+        started = time.perf_counter()
+        inputs = args.inputs or default_inputs()
+        if not inputs:
+            print("No exports found to load")
+            return
+        for path, report, rows in store.load(inputs):
+            print(f"Loaded {rows} rows from {path} ({report})")
+        print(f"Built {args.db} in {time.perf_counter() - started:.2f}s")
+        return
+
+    if not os.path.exists(args.db):
+        print(f"{args.db} not found; run 'aws_inventory.py load' first")
+        return
+    store.open()
+
+    if args.command == 'serve':
+        server = make_server(store, args.host, args.port, not args.quiet)
+        print(f"Serving {args.db} on http://{args.host}:{server.server_address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            store.close()
+        return
+
+    started = time.perf_counter()
+    try:
+        if args.command in ('records', 'load-balancers'):
+            fields = RECORD_FIELDS if args.command == 'records' else LOAD_BALANCER_FIELDS
+            field = next(field for field in fields if getattr(args, field) is not None)
+            select = store.records if args.command == 'records' else store.load_balancers
+            rows = select(field, getattr(args, field), args.match, args.limit)
+            result = {'rows': rows, 'count': len(rows)}
+        elif args.command == 'behind':
+            result = store.behind(args.name, args.limit)
+        elif args.command == 'pointing-at':
+            result = store.pointing_at(args.target, args.limit)
+        else:
+            result = store.stats()
+    except ValueError as e:
+        print(e)
+        store.close()
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+    print(json.dumps(result, indent=2))
+    # Timing goes to stderr so the JSON can be piped
+    print(f"Answered in {elapsed:.3f} ms", file=sys.stderr)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import json
+import os
+import signal
+
+
+class JobJournal:
+    # Append-only record of finished units, e.g. ('account', id),
+    # (account, zone) or (account, region). Each entry also stores how far
+    # every output file had been written when the unit finished, so a rerun
+    # can cut the partial outputs back to that point and skip the done units
+    # without duplicating rows.
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.stop_requested = False
+        self._done = set()
+        self._offsets = {}
+
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            self._load()
+
+        self.resumed = bool(self._done)
+        if self.resumed:
+            print(f"Resuming from {path}: {len(self._done)} units already complete")
+
+    def _load(self):
+        with open(self.path, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from a crash mid-write
+                    break
+                self._done.add(_unit_key(entry['unit']))
+                self._offsets.update(entry['offsets'])
+
+        for output_path, offset in self._offsets.items():
+            if not os.path.exists(output_path) or os.path.getsize(output_path) < offset:
+                print(f"Partial output {output_path} does not match {self.path}; starting over")
+                self._done.clear()
+                self._offsets.clear()
+                os.remove(self.path)
+                return
+
+    def resume_offset(self, path, append=False):
+        # StreamingCsvWriter keeps new exports in '<path>.partial'
+        return self._offsets.get(path if append else path + '.partial')
+
+    def is_done(self, *unit):
+        return _unit_key(unit) in self._done
+
+    def mark_done(self, unit, *writers):
+        offsets = {writer.partial_path: writer.checkpoint() for writer in writers}
+        with open(self.path, 'a') as journal_file:
+            journal_file.write(json.dumps({'unit': list(unit), 'offsets': offsets}) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self._done.add(_unit_key(unit))
+        self._offsets.update(offsets)
+
+    def pending(self, tasks, unit):
+        # Stops handing out new work once a shutdown is requested; tasks that
+        # are already running still drain through the caller's loop.
+        for task in tasks:
+            if self.stop_requested:
+                return
+            if not self.is_done(*unit(task)):
+                yield task
+
+    def request_stop(self, signum=None, frame=None):
+        if self.stop_requested:
+            raise KeyboardInterrupt
+        self.stop_requested = True
+        print("\nStopping after in-flight units finish; run again to resume. Interrupt again to abort now.")
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGTERM, self.request_stop)
+
+    def finish(self, *writers):
+        # On a requested stop, keep the partial outputs and the journal for
+        # the next run; otherwise publish the outputs and drop the journal.
+        if self.stop_requested:
+            for writer in writers:
+                writer.abort()
+            print(f"Checkpoint saved to {self.path}")
+            return False
+
+        for writer in writers:
+            writer.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        return True
+
+
+def _unit_key(unit):
+    return json.dumps([str(part) for part in unit])
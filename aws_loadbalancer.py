@@ -1,69 +1,61 @@
-import csv
+import argparse
 import json
-import boto3
+
+from aws_cache import add_cache_arguments, cache, open_cache
+from aws_cassette import add_cassette_arguments, cassette, open_cassette
+from aws_clients import pool
+from aws_collector import LOAD_BALANCER_REGIONS, Account, LoadBalancerReport, collect
+from aws_credentials import add_credentials_arguments, credentials, open_credentials
+from aws_fanout import add_workers_argument
+from aws_metrics import add_metrics_arguments, write_run_metrics
+from aws_output import add_output_arguments, output_path
+from aws_regions import add_region_map_arguments, open_region_map, region_map
 
 def get_account_ids_from_json(json_filename):
     with open(json_filename, 'r') as json_file:
         data = json.load(json_file)
     return data
-        
-def get_load_balancers(account_name, region): 
-    session = boto3.Session(profile_name=account_name)
-    elbv2_client = session.client('elbv2', region)
-
-    try:
-        response = elbv2_client.describe_load_balancers()
-        return response['LoadBalancers']
-    
-    except Exception as e:
-        print("Error getting load balancers for account id {account_id}")
-        return []
-    
-def export_to_csv(all_load_balancers, csv_file):
-    fieldnames = ['AccountID', 'LoadBalancerArn', 'LoadBalancerName', 'DNSName', 'Type']
-
-    with open(csv_file, mode='w', newline='') as csv_file:
-        writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-        writer.writeheader() 
 
-        for lb in all_load_balancers:
-            writer.writerow({
-                'AccountID': lb.get('Account', ''),
-                'LoadBalancerName': lb.get('LoadBalancerName', ''),
-                'LoadBalancerArn': lb.get('LoadBalancerArn', ''),
-                'DNSName': lb.get('DNSName', ''),
-                'Type': lb.get('Type', ''),
-            })   
-
-if __name__ == "__main__":
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export ELBv2 load balancers for every account')
+    add_workers_argument(parser)
+    parser.add_argument('--restart', action='store_true', help='Ignore an interrupted run and start from the beginning')
+    add_output_arguments(parser)
+    add_cache_arguments(parser)
+    add_cassette_arguments(parser)
+    add_credentials_arguments(parser)
+    add_region_map_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    open_cache(args.cache, args.no_cache, args.refresh)
+    open_cassette(args.record, args.replay, args.replay_latency)
+    open_region_map(args.region_map, args.no_region_map, args.all_regions)
 
     json_filename = 'aws_accounts.json'
-    csv_filename = 'output.csv'
    
     account_ids = get_account_ids_from_json(json_filename)
+    regions = LOAD_BALANCER_REGIONS
 
-    all_load_balancers = []
-
-    for account in account_ids:
-        account_name = (account[0])
-        account_id = (account[1])
+    csv_file_name = output_path("all_load_balancer.csv", args.output_format)
 
-        regions = ['us-east-2', 'us-east-1', 'us-west-1', 'us-west-2']
+    # A view over the collector: only the load balancer report
+    accounts = [Account(account[1], account[0]) for account in account_ids]
+    if not open_credentials([account.profile for account in accounts], args.sso_login):
+        return
+    report = LoadBalancerReport(regions, filename=csv_file_name)
+    finished, _ = collect(accounts, [report], args.workers, 'all_load_balancer.journal', args.restart)
 
-        for region in regions:
+    write_run_metrics('aws_loadbalancer', args.metrics_dir, args.profile_report)
 
-            print(f"Exporting load balancers for account {account_name} in {region}")
-            load_balancers = get_load_balancers(account_name, region)
-            all_load_balancers.extend(load_balancers)
-        
+    if not finished:
+        return
 
-            print(f"Exported {len(load_balancers)} load balancers for account ID {account_name}")
+    print(f"Exported {report.writer.rows_written} load balancers to {csv_file_name}")
+    pool.print_stats()
+    cache.print_stats()
+    cassette.print_stats()
+    credentials.print_stats()
+    region_map.print_stats()
 
-    csv_file_name = "all_load_balancer.csv"
-    export_to_csv(all_load_balancers, csv_file_name)
-
-    print(f"Exported {len(all_load_balancers)} load balancers to {csv_file_name}")
-
-
-
-    
\ No newline at end of file
+if __name__ == "__main__":
+    main()
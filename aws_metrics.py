@@ -0,0 +1,255 @@
+import json
+import os
+import subprocess
+import threading
+import time
+
+# Error codes botocore's retry handlers treat as throttling
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'TransactionInProgressException',
+    'RequestLimitExceeded', 'BandwidthLimitExceeded', 'LimitExceededException', 'RequestThrottled',
+    'SlowDown', 'PriorRequestNotComplete', 'EC2ThrottledException'
+}
+
+# Upper bounds, in seconds, of the Prometheus latency histogram buckets
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class ApiMetrics:
+    # Calls, errors, retries, throttles, response bytes and latencies per
+    # (account, region, operation). boto3 clients report through botocore's
+    # event hooks; AWS CLI subprocesses go through run_command.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._units = {}
+        self.dropped = []
+
+    def _unit(self, account, region, operation):
+        key = (account or '', region or '', operation)
+        unit = self._units.get(key)
+        if unit is None:
+            unit = {'calls': 0, 'errors': 0, 'retries': 0, 'throttles': 0, 'bytes': 0, 'latencies': []}
+            self._units[key] = unit
+        return unit
+
+    def record(self, account, region, operation, seconds, error=False, retries=0, throttles=0, nbytes=0):
+        with self._lock:
+            unit = self._unit(account, region, operation)
+            unit['calls'] += 1
+            unit['errors'] += int(error)
+            unit['retries'] += retries
+            unit['throttles'] += throttles
+            unit['bytes'] += nbytes
+            unit['latencies'].append(seconds)
+
+    def record_dropped(self, account, region, operation, error, resource=None):
+        # A unit whose data is missing from the outputs because its call
+        # still failed after retries
+        with self._lock:
+            self.dropped.append({
+                'account': str(account or ''),
+                'region': region or '',
+                'operation': operation,
+                'resource': resource or '',
+                'error': str(error)
+            })
+
+    def instrument(self, client, account):
+        # Latency runs from parameter validation to the parsed response, so it
+        # includes botocore's own retry sleeps.
+        region = client.meta.region_name
+        service = client.meta.service_model.service_name
+
+        def started(model, context, **_):
+            context['metrics_operation'] = f'{service}:{model.name}'
+            context['metrics_started'] = time.perf_counter()
+
+        # after-call-error only passes the exception and the context
+        def finished(context, http_response=None, parsed=None, exception=None, **_):
+            # Responses served from aws_cache never reached the API
+            if 'metrics_started' not in context or context.get('cache_hit'):
+                return
+            seconds = time.perf_counter() - context['metrics_started']
+            parsed = parsed or {}
+            error_code = parsed.get('Error', {}).get('Code')
+            status_code = getattr(http_response, 'status_code', None)
+            nbytes = int((getattr(http_response, 'headers', None) or {}).get('content-length') or 0)
+            if 'metrics_throttles' in context:
+                throttles = context['metrics_throttles']
+            else:
+                # No request went out (e.g. a stubbed response), so needs-retry never ran
+                throttles = int(error_code in THROTTLE_CODES)
+            self.record(
+                account, region, context['metrics_operation'], seconds,
+                error=exception is not None or (status_code or 0) >= 300,
+                retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                throttles=throttles,
+                nbytes=nbytes
+            )
+
+        def needs_retry(response, request_dict, **_):
+            # Emitted after every attempt, retried or not
+            context = request_dict['context']
+            context.setdefault('metrics_throttles', 0)
+            if response and response[1].get('Error', {}).get('Code') in THROTTLE_CODES:
+                context['metrics_throttles'] += 1
+
+        client.meta.events.register('before-parameter-build', started)
+        client.meta.events.register('after-call', finished)
+        client.meta.events.register('after-call-error', finished)
+        client.meta.events.register('needs-retry', needs_retry)
+        return client
+
+    def run_command(self, account, region, command, **kwargs):
+        # subprocess.run for `aws <service> <command> ...`, recorded like an API call
+        operation = f'{command[1]}:{command[2]} (cli)' if len(command) > 2 and command[0] == 'aws' else command[0]
+        started = time.perf_counter()
+        try:
+            result = subprocess.run(command, **kwargs)
+        except Exception:
+            self.record(account, region, operation, time.perf_counter() - started, error=True)
+            raise
+        stdout = result.stdout or ''
+        stderr = result.stderr or ''
+        self.record(
+            account, region, operation, time.perf_counter() - started,
+            error=result.returncode != 0,
+            throttles=int(any(code in stderr for code in THROTTLE_CODES)),
+            nbytes=len(stdout.encode() if isinstance(stdout, str) else stdout)
+        )
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._units.clear()
+            self.dropped = []
+
+    def summary(self):
+        with self._lock:
+            units = [(key, dict(unit, latencies=sorted(unit['latencies']))) for key, unit in self._units.items()]
+
+        summary = []
+        for (account, region, operation), unit in sorted(units):
+            latencies = unit.pop('latencies')
+            summary.append(dict(
+                unit,
+                account=account,
+                region=region,
+                operation=operation,
+                total_seconds=round(sum(latencies), 6),
+                p50_seconds=round(percentile(latencies, 0.5), 6),
+                p90_seconds=round(percentile(latencies, 0.9), 6),
+                p99_seconds=round(percentile(latencies, 0.99), 6),
+                max_seconds=round(latencies[-1] if latencies else 0.0, 6),
+                buckets=[sum(1 for latency in latencies if latency <= bound) for bound in LATENCY_BUCKETS]
+            ))
+        return summary
+
+    def write_json(self, path, script):
+        summary = self.summary()
+        with open(path, 'w') as json_file:
+            json.dump({
+                'script': script,
+                'finished_at': time.time(),
+                'buckets': LATENCY_BUCKETS,
+                'units': [{key: value for key, value in unit.items() if key != 'buckets'} for unit in summary],
+                'dropped': self.dropped
+            }, json_file, indent=2)
+
+    def write_prometheus(self, path, script):
+        # Written to a temporary file and renamed, so a node_exporter textfile
+        # collector never reads a half-written file.
+        lines = []
+        summary = self.summary()
+        counters = [
+            ('aws_api_calls_total', 'calls', 'AWS API calls'),
+            ('aws_api_errors_total', 'errors', 'AWS API calls that failed'),
+            ('aws_api_retries_total', 'retries', 'Retries botocore made'),
+            ('aws_api_throttles_total', 'throttles', 'Throttled attempts'),
+            ('aws_api_response_bytes_total', 'bytes', 'Response bytes received')
+        ]
+        for name, field, description in counters:
+            lines.append(f'# HELP {name} {description}.')
+            lines.append(f'# TYPE {name} counter')
+            for unit in summary:
+                lines.append(f'{name}{{{self._labels(script, unit)}}} {unit[field]}')
+
+        name = 'aws_dropped_units_total'
+        lines.append(f'# HELP {name} Units left out of the outputs after retries.')
+        lines.append(f'# TYPE {name} counter')
+        dropped = {}
+        for unit in self.dropped:
+            key = (unit['account'], unit['region'], unit['operation'])
+            dropped[key] = dropped.get(key, 0) + 1
+        for (account, region, operation), count in sorted(dropped.items()):
+            labels = self._labels(script, {'account': account, 'region': region, 'operation': operation})
+            lines.append(f'{name}{{{labels}}} {count}')
+
+        name = 'aws_api_call_duration_seconds'
+        lines.append(f'# HELP {name} AWS API call latency.')
+        lines.append(f'# TYPE {name} histogram')
+        for unit in summary:
+            labels = self._labels(script, unit)
+            for bound, count in zip(LATENCY_BUCKETS, unit['buckets']):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {unit["calls"]}')
+            lines.append(f'{name}_sum{{{labels}}} {unit["total_seconds"]}')
+            lines.append(f'{name}_count{{{labels}}} {unit["calls"]}')
+
+        with open(path + '.tmp', 'w') as prom_file:
+            prom_file.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+    def _labels(self, script, unit):
+        values = [('script', script), ('account', unit['account']), ('region', unit['region']), ('operation', unit['operation'])]
+        return ','.join(f'{label}="{self._escape(value)}"' for label, value in values)
+
+    def _escape(self, value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def print_dropped(self):
+        if not self.dropped:
+            return
+        print(f"\n{len(self.dropped)} units were dropped after retries and are missing from the outputs:")
+        for unit in self.dropped:
+            resource = f" {unit['resource']}" if unit['resource'] else ''
+            print(f"  {unit['account']} {unit['region'] or '-'} {unit['operation']}{resource}: {unit['error']}")
+
+    def print_report(self, top):
+        units = sorted(self.summary(), key=lambda unit: unit['total_seconds'], reverse=True)[:top]
+        print(f"\nTop {len(units)} slowest (account, region, operation) units:")
+        print(f"{'total (s)':>10}{'calls':>7}{'p50 (s)':>9}{'p99 (s)':>9}{'retries':>8}{'throttles':>10}  unit")
+        for unit in units:
+            print(f"{unit['total_seconds']:>10.2f}{unit['calls']:>7}{unit['p50_seconds']:>9.3f}{unit['p99_seconds']:>9.3f}"
+                  f"{unit['retries']:>8}{unit['throttles']:>10}  {unit['account']} {unit['region'] or '-'} {unit['operation']}")
+
+
+metrics = ApiMetrics()
+
+
+def run_command(account, region, command, **kwargs):
+    return metrics.run_command(account, region, command, **kwargs)
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics-dir', default='.',
+                        help='Directory for the <script>.metrics.json summary and <script>.prom textfile (default: .)')
+    parser.add_argument('--profile-report', type=int, metavar='N', default=0,
+                        help='Print the N slowest (account, region, operation) units at the end of the run')
+
+
+def write_run_metrics(script, metrics_dir='.', profile_report=0):
+    os.makedirs(metrics_dir, exist_ok=True)
+    metrics.write_json(os.path.join(metrics_dir, f'{script}.metrics.json'), script)
+    metrics.write_prometheus(os.path.join(metrics_dir, f'{script}.prom'), script)
+    metrics.print_dropped()
+    if profile_report:
+        metrics.print_report(profile_report)
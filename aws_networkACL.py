@@ -1,68 +1,63 @@
-import csv
+import argparse
 import json
-import subprocess
-import boto3
+
+from aws_cache import add_cache_arguments, cache, open_cache
+from aws_cassette import add_cassette_arguments, cassette, open_cassette
+from aws_clients import pool
+from aws_collector import NETWORK_ACL_REGIONS, Account, NetworkAclReport, collect
+from aws_credentials import add_credentials_arguments, credentials, open_credentials
+from aws_fanout import add_workers_argument
+from aws_metrics import add_metrics_arguments, write_run_metrics
+from aws_output import add_output_arguments, output_path
+from aws_regions import add_region_map_arguments, open_region_map, region_map
 
 def get_account_ids_from_json(json_filename):
     with open(json_filename, 'r') as json_file:
         data = json.load(json_file)
     return data
 
-def sso_login(profile_name):
-    try:
-        subprocess.run(['aws', 'sso', 'login', '--profile', profile_name], check=True)
-        print(f"Successfully logged in with AWS SSO profile: {profile_name}")
-    except subprocess.CalledProcessError as e:
-        print(f"Error LOgging in with AWS SSO profile: {profile_name}\n{e}")
-        
-def export_network_acls_to_csv(account_id, region, network_acls, csv_writer):
-    for acl in network_acls:
-        is_default = acl.get('IsDefault', False)
-        acl_id = acl['NetworkAclId']
-
-        entry = {
-            'AccountID': account_id,
-            'Region': region,
-            'NetworkAclID': acl_id,
-            'IsDefault': is_default
-        }
-        print(entry)
-        csv_writer.writerow(entry)
-
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export network ACLs for every account and region')
+    add_workers_argument(parser)
+    parser.add_argument('--restart', action='store_true', help='Ignore an interrupted run and start from the beginning')
+    add_output_arguments(parser)
+    add_cache_arguments(parser)
+    add_cassette_arguments(parser)
+    add_credentials_arguments(parser)
+    add_region_map_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    open_cache(args.cache, args.no_cache, args.refresh)
+    open_cassette(args.record, args.replay, args.replay_latency)
+    open_region_map(args.region_map, args.no_region_map, args.all_regions)
 
     json_filename = 'aws_accounts.json'
-    csv_filename = 'output.csv'
-    # sso_profile = 'se-staging-fms'
+    csv_filename = output_path('output.csv', args.output_format)
 
     account_ids = get_account_ids_from_json(json_filename)
     # accounts = seperate_account_id_name(account_ids)
 
-    with open(csv_filename, 'w', newline='') as csvfile:
-        fieldnames = ['AccountID', 'Region', 'NetworkAclID', 'IsDefault']
-        csv_writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        csv_writer.writeheader() 
-
-        for account in account_ids:
-            # sso_login(sso_profile)
-            account_name = (account[0])
-            account_id = (account[1])
+    regions = NETWORK_ACL_REGIONS
 
-            session = boto3.Session(profile_name=account_name)
-            regions = ['us-east-2', 'ap-northeast-3', 'eu-west-1', 'eu-north-1', 'ca-central-1', 'ap-northeast-2', 'ap-south-1', 'us-east-1', 'us-west-1', 'eu-west-3', 'sa-east-1', 'us-west-2', 'ap-southeast-1', 'eu-central-1', 'ap-southeast-2', 'ap-northeast-1', 'eu-west-2']
-        
-            for region in regions:
-                ec2_client = session.client('ec2', region_name=region)
+    # A view over the collector: only the network ACL report, still written
+    # to output.csv here; aws_collector.py writes it to network_acls.csv
+    accounts = [Account(account[1], account[0]) for account in account_ids]
+    if not open_credentials([account.profile for account in accounts], args.sso_login):
+        return
+    report = NetworkAclReport(regions, filename=csv_filename)
+    finished, _ = collect(accounts, [report], args.workers, 'network_acl.journal', args.restart)
 
-                try:
-                    response = ec2_client.describe_network_acls()
-                    network_acls = response['NetworkAcls']
-                    export_network_acls_to_csv(account_id, region, network_acls, csv_writer)
+    write_run_metrics('aws_networkACL', args.metrics_dir, args.profile_report)
 
-                except Exception as e:
-                    print(f"Error Describing network ACLs in account {account_id}, region {region}: {e}")
+    if not finished:
+        return
 
     print(f"Data exported to {csv_filename}")
+    pool.print_stats()
+    cache.print_stats()
+    cassette.print_stats()
+    credentials.print_stats()
+    region_map.print_stats()
 
 if __name__ == "__main__":
     main()        
\ No newline at end of file
@@ -1,8 +1,18 @@
-import csv
-import subprocess
+import argparse
 import json
-import time
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from aws_cache import add_cache_arguments, cache, open_cache
+from aws_cassette import add_cassette_arguments, cassette, open_cassette
+from aws_clients import get_account_id, get_client
+from aws_credentials import add_credentials_arguments, credentials, open_credentials
+from aws_fanout import Task, add_workers_argument, run_tasks
+from aws_metrics import add_metrics_arguments, metrics, write_run_metrics
+from aws_output import add_output_arguments, open_writer, output_path, read_rows
+from aws_paginate import iter_load_balancers
+from aws_ratelimit import run_cli
+from aws_regions import add_region_map_arguments, open_region_map, region_map
 
 def describe_load_balancer(args):
     profile, region, dns_value, record_type = args
@@ -20,60 +30,123 @@ def describe_load_balancer(args):
         "json",
     ]
 
-    retries = 0
-    while retries < 3:  # You can adjust the maximum number of retries
-        result = subprocess.run(command, capture_output=True, text=True)
-
-        if result.returncode != 0:
-            print(f"Error executing AWS CLI command: {result.stderr}")
-
-            # Exponential backoff
-            sleep_duration = 2 ** retries
-            print(f"Retrying in {sleep_duration} seconds...")
-            time.sleep(sleep_duration)
-            retries += 1
-        else:
-            try:
-                # Attempt to parse JSON output
-                return json.loads(result.stdout), profile, record_type, dns_value
-            except json.JSONDecodeError:
-                print("Failed to decode JSON response.")
-                return None
-
-    print("Max retries reached. Exiting.")
+    # Rate limited and retried with jittered backoff by run_cli
+    result = run_cli(profile, region, 'elbv2', command, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        print("Max retries reached. Exiting.")
+        metrics.record_dropped(profile, region, 'elbv2:describe-load-balancers (cli)', result.stderr.strip(), dns_value)
+        return None
+
+    try:
+        # Attempt to parse JSON output
+        return json.loads(result.stdout), profile, record_type, dns_value
+    except json.JSONDecodeError:
+        print("Failed to decode JSON response.")
+        return None
+
+def owner_account_id(lb):
+    # Same lookup as the CLI query's LoadBalancerAttributes[?Key=='owner_account_id'].Value | [0]
+    for attribute in lb.get('LoadBalancerAttributes', []):
+        if attribute.get('Key') == 'owner_account_id':
+            return attribute.get('Value')
     return None
 
-# Specify the path to your CSV file
-csv_file = "route53zones.csv"
-
-# Specify the AWS region
-aws_region = "us-west-2"
-
-# Specify the output CSV file
-output_csv_file = "nlb-waf-candidates.csv"
-
-# Counters for skipped and matched records
-skipped_records = 0
-matched_records = 0
-
-# List to store results
-results = []
-
-# Open the CSV file and read each line
-with open(csv_file, newline='') as csvfile:
-    reader = csv.DictReader(csvfile)
-    tasks = [(row["Profile"], aws_region, row["Record Value"], row["Record Type"]) for row in reader]
-
-    with ThreadPoolExecutor() as executor:
-        with open(output_csv_file, 'a', newline='') as output_csv:
-            fieldnames = ["Profile", "Record Type", "DNS Value (CSV)", "AWS Load Balancer ARN", "AWS Load Balancer Type", "AWS Owner Account ID", "AWS DNSName"]
-            writer = csv.DictWriter(output_csv, fieldnames=fieldnames)
-
-            # Write header if the file is newly created
-            if output_csv.tell() == 0:
-                writer.writeheader()
+def fetch_load_balancers(profile, region):
+    # Keyed by account ID, so the map is the one the other sweeps fill
+    account_id = get_account_id(profile)
+    if not region_map.should_list(account_id, profile, 'elbv2:DescribeLoadBalancers', region):
+        return []
+    elbv2_client = get_client(profile, 'elbv2', region)
+    try:
+        load_balancers = list(iter_load_balancers(elbv2_client))
+        region_map.record(account_id, 'elbv2:DescribeLoadBalancers', region, len(load_balancers))
+        return load_balancers
+    except Exception as e:
+        print(f"Error describing load balancers for profile {profile} in {region}: {e}")
+        metrics.record_dropped(profile, region, 'elbv2:DescribeLoadBalancers', e)
+        return []
+
+def build_dns_index(profiles, regions, workers=None):
+    # (profile, DNSName) -> the same shape the CLI --query produced. Regions are
+    # applied in the given order, so the first region holding a name wins.
+    dns_index = {}
+    tasks = (
+        Task(profile, region, 'elbv2', 'describe_load_balancers', partial(fetch_load_balancers, profile, region))
+        for profile in profiles
+        for region in regions
+    )
+    for task, load_balancers in run_tasks(tasks, workers or 1):
+        for lb in load_balancers:
+            dns_index.setdefault((task.account, lb['DNSName']), {
+                'ARN': lb['LoadBalancerArn'],
+                'Type': lb.get('Type'),
+                'AccountId': owner_account_id(lb),
+                'DNSName': lb['DNSName']
+            })
+    return dns_index
+
+def join_load_balancers(tasks, dns_index):
+    for profile, region, dns_value, record_type in tasks:
+        match = dns_index.get((profile, dns_value))
+        yield [match] if match else [], profile, record_type, dns_value
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Match route53zones.csv records against network load balancers')
+    parser.add_argument('--input', default='route53zones.csv',
+                        help='aws_r53export.py output to read, in any of its formats (default: route53zones.csv)')
+    # Defaults to the executor's own sizing, as before --workers existed
+    add_workers_argument(parser, default=None)
+    parser.add_argument('--mode', choices=['join', 'cli'], default='join',
+                        help="'join' lists load balancers once per profile and region; 'cli' runs one aws CLI query per row")
+    parser.add_argument('--regions', default='us-west-2',
+                        help='Comma-separated regions to search (cli mode only uses the first)')
+    add_output_arguments(parser, appendable=True)
+    add_cache_arguments(parser)
+    add_cassette_arguments(parser)
+    add_credentials_arguments(parser)
+    add_region_map_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    open_cache(args.cache, args.no_cache, args.refresh)
+    open_cassette(args.record, args.replay, args.replay_latency)
+    open_region_map(args.region_map, args.no_region_map, args.all_regions)
+
+    # Specify the path to your input file; its extension picks the reader
+    csv_file = args.input
+
+    # Specify the AWS regions
+    aws_regions = [region.strip() for region in args.regions.split(',') if region.strip()]
+
+    # Specify the output CSV file
+    output_csv_file = output_path("nlb-waf-candidates.csv", args.output_format)
+
+    # Counters for skipped and matched records
+    skipped_records = 0
+    matched_records = 0
+
+    # Read each row, only the columns the lookups use
+    reader = read_rows(csv_file, columns=["Profile", "Record Value", "Record Type"])
+    tasks = [(row["Profile"], aws_regions[0], row["Record Value"], row["Record Type"]) for row in reader]
+
+    profiles = list(dict.fromkeys(task[0] for task in tasks))
+    if not open_credentials(profiles, args.sso_login):
+        return
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        if cache.enabled or region_map.enabled:
+            # Link each profile to its account ID before listing anything, so
+            # entries and regions stored by the other scripts' sweeps are found
+            list(executor.map(get_account_id, profiles))
+        if args.mode == 'cli':
+            results = executor.map(describe_load_balancer, tasks)
+        else:
+            results = join_load_balancers(tasks, build_dns_index(profiles, aws_regions, args.workers))
 
-            for i, result in enumerate(executor.map(describe_load_balancer, tasks), start=1):
+        fieldnames = ["Profile", "Record Type", "DNS Value (CSV)", "AWS Load Balancer ARN", "AWS Load Balancer Type", "AWS Owner Account ID", "AWS DNSName"]
+        # Appends to earlier runs; the header is only written to a new file
+        with open_writer(output_csv_file, fieldnames, append=True) as writer:
+            for i, result in enumerate(results, start=1):
                 if result:
                     if result[0] and result[0][0] and result[0][0]["Type"] == "network":
                         # ... (print and process the matched record)
@@ -104,6 +177,14 @@ with open(csv_file, newline='') as csvfile:
                         skipped_records += 1
 
 
-# Print the totals
-print(f"Total of Skipped Records: {skipped_records}")
-print(f"Total of Matched Records: {matched_records}")
+    # Print the totals
+    print(f"Total of Skipped Records: {skipped_records}")
+    print(f"Total of Matched Records: {matched_records}")
+    cache.print_stats()
+    cassette.print_stats()
+    credentials.print_stats()
+    region_map.print_stats()
+    write_run_metrics('aws_nlbcheck', args.metrics_dir, args.profile_report)
+
+if __name__ == "__main__":
+    main()
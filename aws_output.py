@@ -0,0 +1,324 @@
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+
+from aws_csv_writer import StreamingCsvWriter
+
+# Optional: only needed for the formats that use them
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Format name -> file extension; outputs are named by swapping the .csv
+# extension, and read back by theirs
+FORMATS = {
+    'csv': '.csv',
+    'ndjson': '.ndjson',
+    'ndjson.gz': '.ndjson.gz',
+    'ndjson.zst': '.ndjson.zst',
+    'arrow': '.arrow',
+    'parquet': '.parquet'
+}
+APPENDABLE_FORMATS = ['csv', 'ndjson', 'ndjson.gz', 'ndjson.zst']
+BATCH_ROWS = 65536
+
+
+def missing_dependency(output_format):
+    if output_format == 'ndjson.zst' and zstandard is None:
+        return 'zstandard'
+    if output_format in ('arrow', 'parquet') and pyarrow is None:
+        return 'pyarrow'
+    return None
+
+
+def format_of(path):
+    # Longest extension first, so .ndjson.gz is not taken for .gz
+    for output_format, extension in sorted(FORMATS.items(), key=lambda item: -len(item[1])):
+        if path.endswith(extension):
+            return output_format
+    return 'csv'
+
+
+def output_path(path, output_format):
+    extension = FORMATS[format_of(path)]
+    base = path[:-len(extension)] if path.endswith(extension) else path
+    return base + FORMATS[output_format]
+
+
+class NdjsonWriter:
+    # StreamingCsvWriter's contract (buffered appends, '<path>.partial' until
+    # close, checkpoint offsets to resume from) with one JSON object per line,
+    # so values keep their types. Compressed output ends a gzip member or zstd
+    # frame at every checkpoint: the file is valid at each checkpoint offset,
+    # and a resumed run appends new members after it.
+    def __init__(self, path, fieldnames, append=False, buffer_rows=500, fsync_every=5000, resume_offset=None,
+                 compression=None):
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.append = append
+        self.buffer_rows = buffer_rows
+        self.fsync_every = fsync_every
+        self.compression = compression
+        self.rows_written = 0
+        self._buffer = []
+        self._unsynced = 0
+        self._stream = None
+
+        self.partial_path = path if append else path + '.partial'
+        if resume_offset is not None and os.path.exists(self.partial_path):
+            os.truncate(self.partial_path, resume_offset)
+            self._file = open(self.partial_path, 'ab')
+        else:
+            self._file = open(self.partial_path, 'ab' if append else 'wb')
+        if compression == 'zstd':
+            self._compressor = zstandard.ZstdCompressor()
+
+    def writerow(self, row):
+        if isinstance(row, dict):
+            row = {field: row.get(field) for field in self.fieldnames}
+        else:
+            row = dict(zip(self.fieldnames, row))
+        self._buffer.append(row)
+        if len(self._buffer) >= self.buffer_rows:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def _open_stream(self):
+        if self.compression == 'gzip':
+            return gzip.GzipFile(fileobj=self._file, mode='wb', mtime=0)
+        if self.compression == 'zstd':
+            return self._compressor.stream_writer(self._file)
+        return self._file
+
+    def _end_stream(self):
+        # Completes the current gzip member or zstd frame
+        if self._stream is None or self._stream is self._file:
+            return
+        if self.compression == 'gzip':
+            self._stream.close()
+            self._stream = None
+        else:
+            self._stream.flush(zstandard.FLUSH_FRAME)
+
+    def flush(self):
+        if self._buffer:
+            if self._stream is None:
+                self._stream = self._open_stream()
+            self._stream.write(''.join(json.dumps(row, default=str) + '\n' for row in self._buffer).encode())
+            self.rows_written += len(self._buffer)
+            self._unsynced += len(self._buffer)
+            self._buffer = []
+        self._file.flush()
+
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def checkpoint(self):
+        self.flush()
+        self._end_stream()
+        self.sync()
+        return self._file.tell()
+
+    def _finish(self):
+        self.flush()
+        self._end_stream()
+        self.sync()
+        self._file.close()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._finish()
+        if not self.append:
+            os.replace(self.partial_path, self.path)
+
+    def abort(self):
+        if self._file.closed:
+            return
+        self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def arrow_type(values):
+    # The column type of the first value present; bool before int, since
+    # bool is an int
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            return pyarrow.bool_()
+        if isinstance(value, int):
+            return pyarrow.int64()
+        if isinstance(value, float):
+            return pyarrow.float64()
+        break
+    return pyarrow.string()
+
+
+def read_batches(lines, batch_rows=BATCH_ROWS):
+    batch = []
+    for line in lines:
+        batch.append(json.loads(line))
+        if len(batch) == batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ColumnarWriter(NdjsonWriter):
+    # Arrow IPC or Parquet. Rows are staged as NDJSON in '<path>.partial',
+    # which keeps checkpoints and resume working, and converted on close in
+    # batches of batch_rows, one Parquet row group or Arrow record batch
+    # each. Column types come from the first batch.
+    def __init__(self, path, fieldnames, append=False, buffer_rows=500, fsync_every=5000, resume_offset=None,
+                 parquet=False, batch_rows=BATCH_ROWS):
+        if append:
+            raise ValueError(f"{path}: Arrow and Parquet outputs can not be appended to")
+        super().__init__(path, fieldnames, buffer_rows=buffer_rows, fsync_every=fsync_every, resume_offset=resume_offset)
+        self.parquet = parquet
+        self.batch_rows = batch_rows
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._finish()
+        converting_path = self.path + '.converting'
+        with open(self.partial_path, 'r') as staged:
+            self._convert(staged, converting_path)
+        os.replace(converting_path, self.path)
+        os.remove(self.partial_path)
+
+    def _convert(self, staged, path):
+        schema = None
+        writer = None
+        try:
+            for rows in read_batches(staged, self.batch_rows):
+                columns = {field: [row.get(field) for row in rows] for field in self.fieldnames}
+                if schema is None:
+                    schema = pyarrow.schema([(field, arrow_type(columns[field])) for field in self.fieldnames])
+                    writer = self._open(path, schema)
+                table = pyarrow.Table.from_pydict(self._coerce(columns, schema), schema=schema)
+                if self.parquet:
+                    writer.write_table(table, row_group_size=self.batch_rows)
+                else:
+                    writer.write_table(table, max_chunksize=self.batch_rows)
+            if writer is None:
+                # No rows: still a readable file with every column
+                schema = pyarrow.schema([(field, pyarrow.string()) for field in self.fieldnames])
+                writer = self._open(path, schema)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def _open(self, path, schema):
+        if self.parquet:
+            return pyarrow.parquet.ParquetWriter(path, schema, compression='zstd')
+        return pyarrow.ipc.new_file(path, schema)
+
+    def _coerce(self, columns, schema):
+        # Later batches may hold values of another type in a column typed by
+        # the first one; strings are the one type everything converts to
+        for field in schema:
+            if field.type == pyarrow.string():
+                columns[field.name] = [None if value is None else str(value) for value in columns[field.name]]
+        return columns
+
+
+def open_writer(path, fieldnames, **kwargs):
+    # The writer for path's format, with StreamingCsvWriter's arguments;
+    # write_header only applies to CSV
+    output_format = format_of(path)
+    if output_format == 'csv':
+        return StreamingCsvWriter(path, fieldnames, **kwargs)
+    kwargs.pop('write_header', None)
+    if output_format == 'ndjson':
+        return NdjsonWriter(path, fieldnames, **kwargs)
+    if output_format == 'ndjson.gz':
+        return NdjsonWriter(path, fieldnames, compression='gzip', **kwargs)
+    if output_format == 'ndjson.zst':
+        return NdjsonWriter(path, fieldnames, compression='zstd', **kwargs)
+    return ColumnarWriter(path, fieldnames, parquet=output_format == 'parquet', **kwargs)
+
+
+def open_text(path):
+    output_format = format_of(path)
+    if output_format == 'ndjson.gz':
+        return gzip.open(path, 'rt')
+    if output_format == 'ndjson.zst':
+        # One frame per checkpoint
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader)
+    return open(path, 'r', newline='')
+
+
+def read_rows(path, columns=None):
+    # Rows of any output as dicts, limited to columns if given. CSV values
+    # are strings; the other formats keep the types they were written with.
+    output_format = format_of(path)
+    dependency = missing_dependency(output_format)
+    if dependency:
+        raise ImportError(f"Reading {path} needs the {dependency} package")
+    if output_format in ('arrow', 'parquet'):
+        if output_format == 'parquet':
+            batches = pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=BATCH_ROWS, columns=columns)
+        else:
+            reader = pyarrow.ipc.open_file(path)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        for batch in batches:
+            if columns is not None and output_format == 'arrow':
+                batch = batch.select(columns)
+            yield from batch.to_pylist()
+        return
+
+    with open_text(path) as text:
+        rows = csv.DictReader(text) if output_format == 'csv' else map(json.loads, text)
+        for row in rows:
+            yield row if columns is None else {column: row.get(column) for column in columns}
+
+
+def output_format_type(appendable=False):
+    choices = APPENDABLE_FORMATS if appendable else list(FORMATS)
+
+    def parse(value):
+        if value not in choices:
+            raise argparse.ArgumentTypeError(f"invalid choice: {value!r} (choose from {', '.join(choices)})")
+        dependency = missing_dependency(value)
+        if dependency:
+            raise argparse.ArgumentTypeError(f"{value} output needs the {dependency} package")
+        return value
+    return parse
+
+
+def add_output_arguments(parser, appendable=False):
+    # appendable limits the choices to formats an existing file can be extended in
+    choices = APPENDABLE_FORMATS if appendable else list(FORMATS)
+    parser.add_argument('--output-format', default='csv', type=output_format_type(appendable), metavar='FORMAT',
+                        help=f"Write outputs as {', '.join(choices)} (default: csv); "
+                             f"the .csv extension is replaced to match")
@@ -0,0 +1,44 @@
+def paginate(client, operation, result_key, **params):
+    # Yield items page by page so callers can start working on the first page
+    # while later pages are still being fetched.
+    paginator = client.get_paginator(operation)
+    for page in paginator.paginate(**params):
+        yield from page.get(result_key, [])
+
+
+def iter_hosted_zones(route53_client):
+    return paginate(route53_client, 'list_hosted_zones', 'HostedZones')
+
+
+def iter_resource_record_sets(route53_client, hosted_zone_id, **params):
+    return paginate(route53_client, 'list_resource_record_sets', 'ResourceRecordSets', HostedZoneId=hosted_zone_id, **params)
+
+
+def iter_load_balancers(elbv2_client):
+    return paginate(elbv2_client, 'describe_load_balancers', 'LoadBalancers')
+
+
+def iter_network_acls(ec2_client, **params):
+    return paginate(ec2_client, 'describe_network_acls', 'NetworkAcls', **params)
+
+
+def iter_reservations(ec2_client, **params):
+    return paginate(ec2_client, 'describe_instances', 'Reservations', **params)
+
+
+def iter_classic_load_balancers(elb_client):
+    return paginate(elb_client, 'describe_load_balancers', 'LoadBalancerDescriptions')
+
+
+def iter_distributions(cloudfront_client):
+    # The distributions sit one level down, under DistributionList
+    for page in cloudfront_client.get_paginator('list_distributions').paginate():
+        yield from page.get('DistributionList', {}).get('Items', [])
+
+
+def iter_buckets(s3_client):
+    return paginate(s3_client, 'list_buckets', 'Buckets')
+
+
+def iter_domain_names(apigateway_client):
+    return paginate(apigateway_client, 'get_domain_names', 'items')
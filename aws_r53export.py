@@ -1,10 +1,24 @@
-import subprocess
 import json
 import os
-import csv
 from configparser import ConfigParser
 import signal
 import sys
+import time
+from functools import partial
+
+from aws_cache import DEFAULT_CACHE_PATH, cache, open_cache
+from aws_cassette import cassette, open_cassette
+from aws_clients import pool
+from aws_collector import Account, Route53ZonesReport, collect, filter_records, print_record
+from aws_fanout import Task, run_tasks
+from aws_journal import JobJournal
+from aws_metrics import metrics, write_run_metrics
+from aws_output import FORMATS, missing_dependency, open_writer, output_path
+from aws_ratelimit import run_cli
+from aws_records import project_record
+from aws_snapshot import DEFAULT_MAX_AGE_HOURS, open_snapshot
+
+journal = None
 
 def cleanup():
     print("\nScript terminated. Cleaning up...")
@@ -12,7 +26,11 @@ def cleanup():
     sys.exit(0)
 
 def handle_interrupt(signum, frame):
-    cleanup()
+    # With a journal, finish and checkpoint the in-flight zones before exiting
+    if journal is not None:
+        journal.request_stop(signum, frame)
+    else:
+        cleanup()
 
 def get_aws_profiles():
     # Parse the AWS CLI config file to get a list of profiles
@@ -27,87 +45,121 @@ def get_aws_profiles():
         print(f"Error reading AWS profiles from {config_file_path}: {e}")
         return []
 
-def get_all_hosted_zones(profile):
+def get_all_hosted_zones_cli(profile):
     try:
         # Get all hosted zones for the specified profile
-        result = subprocess.run(['aws', 'route53', 'list-hosted-zones', '--profile', profile], capture_output=True, text=True)
+        result = run_cli(profile, None, 'route53', ['aws', 'route53', 'list-hosted-zones', '--profile', profile], capture_output=True, text=True)
         hosted_zones = json.loads(result.stdout)['HostedZones']
         return [zone['Id'].split('/')[-1] for zone in hosted_zones]
     except Exception as e:
         print(f"Error getting all hosted zones for profile {profile}: {e}")
+        metrics.record_dropped(profile, None, 'route53:list-hosted-zones (cli)', e)
         return []
 
-def get_records_for_hosted_zone(profile, hosted_zone_id):
+def get_records_for_hosted_zone_cli(profile, hosted_zone_id):
     try:
         # Get records for the specified hosted zone
-        result = subprocess.run(['aws', 'route53', 'list-resource-record-sets', '--hosted-zone-id', hosted_zone_id, '--profile', profile], capture_output=True, text=True)
+        result = run_cli(profile, None, 'route53', ['aws', 'route53', 'list-resource-record-sets', '--hosted-zone-id', hosted_zone_id, '--profile', profile], capture_output=True, text=True)
         records = json.loads(result.stdout)['ResourceRecordSets']
         return records
     except Exception as e:
         print(f"Error getting records for hosted zone {hosted_zone_id} in profile {profile}: {e}")
+        metrics.record_dropped(profile, None, 'route53:list-resource-record-sets (cli)', e, hosted_zone_id)
         return None
 
-def filter_records(records):
-    # Filter Type A records with alias settings or CNAME values
-    filtered_records = [record for record in records if
-                        (record['Type'] == 'A' and 'AliasTarget' in record) or record['Type'] == 'CNAME']
-    return filtered_records
-
-def print_record(profile, record, show_stdout=False):
-    record_type = record['Type']
-    record_name = record['Name']
-    
-    if record_type == 'A' and 'AliasTarget' in record:
-        # If it's an A record with AliasTarget, use DNSName as the value
-        record_value = record['AliasTarget']['DNSName']
-    else:
-        record_value = record.get('ResourceRecords', [{}])[0].get('Value', 'N/A')
+def collect_zone_rows(profile, hosted_zone_id, show_stdout=False):
+    records = get_records_for_hosted_zone_cli(profile, hosted_zone_id)
+    if not records:
+        return []
+    return [print_record(profile, record, show_stdout) for record in filter_records(map(project_record, records))]
+
+def zone_tasks(profiles, show_stdout=False):
+    for profile in profiles:
+        print(f"Profile: {profile}")
+        print("Processing Records...")
 
-    if show_stdout:
-        # Print record to stdout with a new line character
-        print(f"Profile: {profile}, Type: {record_type}, Name: {record_name}, Value: {record_value}\n")
+        hosted_zone_ids = get_all_hosted_zones_cli(profile)
+        for hosted_zone_id in hosted_zone_ids or []:
+            yield Task(profile, None, 'route53', 'list_resource_record_sets',
+                       partial(collect_zone_rows, profile, hosted_zone_id, show_stdout), hosted_zone_id)
 
-    return profile, record_type, record_name, record_value
+        print("Completed\n")
 
-def write_to_csv(data):
-    with open('route53zones.csv', 'a', newline='') as csvfile:
-        csv_writer = csv.writer(csvfile)
-        csv_writer.writerow(data)
+def export_cli(profiles, show_stdout=False, workers=1, restart=False, filename='route53zones.csv'):
+    # The original one-subprocess-per-call path, kept for benchmarking
+    global journal
 
-def main(profile=None, show_stdout=False):
+    journal = JobJournal('route53zones.journal', restart=restart)
+
+    csv_writer = open_writer(filename, Route53ZonesReport.fieldnames, resume_offset=journal.resume_offset(filename))
+    tasks = journal.pending(zone_tasks(profiles, show_stdout), lambda task: (task.account, task.key))
+    try:
+        for task, rows in run_tasks(tasks, workers):
+            csv_writer.writerows(rows)
+            journal.mark_done((task.account, task.key), csv_writer)
+    except BaseException:
+        csv_writer.abort()
+        raise
+
+    return journal.finish(csv_writer)
+
+def main(profile=None, show_stdout=False, backend='api', workers=1, snapshot_path='route53zones.snapshot.db', full=False,
+         snapshot_max_age=DEFAULT_MAX_AGE_HOURS, restart=False, metrics_dir='.', profile_report=0, cache_path=DEFAULT_CACHE_PATH, refresh=False,
+         record=None, replay=None, output_format='csv'):
     # Set up signal handlers for graceful termination
     signal.signal(signal.SIGINT, handle_interrupt)
     signal.signal(signal.SIGTERM, handle_interrupt)
 
-    # Clear the existing CSV file or create a new one
-    with open('route53zones.csv', 'w', newline='') as csvfile:
-        csv_writer = csv.writer(csvfile)
-        csv_writer.writerow(['Profile', 'Record Type', 'Record Name', 'Record Value'])
-
+    started = time.perf_counter()
+    open_cache(cache_path, cache_path is None, refresh)
+    open_cassette(record, replay)
     profiles = [profile] if profile else get_aws_profiles()
+    # Zone metadata for the fingerprint check only comes from the api backend
+    snapshot = open_snapshot(snapshot_path, not snapshot_path or backend != 'api', snapshot_max_age)
+    filename = output_path('route53zones.csv', output_format)
+    delta_filename = output_path('route53zones.delta.csv', output_format)
 
-    for profile in profiles:
-        print(f"Profile: {profile}")
-        print("Processing Records...")
-
-        hosted_zone_ids = get_all_hosted_zones(profile)
-        if hosted_zone_ids:
-            for hosted_zone_id in hosted_zone_ids:
-                records = get_records_for_hosted_zone(profile, hosted_zone_id)
-                if records:
-                    filtered_records = filter_records(records)
-                    if filtered_records:
-                        for record in filtered_records:
-                            data = print_record(profile, record, show_stdout)
-                            write_to_csv(data)
-
-        print("Completed\n")
-
-    print("Processing complete.")
+    if backend == 'cli':
+        finished = export_cli(profiles, show_stdout, workers, restart, filename)
+    else:
+        # A view over the collector: only the route53zones report, with each
+        # profile standing in for its account
+        accounts = [Account(profile, profile) for profile in profiles]
+        report = Route53ZonesReport(filename=filename, show_stdout=show_stdout)
+        finished, delta_writer = collect(accounts, [report], workers, 'route53zones.journal', restart, snapshot, full,
+                                         delta_filename)
+
+    write_run_metrics('aws_r53export', metrics_dir, profile_report)
+
+    if not finished:
+        cleanup()
+
+    print(f"Processing complete using the {backend} backend in {time.perf_counter() - started:.2f}s.")
+    if snapshot is not None:
+        print(f"Exported {delta_writer.rows_written} record changes to {delta_filename}")
+        snapshot.print_stats()
+        snapshot.close()
+    if backend == 'api':
+        pool.print_stats()
+    cache.print_stats()
+    cassette.print_stats()
 
 if __name__ == "__main__":
     profile = None
     show_stdout = False
+    backend = 'api'
+    workers = 1
+    snapshot_path = 'route53zones.snapshot.db'
+    full = False
+    snapshot_max_age = DEFAULT_MAX_AGE_HOURS
+    restart = False
+    metrics_dir = '.'
+    profile_report = 0
+    cache_path = DEFAULT_CACHE_PATH
+    refresh = False
+    record = None
+    replay = None
+    output_format = 'csv'
 
     # Parse command-line arguments
     args = iter(sys.argv[1:])
@@ -116,6 +168,55 @@ if __name__ == "__main__":
             profile = next(args, None)
         elif arg == '-stdout':
             show_stdout = True
-
-    main(profile=profile, show_stdout=show_stdout)
+        elif arg == '-backend':
+            # 'cli' keeps the original one-subprocess-per-call path for benchmarking
+            backend = next(args, 'api')
+        elif arg == '--workers':
+            workers = int(next(args, 1))
+        elif arg == '-snapshot':
+            snapshot_path = next(args, snapshot_path)
+        elif arg == '-nosnapshot':
+            snapshot_path = None
+        elif arg == '-full':
+            # Re-list every zone even when its fingerprint is unchanged
+            full = True
+        elif arg == '-maxage':
+            # Hours an unchanged zone's snapshot is reused; edits that keep its
+            # record count are only caught once this passes or with -full
+            snapshot_max_age = float(next(args, snapshot_max_age))
+        elif arg == '-restart':
+            # Discard an interrupted run's journal instead of resuming it
+            restart = True
+        elif arg == '--metrics-dir':
+            metrics_dir = next(args, metrics_dir)
+        elif arg == '--profile-report':
+            # Print the N slowest (account, region, operation) units
+            profile_report = int(next(args, 10))
+        elif arg == '-cache':
+            cache_path = next(args, cache_path)
+        elif arg == '-nocache':
+            cache_path = None
+        elif arg == '-refresh':
+            # Ignore cached listings but store the fresh ones
+            refresh = True
+        elif arg == '-record':
+            # Record every AWS response of this run to a cassette
+            record = next(args, None)
+        elif arg == '-replay':
+            # Serve AWS responses from a recorded cassette instead of AWS
+            replay = next(args, None)
+        elif arg == '-format':
+            # csv, ndjson, ndjson.gz, ndjson.zst, arrow or parquet
+            output_format = next(args, output_format)
+            if output_format not in FORMATS:
+                print(f"Unknown output format {output_format}; choose from {', '.join(FORMATS)}")
+                sys.exit(2)
+            if missing_dependency(output_format):
+                print(f"{output_format} output needs the {missing_dependency(output_format)} package")
+                sys.exit(2)
+
+    main(profile=profile, show_stdout=show_stdout, backend=backend, workers=workers,
+         snapshot_path=snapshot_path, full=full, snapshot_max_age=snapshot_max_age, restart=restart, metrics_dir=metrics_dir,
+         profile_report=profile_report, cache_path=cache_path, refresh=refresh,
+         record=record, replay=replay, output_format=output_format)
 
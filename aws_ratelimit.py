@@ -0,0 +1,171 @@
+import random
+import re
+import threading
+import time
+from functools import partial
+
+from botocore.config import Config
+
+from aws_cache import cache
+from aws_cassette import cassette
+from aws_metrics import THROTTLE_CODES, run_command
+
+# Requests per second each (account, service) starts at and never exceeds.
+# Route53 allows 5 per account; the others are the EC2 and ELB defaults for
+# describe calls with some headroom.
+DEFAULT_RATES = {'route53': 5, 'elbv2': 10, 'ec2': 20}
+DEFAULT_RATE = 10
+MIN_RATE = 0.5
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 20
+
+# What AWS CLI stderr says when a call is worth retrying, matching
+# is_retryable: a throttle, a 5xx (by code or bare status) or a failed
+# connection. Anything else, such as AccessDenied, NoSuchHostedZone or an
+# expired token, fails the same way on every attempt.
+CLI_SERVER_ERRORS = re.compile(
+    r'\((InternalError|InternalFailure|InternalServerError|ServiceUnavailable|5\d\d)\)'
+    r'|Could not connect to the endpoint URL|Connect timeout on endpoint URL|Read timeout on endpoint URL'
+    r'|Connection was closed'
+)
+
+# Clients leave retrying to the limiter's needs-retry handler
+CLIENT_CONFIG = Config(retries={'mode': 'standard', 'total_max_attempts': 1})
+
+
+class TokenBucket:
+    # Shared by every thread calling one service in one account. The rate is
+    # halved on each throttle and creeps back towards max_rate on success, so
+    # a run settles just under whatever the account really allows.
+    def __init__(self, rate, burst=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.throttles = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self._refill()
+            self.throttles += 1
+            self.rate = max(MIN_RATE, self.rate / 2)
+            # Stop the burst that caused it
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def decorrelated_jitter(previous, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    return min(cap, random.uniform(base, max(previous, base) * 3))
+
+
+def is_retryable(response, caught_exception):
+    if caught_exception is not None:
+        return True
+    if not response:
+        return False
+    http_response, parsed = response
+    return parsed.get('Error', {}).get('Code') in THROTTLE_CODES or http_response.status_code >= 500
+
+
+def is_retryable_cli(stderr):
+    return any(code in stderr for code in THROTTLE_CODES) or CLI_SERVER_ERRORS.search(stderr) is not None
+
+
+class RateLimiter:
+    def __init__(self, rates=None, max_attempts=MAX_ATTEMPTS):
+        self.rates = dict(DEFAULT_RATES, **(rates or {}))
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def bucket(self, account, service):
+        key = (account, service)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rates.get(service, DEFAULT_RATE))
+            return bucket
+
+    def instrument(self, client, account):
+        # Every HTTP attempt, retries included, takes a token first; retries
+        # are decided here instead of by botocore (see CLIENT_CONFIG).
+        bucket = self.bucket(account, client.meta.service_model.service_name)
+
+        def before_send(**_):
+            bucket.acquire()
+
+        def needs_retry(response, attempts, caught_exception, request_dict, **_):
+            throttled = bool(response) and response[1].get('Error', {}).get('Code') in THROTTLE_CODES
+            if throttled:
+                bucket.throttled()
+            elif response and response[0].status_code < 300:
+                bucket.succeeded()
+
+            if attempts >= self.max_attempts or not is_retryable(response, caught_exception):
+                return None
+            context = request_dict['context']
+            context['ratelimit_delay'] = decorrelated_jitter(context.get('ratelimit_delay', BACKOFF_BASE))
+            return context['ratelimit_delay']
+
+        client.meta.events.register('before-send', before_send)
+        client.meta.events.register_first('needs-retry', needs_retry)
+        return client
+
+    def run_command(self, account, region, service, command, **kwargs):
+        # AWS CLI subprocesses get the same limit and backoff as boto3 calls
+        bucket = self.bucket(account, service)
+        delay = BACKOFF_BASE
+        for attempt in range(1, self.max_attempts + 1):
+            bucket.acquire()
+            result = run_command(account, region, command, **kwargs)
+            if result.returncode == 0:
+                bucket.succeeded()
+                return result
+
+            stderr = result.stderr or ''
+            print(f"Error executing AWS CLI command: {stderr}")
+            if any(code in stderr for code in THROTTLE_CODES):
+                bucket.throttled()
+            if not is_retryable_cli(stderr):
+                return result
+            if attempt < self.max_attempts:
+                delay = decorrelated_jitter(delay)
+                print(f"Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+        return result
+
+    def throttle_counts(self):
+        with self._lock:
+            return {key: (bucket.throttles, bucket.rate) for key, bucket in self._buckets.items() if bucket.throttles}
+
+
+limiter = RateLimiter()
+
+
+def run_cli(account, region, service, command, **kwargs):
+    # A replayed or cached response, in that order, skips the limiter entirely
+    run = partial(limiter.run_command, account, region, service, command, **kwargs)
+    return cassette.run_command(account, region, command, partial(cache.run_command, account, region, command, run))
@@ -0,0 +1,45 @@
+import sys
+from collections import namedtuple
+
+# Compact stand-ins for the API payloads a crawl keeps in memory. Raw
+# responses are projected to these as soon as they arrive, keeping only the
+# fields the reports write. Strings that repeat across many records (record
+# types, zone names, account ids, the load balancer a record points at) are
+# interned, so every record shares one copy.
+HostedZone = namedtuple('HostedZone', ['id', 'name'])
+# value is the alias target's DNS name, or the first of the record's values
+DnsRecord = namedtuple('DnsRecord', ['name', 'type', 'value', 'alias'])
+LoadBalancer = namedtuple('LoadBalancer', ['arn', 'name', 'dns_name', 'type'])
+NetworkAcl = namedtuple('NetworkAcl', ['id', 'is_default'])
+# A hosted zone with the account and profile it was listed with
+AccountZone = namedtuple('AccountZone', ['account_id', 'zone_id', 'name', 'private', 'profile'])
+
+
+def intern_text(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def project_zone(zone):
+    return HostedZone(zone['Id'], intern_text(zone['Name']))
+
+
+def project_record(record):
+    if 'AliasTarget' in record:
+        return DnsRecord(record['Name'], intern_text(record['Type']), intern_text(record['AliasTarget']['DNSName']), True)
+    values = record.get('ResourceRecords')
+    value = values[0]['Value'] if values else None
+    return DnsRecord(record['Name'], intern_text(record['Type']), intern_text(value), False)
+
+
+def project_load_balancer(lb):
+    return LoadBalancer(lb.get('LoadBalancerArn', ''), lb.get('LoadBalancerName', ''), lb.get('DNSName', ''),
+                        intern_text(lb.get('Type', '')))
+
+
+def project_network_acl(acl):
+    return NetworkAcl(acl['NetworkAclId'], acl.get('IsDefault', False))
+
+
+def project_account_zone(account_id, profile, zone):
+    private = zone['Config']['PrivateZone'] if 'Config' in zone else False
+    return AccountZone(intern_text(account_id), zone['Id'], intern_text(zone['Name']), private, intern_text(profile))
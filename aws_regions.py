@@ -0,0 +1,142 @@
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from aws_cassette import cassette
+from aws_clients import get_client
+
+DEFAULT_REGION_MAP_PATH = 'region_map.db'
+# A listing that came back empty is trusted for this long before the
+# region is listed again; the enabled regions of an account change rarely
+EMPTY_RECHECK = 24 * 3600
+ENABLED_RECHECK = 7 * 24 * 3600
+
+
+class RegionMap:
+    # Per account: which regions are enabled, and which (listing, region)
+    # pairs were empty the last time they were listed. Sweeps ask
+    # should_list before each regional listing and record what it found, so
+    # the next run skips regions known to be empty until they are due for
+    # another look. Nothing is skipped until open() is called.
+    def __init__(self, empty_recheck=EMPTY_RECHECK, enabled_recheck=ENABLED_RECHECK):
+        self.empty_recheck = empty_recheck
+        self.enabled_recheck = enabled_recheck
+        self.path = None
+        self.refresh = False
+        self.skipped_empty = 0
+        self.skipped_disabled = 0
+        self._lock = threading.Lock()
+        self._enabled = {}
+        self._db = None
+
+    def open(self, path=DEFAULT_REGION_MAP_PATH, refresh=False):
+        self.close()
+        db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript('''
+            CREATE TABLE IF NOT EXISTS enabled_regions (
+                account TEXT PRIMARY KEY, regions TEXT, checked_at REAL);
+            CREATE TABLE IF NOT EXISTS listings (
+                account TEXT, listing TEXT, region TEXT, items INTEGER, checked_at REAL,
+                PRIMARY KEY (account, listing, region));
+        ''')
+        with self._lock:
+            self._db = db
+            self.path = path
+            self.refresh = refresh
+            self._enabled = {}
+
+    @property
+    def enabled(self):
+        return self._db is not None
+
+    def _fetch_enabled_regions(self, account, profile):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT regions, checked_at FROM enabled_regions WHERE account = ?', (account,)).fetchone()
+        if row is not None and not self.refresh and now - row[1] < self.enabled_recheck:
+            return set(json.loads(row[0]))
+
+        try:
+            # Without AllRegions, only the regions enabled for the account
+            regions = get_client(profile, 'ec2', 'us-east-1').describe_regions().get('Regions')
+        except Exception as e:
+            print(f"Error listing the enabled regions for account {profile}: {e}")
+            return None
+        if not regions:
+            return None
+        names = sorted(region['RegionName'] for region in regions)
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO enabled_regions VALUES (?, ?, ?)', (account, json.dumps(names), now))
+        return set(names)
+
+    def enabled_regions(self, account, profile):
+        # None when unknown; every region task of an account waits on one lookup
+        with self._lock:
+            future = self._enabled.get(account)
+            owner = future is None
+            if owner:
+                future = self._enabled[account] = Future()
+        if owner:
+            future.set_result(self._fetch_enabled_regions(account, profile))
+        return future.result()
+
+    def should_list(self, account, profile, listing, region):
+        if not self.enabled:
+            return True
+        account = str(account)
+        enabled = self.enabled_regions(account, profile)
+        if enabled is not None and region not in enabled:
+            with self._lock:
+                self.skipped_disabled += 1
+            return False
+        if self.refresh:
+            return True
+
+        with self._lock:
+            row = self._db.execute(
+                'SELECT items, checked_at FROM listings WHERE account = ? AND listing = ? AND region = ?', (account, listing, region)
+            ).fetchone()
+            if row is not None and row[0] == 0 and time.time() - row[1] < self.empty_recheck:
+                self.skipped_empty += 1
+                return False
+        return True
+
+    def record(self, account, listing, region, items):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)',
+                             (str(account), listing, region, items, time.time()))
+
+    def print_stats(self):
+        if self.enabled:
+            print(f"Region map {self.path}: skipped {self.skipped_empty} empty and {self.skipped_disabled} disabled regions, "
+                  f"saving {self.skipped_empty + self.skipped_disabled} listing calls")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+            self._db = None
+
+
+region_map = RegionMap()
+
+
+def add_region_map_arguments(parser):
+    parser.add_argument('--region-map', default=DEFAULT_REGION_MAP_PATH,
+                        help=f'SQLite map of the regions each account uses, kept between runs (default: {DEFAULT_REGION_MAP_PATH})')
+    parser.add_argument('--no-region-map', action='store_true', help='List every region and leave the region map alone')
+    parser.add_argument('--all-regions', action='store_true',
+                        help='List every enabled region, including ones known to be empty, and update the map')
+
+
+def open_region_map(path=DEFAULT_REGION_MAP_PATH, no_region_map=False, refresh=False):
+    # Replayed listings must not decide which regions real runs skip
+    if cassette.replaying:
+        return
+    if not no_region_map:
+        region_map.open(path, refresh)
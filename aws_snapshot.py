@@ -0,0 +1,208 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from aws_cassette import cassette
+
+# Hours a zone's records are reused while its fingerprint is unchanged
+DEFAULT_MAX_AGE_HOURS = 24
+DELTA_FIELDNAMES = ['Change', 'AccountID', 'HostedZoneId', 'RecordName', 'RecordType', 'SetIdentifier', 'OldValue', 'NewValue']
+
+
+def zone_fingerprint(zone):
+    # Built only from what list_hosted_zones already returns, so checking a
+    # zone costs no extra API calls. Edits that keep the record count the same
+    # are picked up by max_age or a full refresh.
+    config = zone.get('Config', {})
+    payload = json.dumps([
+        zone['Id'],
+        zone['Name'],
+        zone.get('ResourceRecordSetCount'),
+        zone.get('CallerReference'),
+        config.get('Comment'),
+        config.get('PrivateZone')
+    ])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def record_key(record):
+    return f"{record['Name']}|{record['Type']}|{record.get('SetIdentifier', '')}"
+
+
+def record_value(record):
+    if 'AliasTarget' in record:
+        return record['AliasTarget']['DNSName']
+    return ' '.join(value['Value'] for value in record.get('ResourceRecords', []))
+
+
+class SnapshotStore:
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE_HOURS * 3600):
+        self.path = path
+        self.max_age = max_age
+        self.zones_skipped = 0
+        self.zones_fetched = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS zones (
+                account_id TEXT, zone_id TEXT, zone_name TEXT, fingerprint TEXT, fetched_at REAL,
+                PRIMARY KEY (account_id, zone_id));
+            CREATE TABLE IF NOT EXISTS records (
+                account_id TEXT, zone_id TEXT, seq INTEGER, record_key TEXT, record_json TEXT,
+                PRIMARY KEY (account_id, zone_id, record_key));
+            CREATE TABLE IF NOT EXISTS staging (
+                account_id TEXT, zone_id TEXT, seq INTEGER, record_key TEXT, record_json TEXT,
+                PRIMARY KEY (account_id, zone_id, record_key));
+        ''')
+        # Accounts absent from the snapshot when the run starts get a baseline
+        # sync rather than a delta full of additions
+        self._known_accounts = {
+            account_id for (account_id,) in self._db.execute('SELECT DISTINCT account_id FROM zones').fetchall()
+        }
+
+    def is_unchanged(self, account_id, zone):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fingerprint, fetched_at FROM zones WHERE account_id = ? AND zone_id = ?',
+                (str(account_id), zone['Id'])
+            ).fetchone()
+        if row is None:
+            return False
+        fingerprint, fetched_at = row
+        return fingerprint == zone_fingerprint(zone) and time.time() - fetched_at < self.max_age
+
+    def cached_records(self, account_id, zone_id):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT record_json FROM records WHERE account_id = ? AND zone_id = ? ORDER BY seq',
+                (str(account_id), zone_id)
+            ).fetchall()
+        for (record_json,) in rows:
+            yield json.loads(record_json)
+
+    def iter_records(self, account_id, zone, fetch, delta, full=False):
+        # Serve an unchanged zone from the snapshot. Otherwise stream the
+        # fetched records through to the caller while staging them, and diff
+        # the staged copy against the snapshot once the listing completes.
+        # A listing that fails or is abandoned leaves the snapshot untouched.
+        account_id = str(account_id)
+        zone_id = zone['Id']
+
+        if not full and self.is_unchanged(account_id, zone):
+            with self._lock:
+                self.zones_skipped += 1
+            yield from self.cached_records(account_id, zone_id)
+            return
+
+        with self._lock:
+            self.zones_fetched += 1
+            self._db.execute('DELETE FROM staging WHERE account_id = ? AND zone_id = ?', (account_id, zone_id))
+
+        for seq, record in enumerate(fetch()):
+            with self._lock:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO staging VALUES (?, ?, ?, ?, ?)',
+                    (account_id, zone_id, seq, record_key(record), json.dumps(record, sort_keys=True, default=str))
+                )
+            yield record
+
+        delta.extend(self._commit_zone(account_id, zone))
+
+    def _commit_zone(self, account_id, zone):
+        zone_id = zone['Id']
+        params = (account_id, zone_id)
+        with self._lock:
+            added = self._db.execute('''
+                SELECT s.record_json, NULL FROM staging s
+                LEFT JOIN records r ON r.account_id = s.account_id AND r.zone_id = s.zone_id AND r.record_key = s.record_key
+                WHERE s.account_id = ? AND s.zone_id = ? AND r.record_key IS NULL ORDER BY s.seq''', params).fetchall()
+            removed = self._db.execute('''
+                SELECT NULL, r.record_json FROM records r
+                LEFT JOIN staging s ON s.account_id = r.account_id AND s.zone_id = r.zone_id AND s.record_key = r.record_key
+                WHERE r.account_id = ? AND r.zone_id = ? AND s.record_key IS NULL ORDER BY r.seq''', params).fetchall()
+            modified = self._db.execute('''
+                SELECT s.record_json, r.record_json FROM staging s
+                JOIN records r ON r.account_id = s.account_id AND r.zone_id = s.zone_id AND r.record_key = s.record_key
+                WHERE s.account_id = ? AND s.zone_id = ? AND s.record_json != r.record_json ORDER BY s.seq''', params).fetchall()
+
+            first_sync = account_id not in self._known_accounts
+
+            self._db.execute('DELETE FROM records WHERE account_id = ? AND zone_id = ?', params)
+            self._db.execute(
+                'INSERT INTO records SELECT * FROM staging WHERE account_id = ? AND zone_id = ?', params
+            )
+            self._db.execute('DELETE FROM staging WHERE account_id = ? AND zone_id = ?', params)
+            self._db.execute(
+                'INSERT OR REPLACE INTO zones VALUES (?, ?, ?, ?, ?)',
+                (account_id, zone_id, zone['Name'], zone_fingerprint(zone), time.time())
+            )
+            self._db.commit()
+
+        if first_sync:
+            return []
+        return (
+            [self._delta_row('added', account_id, zone_id, new, old) for new, old in added]
+            + [self._delta_row('removed', account_id, zone_id, new, old) for new, old in removed]
+            + [self._delta_row('modified', account_id, zone_id, new, old) for new, old in modified]
+        )
+
+    def retire_zones(self, account_id, seen_zone_ids):
+        # Zones missing from a complete listing were deleted; report their
+        # records as removed and drop them from the snapshot.
+        account_id = str(account_id)
+        delta = []
+        with self._lock:
+            zone_ids = [
+                zone_id for (zone_id,) in self._db.execute(
+                    'SELECT zone_id FROM zones WHERE account_id = ?', (account_id,)
+                ).fetchall()
+                if zone_id not in seen_zone_ids
+            ]
+            for zone_id in zone_ids:
+                rows = self._db.execute(
+                    'SELECT record_json FROM records WHERE account_id = ? AND zone_id = ? ORDER BY seq', (account_id, zone_id)
+                ).fetchall()
+                delta.extend(self._delta_row('removed', account_id, zone_id, None, old) for (old,) in rows)
+                self._db.execute('DELETE FROM records WHERE account_id = ? AND zone_id = ?', (account_id, zone_id))
+                self._db.execute('DELETE FROM zones WHERE account_id = ? AND zone_id = ?', (account_id, zone_id))
+            self._db.commit()
+        return delta
+
+    def _delta_row(self, change, account_id, zone_id, new_json, old_json):
+        new = json.loads(new_json) if new_json else None
+        old = json.loads(old_json) if old_json else None
+        record = new or old
+        return {
+            'Change': change,
+            'AccountID': account_id,
+            'HostedZoneId': zone_id,
+            'RecordName': record['Name'],
+            'RecordType': record['Type'],
+            'SetIdentifier': record.get('SetIdentifier', ''),
+            'OldValue': record_value(old) if old else '',
+            'NewValue': record_value(new) if new else ''
+        }
+
+    def print_stats(self):
+        print(f"Snapshot {self.path}: {self.zones_skipped} unchanged zones served locally, {self.zones_fetched} zones fetched")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def open_snapshot(path, no_snapshot=False, max_age_hours=DEFAULT_MAX_AGE_HOURS):
+    # None without a snapshot. A replay gets none either: replayed records
+    # must not become what the next real run diffs against.
+    if no_snapshot or cassette.replaying:
+        return None
+    return SnapshotStore(path, max_age_hours * 3600)
+
+
+def add_snapshot_max_age_argument(parser):
+    parser.add_argument('--snapshot-max-age', type=float, default=DEFAULT_MAX_AGE_HOURS, metavar='HOURS',
+                        help="Hours an unchanged zone's snapshot is reused. The fingerprint only sees zone metadata such as "
+                             "the record count, so edits that keep the count are caught only once this passes or with "
+                             f"--full (default: {DEFAULT_MAX_AGE_HOURS})")
@@ -0,0 +1,127 @@
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aws_DNSZones import compare_hosted_zone_with_csv, map_domains_to_zones
+from aws_domain_trie import normalize_domain, zone_trie
+from aws_records import AccountZone
+
+
+def make_hosted_zones(zones, accounts, rng):
+    # Every tenth zone is delegated from the one before it, and every
+    # fiftieth also exists as a private zone in another account.
+    hosted_zones = []
+    for n in range(zones):
+        if n % 10 == 9:
+            name = f'team{n}.{hosted_zones[-1].name}'
+        else:
+            name = f'domain{n}.example{n % 7}.com.'
+        account_id = f'{100000000000 + n % accounts}'
+        hosted_zones.append(AccountZone(account_id, f'/hostedzone/Z{n:012d}', name, False, account_id))
+        if n % 50 == 0:
+            other_account_id = f'{100000000000 + (n + 1) % accounts}'
+            hosted_zones.append(AccountZone(other_account_id, f'/hostedzone/P{n:012d}', name, True, other_account_id))
+    rng.shuffle(hosted_zones)
+    return hosted_zones
+
+
+def write_domain_csv(path, rows, hosted_zones, rng):
+    zone_names = [zone.name.rstrip('.') for zone in hosted_zones]
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['domain_name'])
+        for n in range(rows):
+            kind = n % 10
+            zone_name = zone_names[rng.randrange(len(zone_names))]
+            if kind == 0:
+                domain = zone_name
+            elif kind < 6:
+                domain = '.'.join(f'h{rng.randrange(1000)}' for _ in range(rng.randint(1, 3))) + '.' + zone_name
+            elif kind < 8:
+                domain = f'host{n}.unmanaged{n % 997}.org'
+            elif kind == 8:
+                domain = f'mail{n % 50}.gmail.com'
+            else:
+                domain = f'Host{n}.{zone_name.upper()}.'
+            writer.writerow([domain])
+
+
+def legacy_compare(hosted_zones, csv_filename, exclude_domain='gmail.com'):
+    # compare_hosted_zone_with_csv before the trie: exact names only, substring exclusion
+    dns_names_to_compare = set()
+    with open(csv_filename, 'r') as csv_file:
+        for row in csv.DictReader(csv_file):
+            domain_name = row['domain_name'].lower()
+            if exclude_domain not in domain_name:
+                dns_names_to_compare.add(domain_name)
+    return [zone for zone in hosted_zones if zone.name.lower() in dns_names_to_compare]
+
+
+def naive_longest_match(domain, zone_names):
+    best = None
+    for zone_name in zone_names:
+        if domain == zone_name or domain.endswith('.' + zone_name):
+            if best is None or len(zone_name) > len(best):
+                best = zone_name
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Map a synthetic domain inventory CSV onto hosted zones')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--zones', type=int, default=5000)
+    parser.add_argument('--accounts', type=int, default=50)
+    parser.add_argument('--naive-sample', type=int, default=2000,
+                        help='Rows matched with a linear scan over every zone, extrapolated to --rows')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    hosted_zones = make_hosted_zones(args.zones, args.accounts, rng)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_filename = os.path.join(workdir, 'dkim.csv')
+        started = time.perf_counter()
+        write_domain_csv(csv_filename, args.rows, hosted_zones, rng)
+        print(f"Generated {args.rows} rows against {len(hosted_zones)} hosted zones in {time.perf_counter() - started:.2f}s")
+
+        started = time.perf_counter()
+        legacy = legacy_compare(hosted_zones, csv_filename)
+        legacy_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        zone_index = zone_trie(hosted_zones)
+        mapped = sum(1 for _ in map_domains_to_zones(zone_index, csv_filename))
+        trie_seconds = time.perf_counter() - started
+
+        matched = compare_hosted_zone_with_csv(hosted_zones, csv_filename)
+
+        zone_names = [normalize_domain(zone.name) for zone in hosted_zones]
+        with open(csv_filename) as csv_file:
+            sample = [normalize_domain(row['domain_name']) for _, row in zip(range(args.naive_sample), csv.DictReader(csv_file))]
+        started = time.perf_counter()
+        for domain in sample:
+            naive_longest_match(domain, zone_names)
+        naive_seconds = (time.perf_counter() - started) * args.rows / max(len(sample), 1)
+
+        # The trie must agree with the linear scan on which zone each sampled domain falls under
+        for domain in sample:
+            zones = zone_index.longest_match(domain)
+            expected = naive_longest_match(domain, zone_names)
+            assert (normalize_domain(zones[0].name) if zones else None) == expected, domain
+
+    print(f"{'method':<24}{'seconds':>10}{'rows/s':>12}{'zones matched':>15}")
+    print(f"{'legacy exact match':<24}{legacy_seconds:>10.2f}{args.rows / legacy_seconds:>12.0f}{len(legacy):>15}")
+    print(f"{'suffix trie':<24}{trie_seconds:>10.2f}{args.rows / trie_seconds:>12.0f}{len(matched):>15}")
+    print(f"{'linear suffix scan (est)':<24}{naive_seconds:>10.2f}{args.rows / naive_seconds:>12.0f}{'':>15}")
+    print(f"Domains mapped to a hosted zone: {mapped}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import http.client
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from aws_collector import LoadBalancerReport, ResolutionReport
+from aws_inventory import InventoryStore, make_server
+from aws_output import open_writer
+from bench_output import make_rows
+
+
+def make_load_balancers():
+    # Every load balancer make_rows points at
+    for account in range(50):
+        account_id = str(100000000000 + account)
+        for n in range(900):
+            yield {
+                'AccountID': '',
+                'LoadBalancerArn': f'arn:aws:elasticloadbalancing:us-east-1:{account_id}:loadbalancer/net/lb{n}/{n:016x}',
+                'LoadBalancerName': f'lb{n}',
+                'DNSName': f'lb{n}-{account_id[-4:]}-{n:08x}.elb.us-east-1.amazonaws.com',
+                'Type': 'network'
+            }
+
+
+def percentiles(seconds):
+    seconds = sorted(seconds)
+    return [seconds[int(len(seconds) * fraction)] * 1e6 for fraction in (0.5, 0.99)]
+
+
+def time_queries(name, queries):
+    seconds = []
+    for query in queries:
+        started = time.perf_counter()
+        query()
+        seconds.append(time.perf_counter() - started)
+    p50, p99 = percentiles(seconds)
+    print(f"{name:<28}{len(seconds):>9}{p50:>11.1f}{p99:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time loading the exports into aws_inventory and querying it')
+    parser.add_argument('--rows', type=int, default=1000000, help='dns_resolution rows')
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--http-queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        resolution_path = os.path.join(workdir, ResolutionReport.filename)
+        load_balancer_path = os.path.join(workdir, LoadBalancerReport.filename)
+        with open_writer(resolution_path, ResolutionReport.fieldnames) as writer:
+            writer.writerows(make_rows(args.rows))
+        with open_writer(load_balancer_path, LoadBalancerReport.fieldnames) as writer:
+            writer.writerows(make_load_balancers())
+
+        db_path = os.path.join(workdir, 'inventory.db')
+        started = time.perf_counter()
+        InventoryStore(db_path).load([resolution_path, load_balancer_path])
+        print(f"Loaded {args.rows} records in {time.perf_counter() - started:.2f}s "
+              f"({os.path.getsize(db_path) / 1e6:.0f} MB)")
+
+        # What a freshly started server pays before its first answer
+        started = time.perf_counter()
+        store = InventoryStore(db_path)
+        store.open()
+        store.records('name', 'host0.zone0.a100000000000.example.com')
+        print(f"Opened and answered the first query in {(time.perf_counter() - started) * 1000:.2f} ms")
+
+        samples = [rng.randrange(args.rows) for _ in range(args.queries)]
+        wanted = set(samples)
+        rows = {n: row for n, row in enumerate(make_rows(args.rows)) if n in wanted}
+        print(f"{'query':<28}{'count':>9}{'p50 (us)':>11}{'p99 (us)':>11}")
+        time_queries('record by name', [lambda n=n: store.records('name', rows[n]['RecordName']) for n in samples])
+        time_queries('records by ARN (limit 100)', [lambda n=n: store.records('arn', rows[n]['TargetARN']) for n in samples])
+        time_queries('load balancer by DNS name', [lambda n=n: store.load_balancers('dns_name', rows[n]['FinalTarget']) for n in samples])
+        time_queries('name prefix (limit 10)', [lambda n=n: store.records('name', f'host{n}.', 'prefix', 10) for n in samples])
+        time_queries('zone suffix (limit 10)',
+                     [lambda n=n: store.records('name', rows[n]['HostedZoneName'], 'suffix', 10) for n in samples])
+        time_queries('behind', [lambda n=n: store.behind(rows[n]['RecordName']) for n in samples])
+
+        server = make_server(store, port=0, log_requests=False)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        # One kept-alive connection, as a client script would hold
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+
+        def get(path):
+            connection.request('GET', path)
+            return connection.getresponse().read()
+        time_queries('HTTP /behind', [
+            lambda n=n: get(f"/behind?name={urllib.parse.quote(rows[n]['RecordName'])}") for n in samples[:args.http_queries]
+        ])
+        connection.close()
+        server.shutdown()
+        server.server_close()
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import new
+from aws_clients import pool
+from synthetic_org import SyntheticOrg
+
+
+def legacy_lookup(org, clients, account_id, regions, dns_name):
+    # The per-record region scan new.py used before the load balancer index.
+    # Clients are cached here so the comparison only counts API calls.
+    for region in regions:
+        if (account_id, region) not in clients:
+            session = org.session_factory(profile_name=f'st-security-ro-{account_id}')
+            clients[(account_id, region)] = session.client('elbv2', region)
+        elbv2_client = clients[(account_id, region)]
+        for lb in elbv2_client.describe_load_balancers()['LoadBalancers']:
+            if dns_name == lb['DNSName'] + '.' or dns_name == 'dualstack.' + lb['DNSName'] + '.':
+                return lb['LoadBalancerArn']
+    return None
+
+
+def run_legacy(org, regions):
+    clients = {}
+    started = time.perf_counter()
+    for account_id in org.account_ids:
+        for zone in org.zones[account_id]:
+            for record in org.records[zone['Id'].split('/')[-1]]:
+                if record['Type'] in ['A', 'CNAME']:
+                    if 'ResourceRecords' in record:
+                        dns_name = record['ResourceRecords'][0]['Value']
+                    else:
+                        dns_name = record['AliasTarget']['DNSName']
+                    legacy_lookup(org, clients, account_id, regions, dns_name)
+    return time.perf_counter() - started
+
+
+def run_indexed(org, regions):
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, 'accounts.json'), 'w') as json_file:
+            json.dump([int(account_id) for account_id in org.account_ids], json_file)
+        with open(os.path.join(workdir, 'aws-region-names.json'), 'w') as json_file:
+            json.dump({'zones': [{'name': region, 'region': region} for region in regions]}, json_file)
+
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        started = time.perf_counter()
+        try:
+            pool.clear()
+            with mock.patch.object(pool, 'session_factory', org.session_factory), contextlib.redirect_stdout(io.StringIO()):
+                new.main([])
+        finally:
+            os.chdir(cwd)
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare ELBv2 API calls for per-record scans and the per-account index in new.py')
+    parser.add_argument('--accounts', type=int, default=5)
+    parser.add_argument('--zones', type=int, default=3)
+    parser.add_argument('--records', type=int, default=100)
+    parser.add_argument('--lbs', type=int, default=10)
+    parser.add_argument('--regions', type=int, default=16)
+    args = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aws-region-names.json')) as json_file:
+        regions = [zone['region'] for zone in json.load(json_file)['zones']][:args.regions]
+    account_ids = [f'{100000000000 + n}' for n in range(args.accounts)]
+
+    results = {}
+    for mode, runner in (('legacy', run_legacy), ('indexed', run_indexed)):
+        org = SyntheticOrg(account_ids, regions, args.zones, args.records, args.lbs)
+        elapsed = runner(org, regions)
+        results[mode] = org.total_calls('DescribeLoadBalancers')
+        print(f"{mode:8} describe_load_balancers calls: {results[mode]:>8}  wall: {elapsed:.2f}s")
+
+    print(f"API call reduction: {results['legacy'] / max(results['indexed'], 1):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
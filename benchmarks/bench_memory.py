@@ -0,0 +1,156 @@
+import argparse
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from aws_records import project_load_balancer, project_record, project_zone
+
+PAGE_SIZE = 300
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def parsed(value):
+    # A fresh copy of every string, the way each API response arrives
+    return json.loads(json.dumps(value))
+
+
+def make_load_balancers(account_id, region, count):
+    # Full DescribeLoadBalancers entries, as boto3 returns them
+    for n in range(count):
+        lb_type = 'network' if n % 3 == 0 else 'application'
+        name = f'lb{n}-{account_id[-4:]}'
+        lb = parsed({
+            'LoadBalancerArn': f'arn:aws:elasticloadbalancing:{region}:{account_id}:loadbalancer/{lb_type[:3]}/{name}/{n:016x}',
+            'DNSName': f'{name}-{n:08x}.{region}.elb.amazonaws.com',
+            'CanonicalHostedZoneId': 'Z35SXDOTRQ7X7K',
+            'LoadBalancerName': name,
+            'Scheme': 'internet-facing',
+            'VpcId': f'vpc-{account_id[-6:]}{n % 7}',
+            'State': {'Code': 'active'},
+            'Type': lb_type,
+            'AvailabilityZones': [
+                {'ZoneName': f'{region}{zone}', 'SubnetId': f'subnet-{n:08x}{zone}', 'LoadBalancerAddresses': []}
+                for zone in 'abc'
+            ],
+            'SecurityGroups': [f'sg-{n:08x}{group}' for group in range(2)],
+            'IpAddressType': 'ipv4'
+        })
+        lb['CreatedTime'] = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+        yield lb
+
+
+def make_records(zone_name, count, lb_names):
+    # ListResourceRecordSets pages for one zone, parsed page by page
+    page = []
+    for n in range(count):
+        name = f'host{n}.{zone_name}'
+        target = lb_names[n % len(lb_names)]
+        kind = n % 4
+        if kind == 0:
+            page.append({'Name': name, 'Type': 'A', 'AliasTarget': {
+                'HostedZoneId': 'Z35SXDOTRQ7X7K', 'DNSName': f'dualstack.{target}.', 'EvaluateTargetHealth': False
+            }})
+        elif kind == 1:
+            page.append({'Name': name, 'Type': 'CNAME', 'TTL': 300, 'ResourceRecords': [{'Value': target}]})
+        elif kind == 2:
+            page.append({'Name': name, 'Type': 'A', 'TTL': 300, 'ResourceRecords': [{'Value': f'10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}'}]})
+        else:
+            page.append({'Name': name, 'Type': 'TXT', 'TTL': 300, 'ResourceRecords': [{'Value': f'"v=spf1 include:{n}.example.net ~all"'}]})
+        if len(page) == PAGE_SIZE:
+            yield from parsed(page)
+            page = []
+    yield from parsed(page)
+
+
+def build_inventory(args, compact):
+    # What the collector holds for every account: the hosted zones with
+    # their records, and the load balancers of each region
+    zone_of = project_zone if compact else (lambda zone: zone)
+    record_of = project_record if compact else (lambda record: record)
+    lb_of = project_load_balancer if compact else (lambda lb: lb)
+
+    inventory = []
+    for a in range(args.accounts):
+        account_id = str(100000000000 + a)
+        regions = [f'us-test-{r}' for r in range(args.regions)]
+        load_balancers = [lb_of(lb) for region in regions for lb in make_load_balancers(account_id, region, args.lbs)]
+        lb_names = [lb.dns_name if compact else lb['DNSName'] for lb in load_balancers]
+        zones = []
+        for z in range(args.zones):
+            zone = parsed({'Id': f'/hostedzone/Z{account_id}{z:04d}', 'Name': f'zone{z}.a{account_id}.example.com.',
+                           'Config': {'PrivateZone': False}, 'ResourceRecordSetCount': args.records})
+            zones.append((zone_of(zone), [record_of(record) for record in make_records(zone['Name'], args.records, lb_names)]))
+        inventory.append((account_id, zones, load_balancers))
+    return inventory
+
+
+def run_child(args):
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    inventory = build_inventory(args, args.child == 'compact')
+    result = {
+        'seconds': round(time.perf_counter() - started, 2),
+        'records': sum(len(records) for _, zones, _ in inventory for _, records in zones),
+        'load_balancers': sum(len(load_balancers) for _, _, load_balancers in inventory),
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+    with open(args.result_file, 'w') as result_file:
+        json.dump(result, result_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the peak RSS of holding a crawl as raw API dicts and as the compact records of aws_records')
+    parser.add_argument('--accounts', type=int, default=10)
+    parser.add_argument('--zones', type=int, default=10, help='Hosted zones per account')
+    parser.add_argument('--records', type=int, default=2000, help='Records per hosted zone')
+    parser.add_argument('--lbs', type=int, default=50, help='Load balancers per region')
+    parser.add_argument('--regions', type=int, default=4)
+    parser.add_argument('--child', choices=['raw', 'compact'], help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    child_args = [f'--accounts={args.accounts}', f'--zones={args.zones}', f'--records={args.records}',
+                  f'--lbs={args.lbs}', f'--regions={args.regions}']
+    results = {}
+    print(f"{'representation':<16}{'records':>10}{'lbs':>8}{'build (s)':>11}{'peak RSS (MB)':>15}{'bytes/record':>14}")
+    # Each representation gets its own process so peak RSS is its own
+    for representation in ('raw', 'compact'):
+        with tempfile.NamedTemporaryFile(suffix='.json') as result_file:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', representation, '--result-file', result_file.name]
+                + child_args, capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                print(f"{representation} failed:\n{completed.stderr}")
+                return
+            with open(result_file.name) as saved:
+                result = results[representation] = json.load(saved)
+
+        held = (result['peak_rss_mb'] - result['baseline_rss_mb']) * 1024 * 1024
+        print(f"{representation:<16}{result['records']:>10}{result['load_balancers']:>8}{result['seconds']:>11.2f}"
+              f"{result['peak_rss_mb']:>15.1f}{held / max(result['records'], 1):>14.0f}")
+
+    print(f"Peak RSS reduction: {results['raw']['peak_rss_mb'] / results['compact']['peak_rss_mb']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
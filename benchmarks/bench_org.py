@@ -0,0 +1,237 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, REPO_DIR)
+
+SCRIPTS = ['new', 'aws_r53export', 'aws_nlbcheck', 'aws_loadbalancer', 'aws_networkACL', 'aws_collector']
+
+# The CSVs each script produces, used to count rows
+OUTPUTS = {
+    'new': ['output.csv'],
+    'aws_r53export': ['route53zones.csv'],
+    'aws_nlbcheck': ['nlb-waf-candidates.csv'],
+    'aws_loadbalancer': ['all_load_balancer.csv'],
+    'aws_networkACL': ['output.csv'],
+    'aws_collector': ['output.csv', 'all_load_balancer.csv', 'network_acls.csv', 'route53zones.csv']
+}
+
+
+def load_json(filename):
+    with open(os.path.join(REPO_DIR, filename)) as json_file:
+        return json.load(json_file)
+
+
+def org_inputs(accounts):
+    # The first `accounts` entries of the repo's own account lists, so the
+    # synthetic org has the same shape and profile names as the real one.
+    account_ids = [str(account_id) for account_id in load_json('accounts.json')[:accounts]]
+    named_accounts = [(name, str(account_id)) for name, account_id in load_json('aws_accounts.json')[:accounts]]
+    regions = [zone['region'] for zone in load_json('aws-region-names.json')['zones']]
+    return account_ids, named_accounts, regions
+
+
+def count_rows(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, newline='') as csv_file:
+        return max(sum(1 for _ in csv_file) - 1, 0)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_script(script, named_accounts, regions, workers):
+    if script == 'new':
+        import new
+        new.main(['--workers', str(workers)])
+    elif script == 'aws_r53export':
+        import aws_r53export
+        with mock.patch.object(aws_r53export, 'get_aws_profiles', return_value=[name for name, _ in named_accounts]):
+            aws_r53export.main(workers=workers)
+    elif script == 'aws_nlbcheck':
+        import aws_nlbcheck
+        aws_nlbcheck.main(['--workers', str(workers), '--regions', ','.join(regions)])
+    elif script == 'aws_loadbalancer':
+        import aws_loadbalancer
+        aws_loadbalancer.main(['--workers', str(workers)])
+    elif script == 'aws_networkACL':
+        import aws_networkACL
+        aws_networkACL.main(['--workers', str(workers)])
+    elif script == 'aws_collector':
+        import aws_collector
+        aws_collector.main(['--workers', str(workers)])
+
+
+def run_child(args):
+    # Runs one script in this process against the synthetic org and writes
+    # its measurements to args.result_file. Each script gets its own process
+    # so peak RSS is not carried over from the previous one.
+    sys.path.insert(0, BENCH_DIR)
+    from aws_clients import pool
+    from synthetic_org import SyntheticOrg
+
+    account_ids, named_accounts, regions = org_inputs(args.accounts)
+    org = SyntheticOrg(
+        account_ids + named_accounts, regions,
+        zones_per_account=args.zones, records_per_zone=args.records, lbs_per_region=args.lbs,
+        acls_per_region=args.acls, active_regions=args.active_regions
+    )
+    pool.session_factory = org.session_factory
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        with open('accounts.json', 'w') as json_file:
+            json.dump([int(account_id) for account_id in account_ids], json_file)
+        with open('aws_accounts.json', 'w') as json_file:
+            json.dump([list(account) for account in named_accounts], json_file)
+        with open('aws-region-names.json', 'w') as json_file:
+            json.dump({'zones': [{'name': region, 'region': region} for region in regions]}, json_file)
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            # aws_nlbcheck reads the export aws_r53export writes; produce it
+            # first and leave it out of the measurements
+            if args.child == 'aws_nlbcheck':
+                run_script('aws_r53export', named_accounts, regions, args.workers)
+                org.calls.clear()
+                pool.clear()
+
+            setup_rss = peak_rss_mb()
+            started = time.perf_counter()
+            run_script(args.child, named_accounts, regions, args.workers)
+            wall = time.perf_counter() - started
+
+        rows = sum(count_rows(path) for path in OUTPUTS[args.child])
+
+    result = {
+        'wall_seconds': round(wall, 4),
+        'api_calls': org.total_calls(),
+        'calls_by_operation': {},
+        'rows': rows,
+        'rows_per_second': round(rows / wall, 1) if wall else 0.0,
+        'setup_rss_mb': round(setup_rss, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+    for (_, _, operation), count in sorted(org.calls.items()):
+        result['calls_by_operation'][operation] = result['calls_by_operation'].get(operation, 0) + count
+
+    with open(args.result_file, 'w') as result_file:
+        json.dump(result, result_file)
+
+
+def git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def previous_result(config):
+    # The most recent saved run with the same org and worker settings
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')), reverse=True):
+        with open(path) as result_file:
+            result = json.load(result_file)
+        if result.get('config') == config:
+            return path, result
+    return None, None
+
+
+def compare(results, previous, threshold):
+    # Wall time and memory are noisy, so they only count past the threshold;
+    # API calls are deterministic against the synthetic org, so any increase counts.
+    regressions = []
+    for script, current in results.items():
+        before = previous.get(script)
+        if not before:
+            continue
+        for metric in ('wall_seconds', 'peak_rss_mb'):
+            if before[metric] and current[metric] > before[metric] * (1 + threshold):
+                regressions.append(f"{script}: {metric} {before[metric]} -> {current[metric]}")
+        if current['api_calls'] > before['api_calls']:
+            regressions.append(f"{script}: api_calls {before['api_calls']} -> {current['api_calls']}")
+        if current['rows'] != before['rows']:
+            regressions.append(f"{script}: rows {before['rows']} -> {current['rows']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the exporters end to end against a synthetic AWS organization')
+    parser.add_argument('--accounts', type=int, default=10, help='Accounts taken from accounts.json and aws_accounts.json')
+    parser.add_argument('--zones', type=int, default=3, help='Hosted zones per account')
+    parser.add_argument('--records', type=int, default=200, help='Records per hosted zone')
+    parser.add_argument('--lbs', type=int, default=5, help='Load balancers per active region')
+    parser.add_argument('--acls', type=int, default=4, help='Network ACLs per active region')
+    parser.add_argument('--active-regions', type=int, default=4, help='Regions per account that hold resources')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--scripts', default=','.join(SCRIPTS), help='Comma-separated scripts to run')
+    parser.add_argument('--label', default='', help='Saved with the results, e.g. a branch name')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown or memory growth reported as a regression')
+    parser.add_argument('--no-save', action='store_true', help=f'Do not write the results to {RESULTS_DIR}')
+    parser.add_argument('--child', choices=SCRIPTS, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    config = {
+        'accounts': args.accounts, 'zones': args.zones, 'records': args.records, 'lbs': args.lbs,
+        'acls': args.acls, 'active_regions': args.active_regions, 'workers': args.workers
+    }
+    child_args = [f'--{name.replace("_", "-")}={value}' for name, value in config.items()]
+
+    results = {}
+    print(f"{'script':<18}{'wall (s)':>10}{'api calls':>11}{'rows':>9}{'rows/s':>11}{'peak RSS (MB)':>15}")
+    for script in [script.strip() for script in args.scripts.split(',') if script.strip()]:
+        with tempfile.NamedTemporaryFile(suffix='.json') as result_file:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', script, '--result-file', result_file.name] + child_args,
+                capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                print(f"{script} failed:\n{completed.stderr}")
+                continue
+            with open(result_file.name) as saved:
+                results[script] = json.load(saved)
+
+        result = results[script]
+        print(f"{script:<18}{result['wall_seconds']:>10.2f}{result['api_calls']:>11}{result['rows']:>9}"
+              f"{result['rows_per_second']:>11.0f}{result['peak_rss_mb']:>15.1f}")
+
+    previous_path, previous = previous_result(config)
+    if previous:
+        regressions = compare(results, previous['results'], args.threshold)
+        print(f"\nCompared with {os.path.basename(previous_path)} ({previous.get('revision')}):")
+        for regression in regressions:
+            print(f"  REGRESSION {regression}")
+        if not regressions:
+            print("  no regressions")
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        revision = git_revision()
+        name = time.strftime('%Y%m%d-%H%M%S') + (f'-{args.label}' if args.label else '')
+        path = os.path.join(RESULTS_DIR, f'{name}.json')
+        with open(path, 'w') as saved:
+            json.dump({'revision': revision, 'label': args.label, 'config': config, 'results': results}, saved, indent=2)
+        print(f"\nSaved results to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aws_collector import ResolutionReport
+from aws_output import FORMATS, missing_dependency, open_writer, output_path, read_rows
+
+# The columns aws_nlbcheck.py-style consumers read out of a wide report
+READ_COLUMNS = ['RecordName', 'FinalTarget', 'TargetARN']
+
+
+def make_rows(count):
+    # dns_resolution.csv rows: long, repetitive names and a typed Depth column
+    for n in range(count):
+        account_id = str(100000000000 + n % 50)
+        zone = f'zone{n % 400}.a{account_id}.example.com.'
+        target = f'lb{n % 900}-{account_id[-4:]}-{n % 900:08x}.elb.us-east-1.amazonaws.com'
+        yield {
+            'AccountID': account_id,
+            'HostedZoneName': zone,
+            'RecordName': f'host{n}.{zone}',
+            'RecordType': 'A' if n % 2 else 'CNAME',
+            'Target': f'dualstack.{target}.',
+            'FinalTarget': target,
+            'Depth': 1 + n % 3,
+            'Status': 'resource',
+            'TargetType': 'elbv2',
+            'TargetARN': f'arn:aws:elasticloadbalancing:us-east-1:{account_id}:loadbalancer/net/lb{n % 900}/{n % 900:016x}'
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the size and read speed of the aws_output formats')
+    parser.add_argument('--rows', type=int, default=500000)
+    args = parser.parse_args()
+
+    print(f"{'format':<12}{'write (s)':>11}{'size (MB)':>11}{'read all (s)':>14}{'read 3 cols (s)':>17}{'rows/s':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for output_format in FORMATS:
+            if missing_dependency(output_format):
+                print(f"{output_format:<12}skipped: needs {missing_dependency(output_format)}")
+                continue
+            path = output_path(os.path.join(workdir, ResolutionReport.filename), output_format)
+
+            started = time.perf_counter()
+            with open_writer(path, ResolutionReport.fieldnames) as writer:
+                writer.writerows(make_rows(args.rows))
+            write_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            rows = sum(1 for _ in read_rows(path))
+            read_seconds = time.perf_counter() - started
+            assert rows == args.rows, (output_format, rows)
+
+            started = time.perf_counter()
+            for _ in read_rows(path, columns=READ_COLUMNS):
+                pass
+            columns_seconds = time.perf_counter() - started
+
+            print(f"{output_format:<12}{write_seconds:>11.2f}{os.path.getsize(path) / 1e6:>11.1f}{read_seconds:>14.2f}"
+                  f"{columns_seconds:>17.2f}{args.rows / columns_seconds:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
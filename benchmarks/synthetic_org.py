@@ -0,0 +1,242 @@
+import bisect
+import threading
+from collections import Counter
+
+from boto3.session import Session
+from botocore.awsrequest import AWSResponse
+
+DEFAULT_REGIONS = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2']
+
+
+def record_sort_key(name, record_type=''):
+    # Route53 orders record sets by name with the labels reversed, then by type.
+    return ('.'.join(reversed(name.rstrip('.').lower().split('.'))), record_type)
+
+
+class SyntheticOrg:
+    # Accounts are account ids or (profile name, account id) pairs, as in
+    # accounts.json and aws_accounts.json. Only the first `active_regions`
+    # regions of each account hold load balancers, VPCs and ACLs; the rest
+    # answer with empty listings like an unused region would.
+    def __init__(self, accounts, regions=None, zones_per_account=3, records_per_zone=50, lbs_per_region=5,
+                 acls_per_region=4, active_regions=None):
+        self.account_ids = []
+        self.profiles = {}
+        for account in accounts:
+            if isinstance(account, (list, tuple)):
+                self.profiles[account[0]] = str(account[1])
+                account = account[1]
+            if str(account) not in self.account_ids:
+                self.account_ids.append(str(account))
+
+        self.regions = regions or DEFAULT_REGIONS
+        active = self.regions if active_regions is None else self.regions[:active_regions]
+        self.zones = {}
+        self.records = {}
+        self.load_balancers = {}
+        self.network_acls = {}
+        self.instances = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+        for account_id in self.account_ids:
+            for region in self.regions:
+                in_use = region in active
+                self.load_balancers[(account_id, region)] = [
+                    self._make_load_balancer(account_id, region, n) for n in range(lbs_per_region if in_use else 0)
+                ]
+                self.network_acls[(account_id, region)] = [
+                    self._make_network_acl(account_id, region, n) for n in range(acls_per_region if in_use else 0)
+                ]
+                # Every other VPC runs instances
+                self.instances[(account_id, region)] = [
+                    {'InstanceId': f'i-{account_id[-6:]}{n:08x}', 'VpcId': acl['VpcId'], 'State': {'Name': 'running'}}
+                    for n, acl in enumerate(self.network_acls[(account_id, region)])
+                    if int(acl['VpcId'][-1]) % 2 == 0
+                ]
+
+            zones = []
+            for n in range(zones_per_account):
+                zone_id = f'/hostedzone/Z{account_id}{n:04d}'
+                zone_name = f'zone{n}.a{account_id}.example.com.'
+                zones.append({
+                    'Id': zone_id,
+                    'Name': zone_name,
+                    'CallerReference': zone_id,
+                    'Config': {'PrivateZone': False},
+                    'ResourceRecordSetCount': records_per_zone
+                })
+                self.records[zone_id.split('/')[-1]] = self._make_records(account_id, zone_name, records_per_zone)
+            self.zones[account_id] = zones
+
+    def _make_load_balancer(self, account_id, region, n):
+        lb_type = 'network' if n % 3 == 0 else 'application'
+        name = f'lb{n}-{account_id[-4:]}'
+        if lb_type == 'network':
+            dns_name = f'{name}-{n:08x}.elb.{region}.amazonaws.com'
+        else:
+            dns_name = f'{name}-{n:08x}.{region}.elb.amazonaws.com'
+        return {
+            'LoadBalancerArn': f'arn:aws:elasticloadbalancing:{region}:{account_id}:loadbalancer/{lb_type[:3]}/{name}/{n:016x}',
+            'DNSName': dns_name,
+            'LoadBalancerName': name,
+            'Scheme': 'internet-facing',
+            'Type': lb_type,
+            'VpcId': f'vpc-{account_id[-6:]}{region[-1]}',
+            'State': {'Code': 'active'}
+        }
+
+    def _make_network_acl(self, account_id, region, n):
+        return {
+            'NetworkAclId': f'acl-{account_id[-6:]}{region[-1]}{n:06x}',
+            'VpcId': f'vpc-{account_id[-6:]}{region[-1]}{n % 3}',
+            'IsDefault': n < 3,
+            'OwnerId': account_id,
+            'Associations': [],
+            'Entries': []
+        }
+
+    def _make_records(self, account_id, zone_name, count):
+        lb_names = [
+            lb['DNSName']
+            for region in self.regions
+            for lb in self.load_balancers[(account_id, region)]
+        ]
+        records = [
+            {'Name': zone_name, 'Type': 'SOA', 'TTL': 900, 'ResourceRecords': [{'Value': 'ns-1.awsdns-00.org. hostmaster. 1 7200 900 1209600 86400'}]},
+            {'Name': zone_name, 'Type': 'NS', 'TTL': 172800, 'ResourceRecords': [{'Value': 'ns-1.awsdns-00.org.'}]}
+        ]
+        for n in range(max(count - len(records), 0)):
+            name = f'host{n}.{zone_name}'
+            kind = n % 5
+            # Walk every load balancer, not just the ones whose index shares n's residue
+            target = lb_names[n // 5 % len(lb_names)] if lb_names else None
+            if kind == 0 and lb_names:
+                records.append({'Name': name, 'Type': 'A', 'AliasTarget': {
+                    'HostedZoneId': 'Z35SXDOTRQ7X7K',
+                    'DNSName': 'dualstack.' + target + '.',
+                    'EvaluateTargetHealth': False
+                }})
+            elif kind == 1 and lb_names:
+                records.append({'Name': name, 'Type': 'CNAME', 'TTL': 300, 'ResourceRecords': [{'Value': target}]})
+            elif kind == 2:
+                records.append({'Name': name, 'Type': 'CNAME', 'TTL': 300, 'ResourceRecords': [{'Value': f'target{n}.example.net'}]})
+            elif kind == 3:
+                records.append({'Name': name, 'Type': 'A', 'TTL': 300, 'ResourceRecords': [{'Value': f'10.0.{n // 250 % 250}.{n % 250}'}]})
+            else:
+                records.append({'Name': name, 'Type': 'TXT', 'TTL': 300, 'ResourceRecords': [{'Value': f'"v=spf1 include:{n}.example.net ~all"'}]})
+        records.sort(key=lambda record: record_sort_key(record['Name'], record['Type']))
+        return records
+
+    def account_for_profile(self, profile_name):
+        profile_name = profile_name or ''
+        if profile_name in self.profiles:
+            return self.profiles[profile_name]
+        for account_id in self.account_ids:
+            if profile_name.endswith(account_id):
+                return account_id
+        return profile_name
+
+    def session_factory(self, profile_name=None, **kwargs):
+        session = Session(
+            aws_access_key_id='synthetic',
+            aws_secret_access_key='synthetic',
+            region_name=kwargs.get('region_name') or 'us-east-1'
+        )
+        account_id = self.account_for_profile(profile_name)
+
+        def capture_params(params, context, **_):
+            context['synthetic_params'] = dict(params)
+
+        def respond(model, context, **_):
+            region = context.get('client_region')
+            return self.handle(account_id, region, model.name, context.get('synthetic_params', {}))
+
+        session.events.register('before-parameter-build', capture_params)
+        session.events.register('before-call', respond)
+        return session
+
+    def handle(self, account_id, region, operation, params):
+        with self._lock:
+            self.calls[(account_id, region, operation)] += 1
+
+        handler = getattr(self, f'_handle_{operation}', None)
+        if handler is None:
+            return AWSResponse('https://synthetic', 200, {}, None), {}
+        return AWSResponse('https://synthetic', 200, {}, None), handler(account_id, region, params)
+
+    def _handle_ListHostedZones(self, account_id, region, params):
+        zones = self.zones.get(account_id, [])
+        start = int(params.get('Marker') or 0)
+        page_size = int(params.get('MaxItems') or 100)
+        page = zones[start:start + page_size]
+        response = {'HostedZones': page, 'IsTruncated': start + page_size < len(zones), 'MaxItems': str(page_size), 'Marker': params.get('Marker', '')}
+        if response['IsTruncated']:
+            response['NextMarker'] = str(start + page_size)
+        return response
+
+    def _handle_ListResourceRecordSets(self, account_id, region, params):
+        records = self.records.get(params['HostedZoneId'].split('/')[-1], [])
+        start = 0
+        if params.get('StartRecordName'):
+            keys = [record_sort_key(record['Name'], record['Type']) for record in records]
+            start = bisect.bisect_left(keys, record_sort_key(params['StartRecordName'], params.get('StartRecordType', '')))
+        page_size = int(params.get('MaxItems') or 300)
+        page = records[start:start + page_size]
+        response = {'ResourceRecordSets': page, 'IsTruncated': start + page_size < len(records), 'MaxItems': str(page_size)}
+        if response['IsTruncated']:
+            response['NextRecordName'] = records[start + page_size]['Name']
+            response['NextRecordType'] = records[start + page_size]['Type']
+        return response
+
+    def _handle_DescribeLoadBalancers(self, account_id, region, params):
+        load_balancers = self.load_balancers.get((account_id, region), [])
+        start = int(params.get('Marker') or 0)
+        page_size = int(params.get('PageSize') or 400)
+        response = {'LoadBalancers': load_balancers[start:start + page_size]}
+        if start + page_size < len(load_balancers):
+            response['NextMarker'] = str(start + page_size)
+        return response
+
+    def _filtered(self, items, params, fields):
+        for item in items:
+            matched = True
+            for query_filter in params.get('Filters', []):
+                field = fields.get(query_filter['Name'])
+                if field and item.get(field) not in query_filter['Values']:
+                    matched = False
+            if matched:
+                yield item
+
+    def _handle_GetCallerIdentity(self, account_id, region, params):
+        return {'Account': account_id, 'Arn': f'arn:aws:sts::{account_id}:assumed-role/synthetic/synthetic', 'UserId': 'synthetic'}
+
+    def _handle_DescribeRegions(self, account_id, region, params):
+        return {'Regions': [{'RegionName': name, 'OptInStatus': 'opt-in-not-required'} for name in self.regions]}
+
+    def _handle_DescribeNetworkAcls(self, account_id, region, params):
+        acls = self.network_acls.get((account_id, region), [])
+        if params.get('NetworkAclIds'):
+            acls = [acl for acl in acls if acl['NetworkAclId'] in params['NetworkAclIds']]
+        acls = list(self._filtered(acls, params, {'network-acl-id': 'NetworkAclId', 'vpc-id': 'VpcId'}))
+        start = int(params.get('NextToken') or 0)
+        page_size = int(params.get('MaxResults') or len(acls) or 1)
+        response = {'NetworkAcls': acls[start:start + page_size]}
+        if start + page_size < len(acls):
+            response['NextToken'] = str(start + page_size)
+        return response
+
+    def _handle_DescribeInstances(self, account_id, region, params):
+        instances = list(self._filtered(self.instances.get((account_id, region), []), params, {'vpc-id': 'VpcId'}))
+        start = int(params.get('NextToken') or 0)
+        page_size = int(params.get('MaxResults') or len(instances) or 1)
+        response = {'Reservations': [
+            {'ReservationId': f"r-{instance['InstanceId'][2:]}", 'Instances': [instance]}
+            for instance in instances[start:start + page_size]
+        ]}
+        if start + page_size < len(instances):
+            response['NextToken'] = str(start + page_size)
+        return response
+
+    def total_calls(self, operation=None):
+        return sum(count for (_, _, op), count in self.calls.items() if operation in (None, op))
@@ -1,7 +1,17 @@
-import boto3
-import csv
+import argparse
 import json
 
+from aws_cache import add_cache_arguments, cache, open_cache
+from aws_cassette import add_cassette_arguments, cassette, open_cassette
+from aws_clients import pool
+from aws_collector import Account, RecordsReport, ResolutionReport, collect
+from aws_credentials import add_credentials_arguments, credentials, open_credentials
+from aws_fanout import add_workers_argument
+from aws_metrics import add_metrics_arguments, write_run_metrics
+from aws_output import add_output_arguments, output_path
+from aws_regions import add_region_map_arguments, open_region_map, region_map
+from aws_snapshot import add_snapshot_max_age_argument, open_snapshot
+
 def get_account_ids_from_json(json_filename):
     with open(json_filename, 'r') as json_file:
         data = json.load(json_file)
@@ -30,118 +40,70 @@ def import_aws_zones_from_json(json_file_path):
         return None
     
 
-def list_hosted_zones(account_id):
-    session = boto3.session.Session(profile_name=f'st-security-ro-{account_id}')
-    route53_client = session.client('route53')
-
-    try:
-        response = route53_client.list_hosted_zones()
-        return response['HostedZones']
-    
-    except Exception as e:
-        print(f"Error listing the hosted Zone: {e}")
-        return None
-
-
-def list_resource_record_sets(account_id, hosted_zone_id):
-    session = boto3.session.Session(profile_name=f'st-security-ro-{account_id}')
-    route53_client = session.client('route53')
-
-    try:
-        response = route53_client.list_resource_record_sets(HostedZoneId=hosted_zone_id)
-        return response
-
-    
-    except Exception as e:
-        # print(f"Error listing resource record set: {e} {account_id}")
-        return None
-    
-    
-def get_load_balancer_arn_for_dns_name(account_id, dns_name):
-    json_file_path = 'aws-region-names.json'
-
-    regions = import_aws_zones_from_json(json_file_path)
+def get_profile_name(account_id):
+    return f'st-security-ro-{account_id}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export Route53 A/CNAME records with their load balancer ARNs')
+    add_workers_argument(parser)
+    parser.add_argument('--snapshot', default='output.snapshot.db',
+                        help='SQLite snapshot used to skip unchanged hosted zones (default: output.snapshot.db)')
+    parser.add_argument('--no-snapshot', action='store_true', help='List every zone and do not read or update the snapshot')
+    parser.add_argument('--full', action='store_true', help='Re-list every zone and refresh the snapshot')
+    add_snapshot_max_age_argument(parser)
+    parser.add_argument('--resolve', action='store_true',
+                        help='Also follow CNAME and alias chains across all accounts into output.resolution.csv')
+    parser.add_argument('--restart', action='store_true', help='Ignore an interrupted run and start from the first account')
+    add_output_arguments(parser)
+    add_cache_arguments(parser)
+    add_cassette_arguments(parser)
+    add_credentials_arguments(parser)
+    add_region_map_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    open_cache(args.cache, args.no_cache, args.refresh)
+    open_cassette(args.record, args.replay, args.replay_latency)
+    open_region_map(args.region_map, args.no_region_map, args.all_regions)
 
-    for region in regions:
-        session = boto3.session.Session(profile_name=f'st-security-ro-{account_id}')
-        elbv2_client = session.client('elbv2', region)
-
-        try:
-            response = elbv2_client.describe_load_balancers()
-            load_balancers = response['LoadBalancers']
-            for lb in load_balancers:
-                if dns_name==lb['DNSName'] + '.':
-                    return lb['LoadBalancerArn']
-                elif dns_name=='dualstack.' + lb['DNSName'] + '.':
-                    return lb['LoadBalancerArn']
-
-        except Exception as e:
-            print(f"Error describing load balancers: {e}")
-            return None
-
-def export_to_csv(data, csv_filename):
-    if not data:
-        print("No data to export.")
-        return
-    
-    with open(csv_filename, 'w', newline='') as csvfile:
-        fieldnames = data[0].keys()
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
-        writer.writeheader()
-        for entry in data:
-            writer.writerow(entry)
-
-        print(f"Data exported to {csv_filename}")
-
-
-    
-def main():
     json_filename = 'accounts.json'
-    csv_filename = 'output.csv'
+    csv_filename = output_path('output.csv', args.output_format)
+    delta_filename = output_path('output.delta.csv', args.output_format)
 
     account_ids = get_account_ids_from_json(json_filename)
-    all_entries = []
-
-    for account_id in account_ids:
-        hosted_zones = list_hosted_zones(account_id)
+    regions = import_aws_zones_from_json('aws-region-names.json') or []
+    snapshot = open_snapshot(args.snapshot, args.no_snapshot, args.snapshot_max_age)
 
-        if hosted_zones:
-            for zone in hosted_zones:
-                hosted_zone_id = zone['Id']
-                records = list_resource_record_sets(account_id, hosted_zone_id)
+    # A view over the collector: only the records report, for accounts.json
+    accounts = [Account(account_id, get_profile_name(account_id)) for account_id in account_ids]
+    if not open_credentials([account.profile for account in accounts], args.sso_login):
+        return
+    report = RecordsReport(regions, filename=csv_filename)
+    reports = [report]
+    if args.resolve:
+        reports.append(ResolutionReport(regions, filename=output_path('output.resolution.csv', args.output_format), workers=args.workers))
+    finished, delta_writer = collect(accounts, reports, args.workers, 'new.journal', args.restart, snapshot, args.full,
+                                     delta_filename)
 
-                if records: 
-                    for record in records['ResourceRecordSets']:
-                        # print(record)
-                        Name = record['Name']
-                        record_type = record['Type']
+    write_run_metrics('new', args.metrics_dir, args.profile_report)
 
-                        if record_type in ['A', 'CNAME']:
-                            value = None
+    if not finished:
+        return
 
-                            if 'ResourceRecords' in record:
-                                value = record['ResourceRecords'][0]['Value']
+    print(f"Exported {report.writer.rows_written} records to {csv_filename}")
+    for resolution_report in reports[1:]:
+        print(f"Exported {resolution_report.writer.rows_written} resolved records to {resolution_report.filename}")
 
-                            elif 'AliasTarget' in record:
-                                value = record['AliasTarget']['DNSName']
-                            
-                            dns_name = value
-                            # print(dns_name)
-                            lb_arns = get_load_balancer_arn_for_dns_name(account_id, dns_name)
-                            
+    if snapshot is not None:
+        print(f"Exported {delta_writer.rows_written} record changes to {delta_filename}")
+        snapshot.print_stats()
+        snapshot.close()
 
-                            entry = {
-                                'AccountID': account_id,
-                                'HostedZoneName': zone['Name'],
-                                'RecordName': dns_name,
-                                'RecordType': record['Type'],
-                                'LoadBalancerARNs': lb_arns
-                            }
-                            print(entry)
-                            all_entries.append(entry)
-        export_to_csv(all_entries, csv_filename)
+    pool.print_stats()
+    cache.print_stats()
+    cassette.print_stats()
+    credentials.print_stats()
+    region_map.print_stats()
     
 if __name__ == "__main__":
-    main()        
-
+    main()